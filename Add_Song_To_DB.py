@@ -1,23 +1,31 @@
 import os
-import subprocess
+import sys
+import argparse
 
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-import firebase_admin
-from firebase_admin import credentials, firestore
 from spotipy.oauth2 import SpotifyClientCredentials
 
+from Catalog import status_flags
+from Create_Main_Genre import derive_main_genre
+from Firebase_Setup import db
+from Firestore_Writer import BatchedWriter, set_if_absent
+from Id_Cache import IdCache
+from Incremental_Scan import touch
+from Metrics import job_run
+from Pipeline_Runner import run_post_upload_pipeline
+from Spotify_Client import create_spotify
+
 """
-This script allows you to upload metadata about a Spotify track to Firebase Firestore.
+This script allows you to upload metadata about Spotify tracks to Firebase Firestore.
 
 Workflow:
-1. Prompt the user to input a Spotify track URL.
+1. Read Spotify URLs: interactively, one track URL at a time, or with `--batch` from a file of
+   track/album/playlist URLs (see "Batch mode" below).
 2. Use the Spotify Web API to extract metadata (title, artist, duration, album art).
-3. Create or retrieve artist and genre documents in Firestore.
+3. Create missing artist and genre documents in Firestore (one `get_all` + one batched write, see `Firestore_Writer.py`).
 4. Add a new document to the "songs" collection, including:
    - Title, artist reference, genre references, duration, artwork, and more.
-5. After all uploads, run auxiliary scripts:
+5. After all uploads, run the auxiliary jobs in-process (see `Pipeline_Runner.py`):
    - `System_Playlists_Update.py`: updates system playlists.
    - `Songs_With_No_MP3_List.py`: generates a report of missing MP3s.
    - `Lyrics_Fill_Batch.py`: fills lyrics for the newly added songs.
@@ -27,6 +35,18 @@ Technologies used:
 - Firebase Admin SDK for Firestore
 - `.env` file for managing sensitive credentials
 
+Batch mode:
+- `python Add_Song_To_DB.py --batch urls.txt` (or `--batch -` for stdin) reads track/album/playlist URLs,
+  one per line, and resolves them in chunks through the multi-ID endpoints (`tracks`, `artists`).
+- Artist lookups are de-duplicated across the whole batch, so a batch of N tracks costs roughly
+  N/50 track calls plus (unique artists)/50 artist calls instead of 3*N single calls.
+- Songs are keyed by their title, so when two tracks of one batch share a title only the first is
+  written; each later one is reported as a skipped duplicate and counted as failed.
+
+Spotify calls go through `Spotify_Client.py`: a shared rate limiter that honors `Retry-After`,
+and a persistent cache of track and artist objects, so re-importing known tracks or artists
+costs no Spotify requests. Hit/miss/throttle counts are printed at the end of each run.
+
 Notes:
 - `audioUrl` is currently left empty – to be filled manually or in a later step.
 - Lyrics and genres are fetched where possible.
@@ -36,119 +56,228 @@ Notes:
 # Load environment variables from .env file
 load_dotenv()
 
-# Init Spotify clients
-auth_manager = SpotifyOAuth(
-    client_id=os.getenv("SPOTIPY_CLIENT_ID"),
-    client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
-    redirect_uri=os.getenv("SPOTIPY_REDIRECT_URI"),
-    scope="user-library-read"
-)
-sp = spotipy.Spotify(auth_manager=auth_manager)
-
-# Use client credentials for genre and artist info
-sp_client = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
+# Init the Spotify client (client credentials: all lookups are public catalog data)
+spotify = create_spotify(SpotifyClientCredentials(
     client_id=os.getenv("SPOTIPY_CLIENT_ID"),
     client_secret=os.getenv("SPOTIPY_CLIENT_SECRET")
 ))
 
-# Initialize Firebase Admin SDK
-cred = credentials.Certificate(r"C:\Users\Yinon\PycharmProjects\QueueMue_Adding_Songs_To_DB\queuemueue-firebase-admin.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
-
-# Genre ID cache to avoid duplicates
-genre_cache = {}
+# Persistent cache of known artist/genre IDs (see Id_Cache.py)
+id_cache = IdCache()
 
 # Generates a Firestore-safe ID from a name (uppercase, underscores instead of spaces)
 def safe_id(name):
     return name.strip().replace(" ", "_").upper()
 
-# Gets or creates a document in a collection using a normalized name-based ID
-def get_or_create_named_document(collection_name, name_field, name_value):
-    doc_id = safe_id(name_value)
-    doc_ref = db.collection(collection_name).document(doc_id)
-    if not doc_ref.get().exists:
-        doc_ref.set({name_field: name_value})
-    return doc_id
-
-# Fetches Spotify genres for a track and returns a list of genre document IDs (creating them if needed)
-def get_or_create_genre_ids(track_id):
+# Fetches the Spotify genres of an artist (the track's main artist, see `track_to_info`)
+def get_artist_genres(artist_id):
     try:
-        track = sp_client.track(track_id)
-        artist_id = track["artists"][0]["id"]
-        artist = sp_client.artist(artist_id)
-        genres = artist.get("genres", [])
-        genre_ids = []
-
-        for g in genres:
-            g_lower = g.lower()
-            if g_lower in genre_cache:
-                genre_ids.append(genre_cache[g_lower])
-            else:
-                genre_id = safe_id(g)
-                ref = db.collection("genres").document(genre_id)
-                if not ref.get().exists:
-                    ref.set({"name": g})
-                genre_cache[g_lower] = genre_id
-                genre_ids.append(genre_id)
-
-        return genre_ids
+        return spotify.artist(artist_id).get("genres", [])
     except Exception as e:
         print(f"⚠️ Failed to get genres: {e}")
         return []
 
-#  Extract track metadata from Spotify
-def extract_basic_info(url):
-    track_id = url.split("/")[-1].split("?")[0]
-    print("🎯 Track ID:", track_id)
-
-    track = sp.track(track_id, market="IL")
-    artist_name = track["artists"][0]["name"]
-
+# Returns genre document IDs for a list of genre names
+def resolve_genre_ids(genres):
+    return [safe_id(g) for g in genres]
+
+# Queues artist and genre documents for the given songs, creating only the ones missing in Firestore
+# (one `get_all` for the whole batch instead of a get/set round-trip per document)
+def queue_artists_and_genres(writer, song_infos):
+    items = []
+    for info in song_infos:
+        names = [("artists", info["artist"])] + [("genres", g) for g in info["genres"]]
+        for collection_name, name in names:
+            doc_id = safe_id(name)
+            if not id_cache.contains(collection_name, doc_id):
+                items.append((db.collection(collection_name).document(doc_id), {"name": name}))
+
+    set_if_absent(writer, items)
+
+    # Queued documents count as known; failed writes are removed again by the writer's error callback
+    for ref, _ in items:
+        id_cache.add(ref.parent.id, ref.id)
+
+# Builds the song info dict from a Spotify track object
+def track_to_info(track, url):
     return {
-        "track_id": track_id,
+        "track_id": track["id"],
         "title": track["name"],
-        "artist": artist_name,
+        "artist": track["artists"][0]["name"],
+        "artist_id": track["artists"][0]["id"],
         "duration": int(track["duration_ms"] / 1000),
         "url": url,
         "cover": track["album"]["images"][0]["url"] if track["album"]["images"] else "",
         "audioUrl": ""
     }
 
-# Upload a song document to Firestore
-def upload_song(song_data):
+#  Extract track metadata from Spotify
+def extract_basic_info(url):
+    track_id = url.split("/")[-1].split("?")[0]
+    print("🎯 Track ID:", track_id)
+
+    track = spotify.track(track_id, market="IL")
+    return track_to_info(track, url)
+
+# Splits a Spotify URL or URI into (kind, id), e.g. ("album", "4aawyAB9vmqN3uQ7FjRGTy")
+def parse_spotify_url(url):
+    url = url.strip()
+    if url.startswith("spotify:"):
+        parts = url.split(":")
+        return parts[1], parts[2]
+
+    path = url.split("?")[0].rstrip("/").split("/")
+    for kind in ("track", "album", "playlist"):
+        if kind in path:
+            return kind, path[path.index(kind) + 1]
+    raise ValueError(f"Unsupported Spotify URL: {url}")
+
+# Resolves track/album/playlist URLs into a de-duplicated, ordered list of track IDs
+def collect_track_ids(urls):
+    track_ids = []
+    seen = set()
+
+    def add(track_id):
+        if track_id and track_id not in seen:
+            seen.add(track_id)
+            track_ids.append(track_id)
+
+    for url in urls:
+        try:
+            kind, item_id = parse_spotify_url(url)
+        except ValueError as e:
+            print(f"❌ {e}")
+            continue
+
+        if kind == "track":
+            add(item_id)
+        elif kind == "album":
+            page = spotify.album_tracks(item_id, limit=50)
+            while page:
+                for item in page["items"]:
+                    add(item.get("id"))
+                page = spotify.next(page) if page.get("next") else None
+        elif kind == "playlist":
+            page = spotify.playlist_items(item_id, fields="items(track(id,type)),next",
+                                          additional_types=("track",), limit=100)
+            while page:
+                for item in page["items"]:
+                    track = item.get("track")
+                    if track and track.get("type") == "track":
+                        add(track.get("id"))
+                page = spotify.next(page) if page.get("next") else None
+
+    return track_ids
+
+# Fetches full track objects for many IDs (50 per request, cached tracks are not requested)
+def fetch_tracks_batched(track_ids):
+    tracks = []
+    for track_id, track in zip(track_ids, spotify.tracks(track_ids, market="IL")["tracks"]):
+        if track:
+            tracks.append(track)
+        else:
+            print(f"⚠️ Track not found on Spotify: {track_id}")
+    return tracks
+
+# Fetches genres for many artists (50 per request), looking up each artist only once
+def fetch_artist_genres_batched(artist_ids):
+    artist_ids = list(dict.fromkeys(artist_ids))
+    return {artist["id"]: artist.get("genres", [])
+            for artist in spotify.artists(artist_ids)["artists"] if artist}
+
+# Resolves a batch of URLs into song info dicts with genres already attached
+def extract_batch_info(urls):
+    track_ids = collect_track_ids(urls)
+    print(f"🎯 Resolved {len(track_ids)} unique tracks from {len(urls)} URLs")
+
+    tracks = fetch_tracks_batched(track_ids)
+    genres_by_artist = fetch_artist_genres_batched([t["artists"][0]["id"] for t in tracks])
+    print(f"🎤 Fetched genres for {len(genres_by_artist)} unique artists")
+
+    infos = []
+    for track in tracks:
+        info = track_to_info(track, track["external_urls"].get("spotify", ""))
+        info["genres"] = genres_by_artist.get(track["artists"][0]["id"], [])
+        infos.append(info)
+    return infos
+
+# Builds the Firestore document for a song
+def build_song_doc(song_data):
     artist_name = song_data["artist"]
-    artist_id = get_or_create_named_document("artists", "name", artist_name)
-    genre_ids = get_or_create_genre_ids(song_data["track_id"])
 
     # Normalize titles
     original_title = song_data["title"]
     title_upper = original_title.strip().upper()
     title_lower = original_title.strip().lower()
 
-    song_id = safe_id(original_title)
-    doc_ref = db.collection("songs").document(song_id)
-
-    doc = {
+    song_doc = touch({
         "title": title_upper,
         "title_lower": title_lower,
-        "artistId": artist_id,
+        "artistId": safe_id(artist_name),
         "artistName": artist_name,
         "artist_lower": artist_name.strip().lower(),
-        "genreId": genre_ids,
+        "genreId": resolve_genre_ids(song_data["genres"]),
         "lyrics": "",
         "url": song_data["url"],
         "duration": song_data["duration"],
         "cover": song_data["cover"],
         "audioUrl": song_data["audioUrl"]
-    }
+    })
+    main_genre = derive_main_genre(song_doc["genreId"])
+    if main_genre is not None:
+        song_doc["mainGenre"] = main_genre
+    song_doc.update(status_flags(song_doc))
+    return song_doc
+
+# Upload songs (with their artists and genres) to Firestore through batched writes; returns the song IDs written.
+# A song whose document, artist or genre write failed is reported as failed and left out.
+def upload_songs(song_infos, flush_size=400):
+    for info in song_infos:
+        if "genres" not in info:
+            info["genres"] = get_artist_genres(info["artist_id"])
+
+    writer = BatchedWriter(db, flush_size=flush_size, on_error=id_cache.invalidate_ref)
+    queue_artists_and_genres(writer, song_infos)
+
+    song_refs = []
+    queued_ids = set()
+    for info in song_infos:
+        doc_ref = db.collection("songs").document(safe_id(info["title"]))
+        if doc_ref.id in queued_ids:
+            # Same title as an earlier song of this batch: writing it would overwrite that song
+            print(f'❌ "{info["title"].strip().upper()}" by {info["artist"]} skipped: '
+                  f'another song in this batch already uses the ID {doc_ref.id}')
+            continue
+        queued_ids.add(doc_ref.id)
+        writer.set(doc_ref, build_song_doc(info))
+        song_refs.append((info, doc_ref))
+
+    writer.flush()
+    id_cache.save()
+    failed_paths = {path for path, _ in writer.errors}
+
+    uploaded_song_ids = []
+    for info, doc_ref in song_refs:
+        related = [f"artists/{safe_id(info['artist'])}"] + [f"genres/{safe_id(g)}" for g in info["genres"]]
+        failed = [path for path in [doc_ref.path] + related if path in failed_paths]
+        if failed:
+            print(f'❌ "{info["title"].strip().upper()}" failed: could not write {", ".join(failed)}')
+            continue
+        print(f'✅ "{info["title"].strip().upper()}" uploaded successfully under ID: {doc_ref.id}')
+        uploaded_song_ids.append(doc_ref.id)
 
-    doc_ref.set(doc)
-    print(f'✅ "{title_upper}" uploaded successfully under ID: {song_id}\n')
+    return uploaded_song_ids
+
+# Upload a song document to Firestore
+def upload_song(song_data):
+    if not upload_songs([song_data]):
+        raise RuntimeError(f'Firestore write failed for "{song_data["title"]}"')
+    print()
 
 # CLI loop to upload songs and run post-upload scripts
 def main():
     print("🎧 Upload basic song info from Spotify to Firestore")
+    id_cache.warm(db)
     print("Paste a Spotify track URL (or type 'exit' to quit):\n")
 
     uploaded_song_ids = []  # We will track uploaded songs
@@ -177,19 +306,60 @@ def main():
         except Exception as e:
             print(f"❌ Failed to upload: {e}\n")
 
-    if uploaded_song_ids:
-        print("\n📦 Running post-upload tasks...")
+    spotify.print_metrics()
+    run_post_upload_tasks(uploaded_song_ids)
 
-        # Convert to string format to send as parameter
-        song_ids_string = ",".join(uploaded_song_ids)
+# Non-interactive mode: upload every track referenced by the URLs in a file (or stdin when path is "-")
+def batch_main(path, flush_size=400):
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        urls = [line.strip() for line in source if line.strip() and not line.startswith("#")]
+    finally:
+        if source is not sys.stdin:
+            source.close()
 
-        venv_python = r"C:\Users\yinon\PycharmProjects\quemueFirestoreAddSongs\venv\Scripts\python.exe"
-        subprocess.run([venv_python, "System_Playlists_Update.py"])
-        subprocess.run([venv_python, "Songs_With_No_MP3_List.py"])
-        subprocess.run([venv_python, "Lyrics_Fill_Batch.py", song_ids_string])
+    print(f"🎧 Batch upload of {len(urls)} Spotify URLs to Firestore")
+    id_cache.warm(db)
+    uploaded_song_ids = []
+
+    try:
+        infos = extract_batch_info(urls)
+    except Exception as e:
+        print(f"❌ Failed to extract batch info: {e}\n")
+        return
+
+    try:
+        uploaded_song_ids = upload_songs(infos, flush_size=flush_size)
+    except Exception as e:
+        print(f"❌ Failed to upload batch: {e}\n")
+
+    print(f"\n📊 Uploaded {len(uploaded_song_ids)}/{len(infos)} songs.")
+    spotify.print_metrics()
+    run_post_upload_tasks(uploaded_song_ids)
+
+# Run auxiliary scripts for the songs uploaded in this session
+def run_post_upload_tasks(uploaded_song_ids):
+    if uploaded_song_ids:
+        print("\n📦 Running post-upload tasks...")
+        run_post_upload_pipeline(uploaded_song_ids)
 
     print("✅ All post-upload tasks completed.")
 
-# Main Execution
+# Command-line entry point (`python Add_Song_To_DB.py` or `python QueueMue_CLI.py ingest`)
+def cli(argv=None, prog=None):
+    spotify.prune()
+    parser = argparse.ArgumentParser(prog=prog, description="Upload Spotify track metadata to Firestore")
+    parser.add_argument("--batch", metavar="PATH",
+                        help="file with one track/album/playlist URL per line ('-' for stdin)")
+    parser.add_argument("--flush-size", type=int, default=400,
+                        help="number of Firestore writes committed per batch (max 500)")
+    args = parser.parse_args(argv)
+
+    with job_run("ingest"):
+        if args.batch:
+            batch_main(args.batch, flush_size=args.flush_size)
+        else:
+            main()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
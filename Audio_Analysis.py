@@ -0,0 +1,339 @@
+"""
+Audio analysis helpers shared by the BPM scripts.
+
+This module is kept free of Firebase imports so it can be imported cheaply by the
+`ProcessPoolExecutor` workers in `BPM_Update.py` (each worker process imports it on startup).
+
+Features:
+- `extract_features(source)` decodes an MP3 (raw bytes or a local file path) once and computes every
+  registered audio feature from that one signal:
+  - `tempo`: `bpm`, `bpmConfidence` (0-1) and `beats` (beat times in seconds, from the start of the track)
+  - `key`: `key` ("C" ... "B"), `mode` ("major"/"minor"), `keyConfidence` and the mean `chroma` vector
+  - `loudness`: `loudnessDb` (RMS level in dBFS), `energy` (mean frame RMS) and `dynamicRangeDb`
+  - `onsets`: `onsetDensity` (note onsets per second)
+  - `envelope`: `envelope`, the peak amplitude of the analysis window in `ENVELOPE_POINTS` steps
+- `calculate_bpm(source)` estimates only the tempo.
+- Audio is decoded straight from memory (bytes) or from a memory-mapped file, never via a temp copy,
+  as long as the installed libsndfile can decode MP3 (libsndfile >= 1.1). Otherwise it falls back
+  to a temporary file so `librosa` can use its `audioread` backend.
+- Only an analysis window is decoded (by default the middle `ANALYSIS_WINDOW_SECONDS` of the track),
+  downmixed to mono and resampled to `ANALYSIS_SAMPLE_RATE`.
+
+Shared analysis:
+- `Signal` holds the decoded samples and computes the magnitude STFT, onset strength envelope and
+  tempogram on first use, so every feature built on them reuses the same arrays (the tempo comes from
+  the same computations `librosa.beat.beat_track(y=...)` runs internally, so it is unchanged).
+- A new attribute is one more function in `FEATURE_EXTRACTORS`; bump `FEATURES_VERSION` so
+  `BPM_Update.py --refresh-features` analyzes the catalog again, one download and decode per track
+  for all features together.
+- Features describe the analysis window (see below), not necessarily the whole track.
+- Print the features of local files with `python Audio_Analysis.py --features song1.mp3 ...`
+
+Accuracy vs. speed:
+- Shorter windows and lower sample rates decode faster but can drift from the full-track tempo.
+- Compare settings on your own files with:
+  `python Audio_Analysis.py --benchmark song1.mp3 song2.mp3 ...`
+
+Startup:
+- `librosa` and `soundfile` are imported on the first decode, not at import time, so the settings
+  and `analyze_audio` can be imported without paying for them (the parent process of the BPM
+  pipeline never imports them; only its analyzer processes do).
+
+Prerequisites:
+- `librosa` and its dependencies (`numpy`, `soundfile`) must be installed.
+"""
+
+import io
+import os
+import sys
+import mmap
+import time
+import tempfile
+from functools import cached_property
+
+from Metrics import registry, timed
+
+# Default analysis settings (None window = decode the whole track)
+ANALYSIS_SAMPLE_RATE = 22050
+ANALYSIS_WINDOW_SECONDS = 60
+
+# STFT settings shared by all features (librosa's defaults, which its beat tracker uses too)
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# Seconds of onset envelope autocorrelated to estimate the tempo (librosa's default `ac_size`)
+TEMPO_AC_SECONDS = 8.0
+
+# Bump when features are added or computed differently: stored and cached features of an older
+# version are recomputed by `BPM_Update.py --refresh-features`
+FEATURES_VERSION = 1
+
+# Points of the downsampled waveform envelope
+ENVELOPE_POINTS = 100
+
+# Pitch classes, and the Krumhansl-Kessler key profiles of C major and C minor
+KEY_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+MAJOR_PROFILE = [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+MINOR_PROFILE = [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+
+# Scalar features copied onto the song document (see `song_feature_fields`)
+SONG_FEATURE_FIELDS = ["bpmConfidence", "key", "mode", "keyConfidence", "loudnessDb", "energy", "onsetDensity"]
+
+# Firestore collection holding the full feature vector of each analyzed song, keyed by song ID
+FEATURES_COLLECTION = 'audio_features'
+
+# Settings compared by --benchmark, as (sample_rate, window_seconds)
+BENCHMARK_SETTINGS = [(22050, None), (22050, 60), (22050, 30), (11025, 60), (11025, 30)]
+
+# Returns the (offset, duration) in seconds of the centered analysis window
+def analysis_window(total_seconds, window_seconds):
+    if not window_seconds or total_seconds <= window_seconds:
+        return 0.0, None
+    return (total_seconds - window_seconds) / 2, float(window_seconds)
+
+# Decode a mono signal from a seekable file-like object, limited to the analysis window.
+# Returns (signal, sample_rate, window offset in seconds).
+def _load_from_buffer(buffer, sr, window_seconds):
+    import librosa
+    import soundfile as sf
+    total_seconds = sf.info(buffer).duration
+    buffer.seek(0)
+    offset, duration = analysis_window(total_seconds, window_seconds)
+    return (*librosa.load(buffer, sr=sr, mono=True, offset=offset, duration=duration), offset)
+
+# Decode from a file path, letting librosa fall back to its audioread backend when needed
+def _load_from_path(path, sr, window_seconds):
+    import librosa
+    total_seconds = librosa.get_duration(path=path)
+    offset, duration = analysis_window(total_seconds, window_seconds)
+    return (*librosa.load(path, sr=sr, mono=True, offset=offset, duration=duration), offset)
+
+# Decode via a temporary file, for libsndfile builds that cannot read MP3
+def _load_from_temp_file(data, sr, window_seconds):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
+        tmp.write(data)
+    try:
+        return _load_from_path(tmp.name, sr, window_seconds)
+    finally:
+        os.remove(tmp.name)
+
+# Decode audio from raw bytes or a local file path into (signal, sample_rate, window offset in seconds)
+def _decode(source, sr, window_seconds):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        try:
+            return _load_from_buffer(io.BytesIO(source), sr, window_seconds)
+        except RuntimeError:
+            return _load_from_temp_file(bytes(source), sr, window_seconds)
+
+    with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        try:
+            return _load_from_buffer(mapped, sr, window_seconds)
+        except RuntimeError:
+            pass
+    return _load_from_path(source, sr, window_seconds)
+
+# Decode audio from raw bytes or a local file path into (signal, sample_rate)
+def load_audio(source, sr=ANALYSIS_SAMPLE_RATE, window_seconds=ANALYSIS_WINDOW_SECONDS):
+    y, sr, _ = _decode(source, sr, window_seconds)
+    return y, sr
+
+# A decoded analysis window plus the intermediate representations the features share,
+# each computed on first use and kept for the other features
+class Signal:
+    def __init__(self, y, sr, offset=0.0):
+        self.y = y
+        self.sr = sr
+        self.offset = offset  # Seconds from the start of the track to the start of the window
+
+    @property
+    def seconds(self):
+        return len(self.y) / self.sr
+
+    @cached_property
+    def magnitude(self):
+        import numpy as np
+        import librosa
+        with timed("audio.stft"):
+            return np.abs(librosa.stft(self.y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+
+    @cached_property
+    def power(self):
+        return self.magnitude ** 2
+
+    # Spectral flux of the log-power mel spectrogram, median over bands (what `beat_track(y=...)` computes)
+    @cached_property
+    def onset_envelope(self):
+        import numpy as np
+        import librosa
+        with timed("audio.onset_strength"):
+            mel = librosa.feature.melspectrogram(S=self.power, sr=self.sr)
+            return librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=self.sr, hop_length=HOP_LENGTH,
+                                                aggregate=np.median)
+
+    # Local autocorrelation of the onset envelope, one column per frame (lag 0 normalized to 1)
+    @cached_property
+    def tempogram(self):
+        import librosa
+        win_length = int(librosa.time_to_frames(TEMPO_AC_SECONDS, sr=self.sr, hop_length=HOP_LENGTH))
+        return librosa.feature.tempogram(onset_envelope=self.onset_envelope, sr=self.sr,
+                                         hop_length=HOP_LENGTH, win_length=win_length)
+
+    @cached_property
+    def tempo(self):
+        import librosa
+        tempo = librosa.feature.tempo(onset_envelope=self.onset_envelope, tg=self.tempogram, sr=self.sr,
+                                      hop_length=HOP_LENGTH)
+        # The tempo comes back as a 1-element array
+        return float(tempo[0] if getattr(tempo, "ndim", 0) else tempo)
+
+def tempo_features(signal):
+    import numpy as np
+    import librosa
+    _, beat_frames = librosa.beat.beat_track(onset_envelope=signal.onset_envelope, sr=signal.sr,
+                                             hop_length=HOP_LENGTH, bpm=signal.tempo)
+    beats = librosa.frames_to_time(beat_frames, sr=signal.sr, hop_length=HOP_LENGTH) + signal.offset
+
+    # Confidence: mean autocorrelation of the onset envelope at the beat period
+    lag = int(round(60.0 * signal.sr / (HOP_LENGTH * signal.tempo))) if signal.tempo else 0
+    tempogram = signal.tempogram
+    confidence = float(np.mean(tempogram[lag])) if 0 < lag < tempogram.shape[0] else 0.0
+    return {
+        "bpm": round(signal.tempo, 2),
+        "bpmConfidence": round(min(max(confidence, 0.0), 1.0), 3),
+        "beats": [round(float(t), 3) for t in beats],
+    }
+
+# Key by correlating the mean chroma with the 24 rotated Krumhansl-Kessler profiles
+def key_features(signal):
+    import numpy as np
+    import librosa
+    chroma = librosa.feature.chroma_stft(S=signal.power, sr=signal.sr).mean(axis=1)
+    best = (-2.0, 0, "major")
+    for mode, profile in (("major", MAJOR_PROFILE), ("minor", MINOR_PROFILE)):
+        for tonic in range(12):
+            score = np.corrcoef(chroma, np.roll(profile, tonic))[0, 1]
+            if np.isfinite(score) and score > best[0]:
+                best = (float(score), tonic, mode)
+    score, tonic, mode = best
+    peak = float(chroma.max()) or 1.0
+    return {
+        "key": KEY_NAMES[tonic],
+        "mode": mode,
+        "keyConfidence": round(max(score, 0.0), 3),
+        "chroma": [round(float(value) / peak, 3) for value in chroma],
+    }
+
+def loudness_features(signal):
+    import numpy as np
+    import librosa
+    rms = librosa.feature.rms(S=signal.magnitude, frame_length=N_FFT, hop_length=HOP_LENGTH)[0]
+    level = float(np.sqrt(np.mean(np.square(signal.y)))) if len(signal.y) else 0.0
+    frames_db = librosa.amplitude_to_db(rms, ref=1.0)
+    return {
+        "loudnessDb": round(20 * float(np.log10(max(level, 1e-10))), 2),
+        "energy": round(float(rms.mean()), 4) if len(rms) else 0.0,
+        "dynamicRangeDb": round(float(np.percentile(frames_db, 95) - np.percentile(frames_db, 5)), 2)
+        if len(rms) else 0.0,
+    }
+
+def onset_features(signal):
+    import librosa
+    onsets = librosa.onset.onset_detect(onset_envelope=signal.onset_envelope, sr=signal.sr, hop_length=HOP_LENGTH)
+    return {"onsetDensity": round(len(onsets) / signal.seconds, 3) if signal.seconds else 0.0}
+
+# Peak absolute amplitude of ENVELOPE_POINTS equal slices of the window
+def envelope_features(signal):
+    import numpy as np
+    if not len(signal.y):
+        return {"envelope": []}
+    slices = np.array_split(np.abs(signal.y), min(ENVELOPE_POINTS, len(signal.y)))
+    return {"envelope": [round(float(part.max()), 3) for part in slices]}
+
+# Feature name -> function(Signal) returning the fields it adds
+FEATURE_EXTRACTORS = {
+    "tempo": tempo_features,
+    "key": key_features,
+    "loudness": loudness_features,
+    "onsets": onset_features,
+    "envelope": envelope_features,
+}
+
+# Decode audio (bytes or file path) once and compute the named features (default: all of them).
+# Returns a flat JSON-serializable dict, or None if the audio could not be analyzed.
+def extract_features(source, sr=ANALYSIS_SAMPLE_RATE, window_seconds=ANALYSIS_WINDOW_SECONDS, names=None):
+    try:
+        with timed("audio.decode"):
+            signal = Signal(*_decode(source, sr, window_seconds))
+        features = {
+            "featuresVersion": FEATURES_VERSION,
+            "sampleRate": signal.sr,
+            "analysisOffset": round(signal.offset, 3),
+            "analysisSeconds": round(signal.seconds, 3),
+        }
+        for name in names or FEATURE_EXTRACTORS:
+            with timed("audio.feature", feature=name):
+                features.update(FEATURE_EXTRACTORS[name](signal))
+        return features
+    except Exception as e:
+        print(f"[EXCEPTION] Error in audio analysis: {e}")
+        return None
+
+# Analyze audio (bytes or file path) and calculate its BPM (beats per minute) using librosa
+def calculate_bpm(source, sr=ANALYSIS_SAMPLE_RATE, window_seconds=ANALYSIS_WINDOW_SECONDS):
+    features = extract_features(source, sr, window_seconds, names=["tempo"])
+    return features["bpm"] if features else None
+
+# True if cached or stored features were computed by the current FEATURES_VERSION
+def features_current(features):
+    return bool(features and features.get("bpm")) and features.get("featuresVersion", 0) >= FEATURES_VERSION
+
+# Fields written to the song document: the BPM, the features version and the scalar features
+def song_feature_fields(features):
+    return {
+        "bpm": features["bpm"],
+        "featuresVersion": features.get("featuresVersion", 0),
+        "audioFeatures": {field: features[field] for field in SONG_FEATURE_FIELDS if field in features},
+    }
+
+# Runs in an analyzer process of `BPM_Update.py`: features of one file, plus the metrics recorded computing them
+def analyze_audio(audio_data, sr=ANALYSIS_SAMPLE_RATE, window_seconds=ANALYSIS_WINDOW_SECONDS):
+    registry.reset()
+    features = extract_features(audio_data, sr, window_seconds)
+    return features, registry.drain()
+
+# Compare decode time and BPM drift of each setting against a full-track, 22 kHz baseline
+def benchmark(paths, settings=BENCHMARK_SETTINGS):
+    sources = []
+    for path in paths:
+        with open(path, "rb") as f:
+            sources.append((os.path.basename(path), f.read()))
+
+    baseline = {name: calculate_bpm(data, 22050, None) for name, data in sources}
+
+    print(f"\n📊 Benchmark over {len(sources)} files (baseline: 22050 Hz, full track)")
+    print(f"{'sample rate':>12} {'window':>8} {'sec/file':>9} {'mean |ΔBPM|':>12} {'max |ΔBPM|':>11}")
+    for sr, window in settings:
+        start = time.perf_counter()
+        deltas = []
+        for name, data in sources:
+            bpm = calculate_bpm(data, sr, window)
+            if bpm is not None and baseline[name] is not None:
+                deltas.append(abs(bpm - baseline[name]))
+        per_file = (time.perf_counter() - start) / max(len(sources), 1)
+        mean_delta = sum(deltas) / len(deltas) if deltas else float("nan")
+        max_delta = max(deltas) if deltas else float("nan")
+        window_label = f"{window}s" if window else "full"
+        print(f"{sr:>12} {window_label:>8} {per_file:>9.2f} {mean_delta:>12.2f} {max_delta:>11.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "--features":
+        import json
+        for path in sys.argv[2:]:
+            print(f"🎧 {os.path.basename(path)}: {json.dumps(extract_features(path))}")
+        sys.exit(0)
+    if len(sys.argv) < 3 or sys.argv[1] != "--benchmark":
+        print("❌ Usage: python Audio_Analysis.py --benchmark FILE.mp3 [FILE.mp3 ...]")
+        print("         python Audio_Analysis.py --features FILE.mp3 [FILE.mp3 ...]")
+        sys.exit(1)
+    benchmark(sys.argv[2:])
@@ -1,30 +1,67 @@
 import os
-import tempfile
+import queue
+import argparse
+import threading
+import contextvars
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ProcessPoolExecutor
 import requests
-import librosa
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, firestore
-from fastapi import FastAPI
+
+from Audio_Analysis import (analyze_audio, features_current, song_feature_fields, ANALYSIS_SAMPLE_RATE,
+                            ANALYSIS_WINDOW_SECONDS, FEATURES_COLLECTION, FEATURES_VERSION)
+from Catalog import JOB_FIELDS, NEEDS_AUDIO, NEEDS_BPM, DEFAULT_PAGE_SIZE, stream_backlog
+from Firestore_Writer import BatchedWriter
+from Feature_Store import FeatureStore, content_hashes
+from Incremental_Scan import IncrementalScan, touch, watch_changed_songs
+from Metrics import ContextThreadPoolExecutor, registry, timed, count_bytes, job_run
 
 """
 This script scans all songs in the Firestore database and automatically calculates the BPM (beats per minute)
 for songs that are missing it. It downloads the MP3 file using the `audioUrl`, analyzes the audio using `librosa`,
 and updates the `bpm` field in Firestore.
 
+The same decode also yields the song's other audio features (see `Audio_Analysis.py`): the song document
+gets `bpm`, `featuresVersion` and the scalar features in `audioFeatures` (tempo confidence, key, mode,
+loudness, energy, onset density), and `audio_features/{song_id}` gets the full feature vector (beat
+times, chroma, waveform envelope, ...).
+
 Features:
 - Downloads audio files from public URLs stored in Firestore.
 - Uses `librosa` to analyze each file and extract tempo (BPM).
 - Updates the Firestore `songs` collection with the calculated BPM.
 - Skips songs that already have a BPM or are missing `audioUrl`.
+- `--refresh-features` also analyzes songs whose features predate `FEATURES_VERSION` (after a
+  feature was added), with one download and decode per song for all features.
+
+Pipeline:
+- A bounded thread pool downloads MP3s into memory (network I/O, 1 MB chunks, no temp files) and hands each file to a `ProcessPoolExecutor`
+  of librosa analyzers (CPU), so downloads and decodes overlap and every core is used.
+- At most `--max-in-flight` songs are downloaded or being analyzed at once (backpressure),
+  which bounds the memory held by downloaded files.
+- Only the middle `--window` seconds are decoded, as mono at `--sample-rate` (see `Audio_Analysis.py`).
+- Results are written back through batched Firestore writes (`Firestore_Writer.py`).
+- Before downloading, each object is looked up in the local feature store (`Feature_Store.py`) by its
+  storage generation and MD5 (from a HEAD request); after downloading, by the SHA-256 of its bytes.
+  Audio that was analyzed (with the current `FEATURES_VERSION`) before is never decoded again.
+- Download, HEAD, decode and beat-tracking latencies are recorded (`Metrics.py`); the analyzer
+  processes send their measurements back with each result.
+- Only songs flagged `needsBpm` with `needsAudio` false are read, by an indexed query paginated
+  with `--page-size` (see `Catalog.py`), so a run costs reads proportional to the backlog.
+  Use `--full` to scan the whole catalog instead (songs written before the flags existed), or
+  `--watch` to keep running and process changed songs as they arrive (`Incremental_Scan.py`).
+- The analyzer processes import only `Audio_Analysis.py` and its librosa stack: this module loads
+  `.env` and Firebase on first use (`firestore_db()`), so workers that re-import it (spawn on
+  Windows, forkserver) never initialize Firebase.
+- Worker counts and batch sizes are configurable, e.g.:
+  `python BPM_Update.py --download-workers 8 --analysis-workers 6 --flush-size 50`
 
 Technologies:
 - `firebase-admin` to connect and update Firestore
 - `requests` for HTTP audio download
-- `librosa` for BPM detection and signal processing
-- `tempfile` and `os` for managing temporary files
+- `librosa` for BPM detection and signal processing (see `Audio_Analysis.py`)
+- `concurrent.futures` thread and process pools for the download/analysis pipeline
 - `dotenv` to load environment variables
-- Optional `FastAPI` setup for future expansion (e.g., turning into an API endpoint)
 
 Use Case:
 Run this script after uploading songs to Firebase Storage, to fill in missing BPM values for use in playlists,
@@ -36,53 +73,69 @@ Prerequisites:
 - `librosa` and its dependencies (`numpy`, `soundfile`) must be installed.
 """
 
-# Load environment variables from .env file
-load_dotenv()
+# Download buffer size (large chunks keep per-chunk overhead negligible)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
-# Initialize Firebase using service account JSON file
-cred = credentials.Certificate(r"C:\Users\Yinon\PycharmProjects\QueueMue_Adding_Songs_To_DB\queuemueue-firebase-admin.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Shared HTTP session so download threads reuse pooled connections
+http = requests.Session()
 
-# Create FastAPI app instance
-app = FastAPI()
+# Loads the .env file and Firebase on first use, not at import: analyzer processes started with spawn
+# (Windows) or forkserver re-import this module when it runs as a script, and must not initialize Firebase
+def firestore_db():
+    load_dotenv()
+    from Firebase_Setup import db
+    return db
 
-# Download audio file from a given URL and save it temporarily
+# Download an audio file from a given URL into memory
 def download_audio(url):
     try:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-                for chunk in response.iter_content(chunk_size=1024):
-                    tmp.write(chunk)
-                return tmp.name
-        else:
-            print(f"[ERROR] Failed to download file: {url}")
-            return None
+        with timed("audio.download"):
+            response = http.get(url, stream=True, timeout=30)
+            if response.status_code == 200:
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    data.extend(chunk)
+                count_bytes("audio.download", received=len(data))
+                return bytes(data)
+            else:
+                print(f"[ERROR] Failed to download file: {url}")
+                return None
     except Exception as e:
         print(f"[EXCEPTION] Error downloading file: {e}")
         return None
 
-# Analyze audio file and calculate its BPM (beats per minute) using librosa
-def calculate_bpm(file_path):
+# Read the storage object key and base64 MD5 of a public Cloud Storage URL without downloading it
+def head_audio(url):
     try:
-        y, sr = librosa.load(file_path)
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        return round(float(tempo), 2)
+        with timed("audio.head"):
+            response = http.head(url, timeout=10)
+        if response.status_code != 200:
+            return None, None
+        md5 = None
+        for part in response.headers.get("x-goog-hash", "").split(","):
+            name, _, value = part.strip().partition("=")
+            if name == "md5":
+                md5 = value
+        generation = response.headers.get("x-goog-generation")
+        object_key = f"{unquote(urlparse(url).path).lstrip('/')}#{generation}" if generation else None
+        return object_key, md5
     except Exception as e:
-        print(f"[EXCEPTION] Error in BPM calculation: {e}")
-        return None
+        print(f"[EXCEPTION] Error reading file metadata: {e}")
+        return None, None
 
-# Scan all songs in Firestore and update BPM for those missing it
-def process_missing_bpm():
-    print("🔍 Scanning all songs without BPM...")
-    songs = db.collection('songs').stream()
+# Default pipeline sizes
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_ANALYSIS_WORKERS = os.cpu_count() or 2
+DEFAULT_FLUSH_SIZE = 50
 
-    total = 0
-    success = 0
-    failed = 0
+# Fields read by the BPM job
+BPM_FIELDS = JOB_FIELDS['bpm']
 
-    for doc in songs:
+# Collect songs that have an audioUrl but no BPM yet, as (doc_id, title, audio_url).
+# With refresh_features, also songs whose features were computed by an older FEATURES_VERSION.
+def find_songs_missing_bpm(docs, refresh_features=False):
+    pending = []
+    for doc in docs:
         data = doc.to_dict()
         audio_url = data.get('audioUrl')
         bpm = data.get('bpm')
@@ -91,34 +144,189 @@ def process_missing_bpm():
         if not audio_url:
             print(f"[WARNING] Skipping '{title}' - no audioUrl.")
             continue
-        if bpm is not None:
+        if bpm is not None and not (refresh_features and (data.get('featuresVersion') or 0) < FEATURES_VERSION):
            # print(f"[INFO] Skipping '{title}' - BPM already exists.")
             continue
 
-        total += 1
-        print(f"\n🎵 Processing song: {title}")
-        file_path = download_audio(audio_url)
-        if not file_path:
-            print(f"[ERROR] Failed to download '{title}'.")
-            failed += 1
-            continue
+        pending.append((doc.id, title, audio_url))
+    return pending
 
-        bpm_result = calculate_bpm(file_path)
-        os.remove(file_path)
+# Run the download/analysis/write pipeline for pending songs; returns the IDs of songs that failed
+def run_bpm_pipeline(pending, download_workers=DEFAULT_DOWNLOAD_WORKERS, analysis_workers=DEFAULT_ANALYSIS_WORKERS,
+                     max_in_flight=None, flush_size=DEFAULT_FLUSH_SIZE,
+                     sample_rate=ANALYSIS_SAMPLE_RATE, window_seconds=ANALYSIS_WINDOW_SECONDS):
+    total = len(pending)
+    success = 0
+    failed = 0
+    failed_ids = set()
 
-        if bpm_result:
-            print(f"✅ Calculated BPM = {bpm_result} for '{title}'")
-            db.collection('songs').document(doc.id).update({'bpm': bpm_result})
-            success += 1
-        else:
-            print(f"❌ Failed to calculate BPM for '{title}'")
-            failed += 1
+    # Backpressure: a slot is taken before download and released once the analysis finished,
+    # which also bounds how many downloaded files are held in memory at once
+    slots = threading.BoundedSemaphore(max_in_flight or download_workers + 2 * analysis_workers)
+    results = queue.Queue()
+    features = FeatureStore()
+    db = firestore_db()
+
+    with ContextThreadPoolExecutor(max_workers=download_workers) as downloader, \
+            ProcessPoolExecutor(max_workers=analysis_workers) as analyzer, \
+            BatchedWriter(db, flush_size=flush_size) as writer:
+
+        # Runs on an analyzer's done-callback: clean up and report the result
+        def finish_analysis(doc_id, title, hashes, object_key, future):
+            try:
+                audio_features, metrics = future.result()
+                registry.merge(metrics)
+                if audio_features and audio_features.get("bpm"):
+                    features.put(*hashes, audio_features, object_key=object_key)
+            except Exception as e:
+                print(f"[EXCEPTION] Analysis worker failed for '{title}': {e}")
+                audio_features = None
+            results.put((doc_id, title, audio_features, "calculate BPM for"))
+            slots.release()
+
+        # Runs on a download thread: reuse cached features or fetch the file and hand it to the process pool
+        def download_stage(doc_id, title, audio_url):
+            try:
+                object_key, md5 = head_audio(audio_url)
+                cached = features.get_by_object(object_key) or features.get_by_md5(md5)
+                if features_current(cached):
+                    results.put((doc_id, title, cached, "cached"))
+                    slots.release()
+                    return
+
+                audio_data = download_audio(audio_url)
+                if not audio_data:
+                    results.put((doc_id, title, None, "download"))
+                    slots.release()
+                    return
+
+                hashes = content_hashes(audio_data)
+                cached = features.get(hashes[0])
+                if features_current(cached):
+                    if object_key:
+                        features.link_object(object_key, hashes[0])
+                    results.put((doc_id, title, cached, "cached"))
+                    slots.release()
+                    return
+
+                future = analyzer.submit(analyze_audio, audio_data, sample_rate, window_seconds)
+                # The callback runs on the pool's management thread; keep this song's context for it
+                context = contextvars.copy_context()
+                future.add_done_callback(lambda f: context.run(finish_analysis, doc_id, title, hashes, object_key, f))
+            except Exception as e:
+                print(f"[EXCEPTION] Pipeline error for '{title}': {e}")
+                results.put((doc_id, title, None, "process"))
+                slots.release()
+
+        # Main thread: record one finished song (only this thread touches the writer and counters)
+        def handle_result(result):
+            nonlocal success, failed
+            doc_id, title, audio_features, stage = result
+            if audio_features and audio_features.get("bpm"):
+                summary = f"BPM = {audio_features['bpm']}, key = {audio_features.get('key')} {audio_features.get('mode')}"
+                if stage == "cached":
+                    print(f"♻️ Reused cached {summary} for '{title}'")
+                else:
+                    print(f"✅ Calculated {summary} for '{title}'")
+                writer.update(db.collection('songs').document(doc_id),
+                              touch({**song_feature_fields(audio_features), NEEDS_BPM: False}, "bpm"))
+                writer.set(db.collection(FEATURES_COLLECTION).document(doc_id), audio_features)
+                success += 1
+            else:
+                print(f"❌ Failed to {stage} '{title}'")
+                failed += 1
+                failed_ids.add(doc_id)
+
+        done = 0
+        for doc_id, title, audio_url in pending:
+            slots.acquire()
+            print(f"\n🎵 Processing song: {title}")
+            downloader.submit(download_stage, doc_id, title, audio_url)
+            while True:
+                try:
+                    handle_result(results.get_nowait())
+                    done += 1
+                except queue.Empty:
+                    break
+
+        while done < total:
+            handle_result(results.get())
+            done += 1
+
+    features.close()
+    # A song queues two writes (songs/{id} and audio_features/{id}); count it once if either failed
+    write_failed_ids = {path.split("/")[-1] for path, _ in writer.errors} - failed_ids
+    failed += len(write_failed_ids)
+    success -= len(write_failed_ids)
+    failed_ids.update(write_failed_ids)
 
     print("\n📊 Done.")
     print(f"Total processed: {total}")
     print(f"✅ Success: {success}")
     print(f"❌ Failed: {failed}")
+    return failed_ids
+
+# Update BPM for the songs flagged as needing it (or, with full=True, for every song missing it;
+# with refresh_features, also for every song with outdated features). Failed songs keep `needsBpm`
+# and are retried on the next run.
+def process_missing_bpm(full=False, page_size=DEFAULT_PAGE_SIZE, refresh_features=False, **pipeline_options):
+    db = firestore_db()
+    if not full and not refresh_features:
+        print("🔍 Querying songs that need a BPM...")
+        docs = stream_backlog(db, {NEEDS_BPM: True, NEEDS_AUDIO: False}, BPM_FIELDS, page_size)
+        run_bpm_pipeline(find_songs_missing_bpm(docs), **pipeline_options)
+        return
+
+    scan = IncrementalScan(db, "bpm", fields=BPM_FIELDS, full=True)
+    print(f"🔍 Scanning songs without BPM ({scan.describe()})...")
+    docs = {doc.id: doc for doc in scan}
+    failed_ids = run_bpm_pipeline(find_songs_missing_bpm(docs.values(), refresh_features), **pipeline_options)
+
+    for doc_id in failed_ids:
+        scan.mark_failed(docs[doc_id])
+    scan.commit()
+
+# Daemon mode: compute BPM for songs as soon as they get an audioUrl
+def watch_missing_bpm(**pipeline_options):
+    def handle_docs(docs):
+        pending = find_songs_missing_bpm(docs)
+        if pending and run_bpm_pipeline(pending, **pipeline_options):
+            raise RuntimeError("some songs failed; watermark not advanced")
+
+    watch_changed_songs(firestore_db(), "bpm", handle_docs, fields=BPM_FIELDS)
+
+# Command-line entry point (`python BPM_Update.py` or `python QueueMue_CLI.py bpm`)
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Calculate missing BPM values for songs in Firestore")
+    parser.add_argument("--download-workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS,
+                        help="parallel MP3 downloads")
+    parser.add_argument("--analysis-workers", type=int, default=DEFAULT_ANALYSIS_WORKERS,
+                        help="librosa analyzer processes (default: number of CPU cores)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="max songs downloaded or being analyzed at once")
+    parser.add_argument("--flush-size", type=int, default=DEFAULT_FLUSH_SIZE,
+                        help="BPM updates committed per Firestore batch")
+    parser.add_argument("--sample-rate", type=int, default=ANALYSIS_SAMPLE_RATE,
+                        help="mono sample rate used for analysis")
+    parser.add_argument("--window", type=float, default=ANALYSIS_WINDOW_SECONDS,
+                        help="analyze only the middle N seconds of each track (0 = whole track)")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help="songs read per page of the needsBpm query")
+    parser.add_argument("--full", action="store_true", help="scan the whole catalog, not only flagged songs")
+    parser.add_argument("--refresh-features", action="store_true",
+                        help="also analyze songs whose audio features are outdated (implies --full)")
+    parser.add_argument("--watch", action="store_true", help="keep running and process changed songs as they arrive")
+    args = parser.parse_args(argv)
+
+    options = dict(download_workers=args.download_workers, analysis_workers=args.analysis_workers,
+                   max_in_flight=args.max_in_flight, flush_size=args.flush_size,
+                   sample_rate=args.sample_rate, window_seconds=args.window or None)
+    with job_run("bpm"):
+        if args.watch:
+            watch_missing_bpm(**options)
+        else:
+            process_missing_bpm(full=args.full, page_size=args.page_size, refresh_features=args.refresh_features,
+                                **options)
 
-# Main Execution
 if __name__ == "__main__":
-    process_missing_bpm()
+    cli()
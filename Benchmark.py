@@ -0,0 +1,419 @@
+"""
+Reproducible benchmark of the QueueMue jobs against synthetic catalogs.
+
+Without numbers we cannot tell whether a change makes the nightly jobs faster or slower, so this
+script seeds a synthetic catalog, runs each job against local stand-ins of every external service
+(see `Benchmark_Fakes.py`) and reports wall time, throughput, Firestore RPCs and peak memory.
+
+How it works:
+1. For every catalog size (`--sizes`, default 1k / 10k / 100k songs) a fresh process seeds the
+   catalog: `songs`, `artists` and `genres`, with disjoint backlogs of `--backlog` songs that need
+   BPM, lyrics, embeddings and audio.
+2. Firestore is an in-process fake that counts RPCs and documents read/written (`--backend fake`),
+   or the Firestore emulator (`--backend emulator`, with `FIRESTORE_EMULATOR_HOST` set; RPCs are
+   not counted there). Storage is always faked.
+3. Spotify, lyrics.ovh and the audio downloads are served by one local HTTP server with an
+   injected delay per response (`--http-latency-ms`).
+4. The jobs (`--jobs`) run one after another; setup (imports, model loading, generating the MP3
+   files) is not timed:
+   - `ingest`: `Add_Song_To_DB.extract_batch_info` + `upload_songs` for the backlog of new tracks
+   - `playlists`: `System_Playlists_Update.build_system_playlists` over the whole catalog
+   - `chunked`: the same in the chunked playlist format, with cached song details (`Playlist_Storage.py`)
+   - `bpm`: `BPM_Update.process_missing_bpm` (synthetic click tracks at known tempos; the share
+     detected within 4% is reported as the BPM accuracy)
+   - `lyrics`: `Lyrics_Fill_Batch.fill_lyrics_for_songs` for the lyrics backlog
+   - `embeddings`: `Songs_Embadding.update_song_embeddings`
+   - `mp3`: `MP3_Upload.upload_all` over a folder of tagged, silent MP3 files
+5. Peak memory is the peak of Python allocations while the job ran (`tracemalloc`; it slows the
+   jobs down, `--no-memory` turns it off). BPM analyzer processes are not included.
+6. Results are printed as a table and can be saved (`--output`) and compared with a previous run
+   (`--compare`). Saved results include each job's per-operation metrics (`Metrics.py`).
+
+Usage example:
+    python Benchmark.py --sizes 1000 10000 --output baseline.json
+    python Benchmark.py --sizes 1000 10000 --compare baseline.json
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python Benchmark.py --backend emulator --sizes 1000
+
+Notes:
+- All caches go to a temporary directory (`QUEUEMUE_CACHE_DIR`), so runs never reuse results of
+  earlier runs and never touch the real `.queuemue_cache/`.
+- Jobs whose dependencies are not installed (e.g. `sentence-transformers`) are reported as skipped.
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+from Benchmark_Fakes import FakeFirestore, FakeBucket, FakeServices, write_silent_mp3
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_BACKLOG = 200
+JOBS = ["ingest", "playlists", "chunked", "bpm", "lyrics", "embeddings", "mp3"]
+
+# Injected latencies (milliseconds)
+DEFAULT_RPC_LATENCY_MS = 5
+DEFAULT_STORAGE_LATENCY_MS = 20
+DEFAULT_HTTP_LATENCY_MS = 50
+
+AUDIO_SECONDS = 30
+SPOTIFY_ARTISTS = 500
+GENRES = ["pop", "rock", "hip hop", "jazz", "blues", "metal", "indie", "folk", "soul", "funk",
+          "house", "techno", "reggae", "country", "punk", "disco", "latin", "k-pop", "classical", "mizrahi"]
+TITLE_WORDS = ["summer", "night", "blue", "river", "heart", "fire", "dream", "city", "golden", "rain",
+               "shadow", "light", "wild", "ocean", "star", "echo", "silver", "storm", "dance", "lonely",
+               "paper", "moon", "velvet", "thunder", "sugar", "honey", "broken", "electric", "midnight", "garden"]
+
+
+# Firestore-safe ID, as `Add_Song_To_DB.safe_id` builds it
+def safe_id(name):
+    return name.strip().replace(" ", "_").upper()
+
+
+# Replaces `Firebase_Setup` with the fakes (or points the real one at the emulator); returns (db, bucket)
+def install_backend(backend, rpc_latency, storage_latency):
+    bucket = FakeBucket(latency=storage_latency)
+    if backend == "fake":
+        module = types.ModuleType("Firebase_Setup")
+        module.db = FakeFirestore(latency=rpc_latency)
+        module.bucket = bucket
+        module.BUCKET_NAME = bucket.name
+        module.CREDENTIALS_PATH = None
+        module.PROJECT_ID = "benchmark"
+        sys.modules["Firebase_Setup"] = module
+        return module.db, bucket
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("❌ --backend emulator needs FIRESTORE_EMULATOR_HOST (e.g. localhost:8080)")
+    import Firebase_Setup
+    Firebase_Setup.bucket = bucket
+    return Firebase_Setup.db, bucket
+
+
+# Removes every document from the emulator's database
+def clear_emulator(project_id):
+    import requests
+    host = os.getenv("FIRESTORE_EMULATOR_HOST")
+    requests.delete(f"http://{host}/emulator/v1/projects/{project_id}/databases/(default)/documents", timeout=60)
+
+
+# Synthetic song documents (same fields as `Add_Song_To_DB.build_song_doc`) and the backlog of each job
+def build_catalog(size, backlog, audio_base_url):
+    rng = random.Random(size)
+    now = datetime.now(timezone.utc)
+    songs, artists = {}, {}
+    backlogs = {name: [] for name in ("bpm", "lyrics", "embeddings", "mp3")}
+
+    for i in range(size):
+        words = rng.sample(TITLE_WORDS, 3)
+        title = f"{' '.join(words)} {i}".title()
+        artist = f"{rng.choice(TITLE_WORDS).title()} {rng.choice(TITLE_WORDS).title()} {i % 997}"
+        song_id = safe_id(title)
+        genres = rng.sample(GENRES, 2)
+        doc = {
+            "title": title.upper(),
+            "title_lower": title.lower(),
+            "artistId": safe_id(artist),
+            "artistName": artist,
+            "artist_lower": artist.lower(),
+            "genreId": [safe_id(g) for g in genres],
+            "mainGenre": genres[0],
+            "lyrics": "",
+            "url": f"https://open.spotify.com/track/catalog{i}",
+            "duration": AUDIO_SECONDS,
+            "cover": "",
+            "audioUrl": f"https://storage.googleapis.com/benchmark-bucket/songs/{song_id}.mp3",
+            "bpm": rng.randint(70, 170),
+            "updatedAt": now,
+        }
+
+        kind = ("bpm", "lyrics", "embeddings", "mp3")[i // backlog] if i < 4 * backlog else None
+        if kind == "bpm":
+            doc["audioUrl"] = f"{audio_base_url}/audio/{song_id}.wav"
+            doc["bpm"] = None
+        elif kind == "embeddings":
+            doc["lyrics"] = "\n".join(f"{title} line {n}" for n in range(30))
+        elif kind == "mp3":
+            doc["audioUrl"] = ""
+            doc["bpm"] = None
+        doc.update({"needsAudio": not doc["audioUrl"], "needsBpm": not doc["bpm"], "needsLyrics": not doc["lyrics"]})
+
+        songs[song_id] = doc
+        artists[doc["artistId"]] = {"name": artist}
+        if kind:
+            backlogs[kind].append((song_id, title, artist))
+
+    genres = {safe_id(g): {"name": g} for g in GENRES}
+    return {"songs": songs, "artists": artists, "genres": genres}, backlogs
+
+
+# Writes the synthetic catalog to the backend (directly into the fake, through batched writes to the emulator)
+def seed_catalog(db, collections):
+    if isinstance(db, FakeFirestore):
+        for name, documents in collections.items():
+            db.load(name, documents)
+        return
+
+    from Firestore_Writer import BatchedWriter
+    with BatchedWriter(db, flush_size=500) as writer:
+        for name, documents in collections.items():
+            for doc_id, data in documents.items():
+                writer.set(db.collection(name).document(doc_id), data)
+
+
+# Each setup function imports and prepares a job (untimed) and returns (items, run); run() does the timed work
+def setup_ingest(ctx):
+    import Add_Song_To_DB as ingest
+    ingest.spotify.sp.prefix = f"{ctx['services'].base_url}/v1/"
+    ingest.spotify.sp.auth_manager.OAUTH_TOKEN_URL = f"{ctx['services'].base_url}/api/token"
+    urls = [f"https://open.spotify.com/track/bench{ctx['size']}x{i}" for i in range(ctx["backlog"])]
+    return len(urls), lambda: ingest.upload_songs(ingest.extract_batch_info(urls))
+
+
+def setup_playlists(ctx):
+    from System_Playlists_Update import build_system_playlists
+    return ctx["size"], lambda: build_system_playlists(incremental=True)
+
+
+def setup_chunked(ctx):
+    from System_Playlists_Update import build_system_playlists
+    return ctx["size"], lambda: build_system_playlists(incremental=True, storage="chunked", with_details=True)
+
+
+def setup_bpm(ctx):
+    from BPM_Update import process_missing_bpm
+    options = {"analysis_workers": ctx["analysis_workers"]} if ctx["analysis_workers"] else {}
+    return len(ctx["backlogs"]["bpm"]), lambda: process_missing_bpm(**options)
+
+
+# Share of the BPM backlog whose detected tempo is within 4% of the click track's (or of its half/double)
+def bpm_accuracy(ctx):
+    refs = [ctx["db"].collection("songs").document(song_id) for song_id, _, _ in ctx["backlogs"]["bpm"]]
+    correct = 0
+    for snapshot in ctx["db"].get_all(refs, field_paths=["bpm"]):
+        detected = (snapshot.to_dict() or {}).get("bpm")
+        expected = ctx["services"].audio_bpm(f"{snapshot.id}.wav")
+        if detected and any(abs(detected - expected * factor) <= 0.04 * expected * factor for factor in (0.5, 1, 2)):
+            correct += 1
+    return round(correct / len(refs), 3) if refs else None
+
+
+def setup_lyrics(ctx):
+    import Lyrics_Fill_Batch
+    Lyrics_Fill_Batch.LYRICS_API_URL = f"{ctx['services'].base_url}/lyrics/{{artist}}/{{title}}"
+    song_ids = [song_id for song_id, _, _ in ctx["backlogs"]["lyrics"]]
+    return len(song_ids), lambda: Lyrics_Fill_Batch.fill_lyrics_for_songs(song_ids)
+
+
+def setup_embeddings(ctx):
+    from Pipeline_Runner import load_script
+    embedding = load_script("Songs_Embadding")
+    embedding.get_model()  # Loaded on first use, outside the timed run
+    return len(ctx["backlogs"]["embeddings"]), lambda: embedding.update_song_embeddings()
+
+
+def setup_mp3(ctx):
+    folder = os.path.join(ctx["workdir"], f"mp3_{ctx['size']}")
+    os.makedirs(folder, exist_ok=True)
+    for song_id, title, artist in ctx["backlogs"]["mp3"]:
+        write_silent_mp3(os.path.join(folder, f"{song_id}.mp3"), title, artist, AUDIO_SECONDS)
+
+    import MP3_Upload
+    return len(ctx["backlogs"]["mp3"]), lambda: MP3_Upload.upload_all(folder, logs_folder=ctx["workdir"])
+
+
+SETUPS = {
+    "ingest": setup_ingest,
+    "playlists": setup_playlists,
+    "chunked": setup_chunked,
+    "bpm": setup_bpm,
+    "lyrics": setup_lyrics,
+    "embeddings": setup_embeddings,
+    "mp3": setup_mp3,
+}
+
+
+# Runs one job and returns its result row
+def measure(job, ctx, track_memory=True, verbose=False):
+    # Imported here: importing the repo modules fixes CACHE_DIR, which `run_size` has to set first
+    from Metrics import registry, print_summary
+
+    row = {"job": job, "size": ctx["size"]}
+    try:
+        items, run = SETUPS[job](ctx)
+    except ImportError as e:
+        print(f"⏭️ Skipping '{job}': {e}")
+        return dict(row, status="skipped", error=str(e))
+
+    for counter in (ctx["db"].rpc if isinstance(ctx["db"], FakeFirestore) else None,
+                    ctx["bucket"].rpc, ctx["services"].requests):
+        if counter is not None:
+            counter.reset()
+    registry.reset()
+
+    print(f"▶️ {job} ({items} items, catalog of {ctx['size']})")
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    status, error = "ok", None
+    with open(os.devnull, "w") as devnull:
+        try:
+            with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(devnull):
+                run()
+        except Exception as e:
+            status, error = "failed", f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    if track_memory:
+        tracemalloc.stop()
+
+    row.update({
+        "status": status,
+        "items": items,
+        "seconds": round(seconds, 3),
+        "itemsPerSecond": round(items / seconds, 2) if seconds else None,
+        "peakMemoryMB": round(peak / 2 ** 20, 1) if peak is not None else None,
+        "firestore": ctx["db"].rpc.snapshot() if isinstance(ctx["db"], FakeFirestore) else None,
+        "storage": ctx["bucket"].rpc.snapshot(),
+        "http": ctx["services"].requests.snapshot(),
+        "metrics": registry.snapshot(),
+    })
+    if verbose:
+        print_summary(job, seconds)
+    if job == "bpm" and status == "ok":
+        row["bpmAccuracy"] = bpm_accuracy(ctx)
+    if error:
+        row["error"] = error
+        print(f"❌ {job} failed: {error}")
+    return row
+
+
+# Seeds one catalog size and runs the jobs against it (in this process)
+def run_size(size, args):
+    backlog = min(args.backlog, size // 5)
+    workdir = tempfile.mkdtemp(prefix=f"queuemue_bench_{size}_")
+    os.environ["QUEUEMUE_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ.setdefault("SPOTIPY_CLIENT_ID", "benchmark")
+    os.environ.setdefault("SPOTIPY_CLIENT_SECRET", "benchmark")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)  # Scripts write logs and spotipy its token cache into the working directory
+
+    db, bucket = install_backend(args.backend, args.rpc_latency_ms / 1000, args.storage_latency_ms / 1000)
+    services = FakeServices(latency=args.http_latency_ms / 1000, genres=GENRES, artist_count=SPOTIFY_ARTISTS,
+                            audio_seconds=AUDIO_SECONDS).start()
+    try:
+        print(f"\n🌱 Seeding a catalog of {size} songs (backlogs of {backlog})...")
+        start = time.perf_counter()
+        if args.backend == "emulator":
+            clear_emulator(sys.modules["Firebase_Setup"].PROJECT_ID)
+        collections, backlogs = build_catalog(size, backlog, services.base_url)
+        seed_catalog(db, collections)
+        print(f"🌱 Seeded in {time.perf_counter() - start:.1f}s")
+
+        ctx = {"size": size, "backlog": backlog, "backlogs": backlogs, "db": db, "bucket": bucket,
+               "services": services, "workdir": workdir, "analysis_workers": args.analysis_workers}
+        return [measure(job, ctx, not args.no_memory, args.verbose) for job in args.jobs]
+    finally:
+        services.stop()
+        os.chdir(previous_cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Runs every size in its own process, so imports, caches and memory start fresh each time
+def run_sizes_in_subprocesses(args):
+    rows = []
+    for size in args.sizes:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_path = f.name
+        argv = [sys.executable, os.path.abspath(__file__), "--sizes", str(size), "--output", result_path,
+                "--backend", args.backend, "--backlog", str(args.backlog), "--jobs", *args.jobs,
+                "--rpc-latency-ms", str(args.rpc_latency_ms), "--storage-latency-ms", str(args.storage_latency_ms),
+                "--http-latency-ms", str(args.http_latency_ms)]
+        if args.analysis_workers:
+            argv += ["--analysis-workers", str(args.analysis_workers)]
+        argv += [flag for flag, enabled in (("--no-memory", args.no_memory), ("--keep", args.keep),
+                                            ("--verbose", args.verbose)) if enabled]
+        subprocess.run(argv, check=False)
+        try:
+            with open(result_path, encoding="utf-8") as f:
+                rows.extend(json.load(f)["results"])
+        except (OSError, ValueError):
+            print(f"❌ No results for size {size}")
+        finally:
+            os.remove(result_path)
+    return rows
+
+
+# Prints the results, with the change against a baseline run when given
+def print_results(rows, baseline=None):
+    previous = {(row["job"], row["size"]): row for row in (baseline or [])}
+    print(f"\n📊 {'job':<11} {'songs':>7} {'items':>6} {'seconds':>9} {'items/s':>9} {'peak MB':>8} "
+          f"{'reads':>8} {'writes':>7} {'RPCs':>6}" + (f" {'Δ time':>8}" if baseline else ""))
+    for row in rows:
+        if row["status"] == "skipped":
+            print(f"   {row['job']:<11} {row['size']:>7}  skipped ({row.get('error')})")
+            continue
+        firestore = row.get("firestore")
+        reads = firestore.get("docsRead", 0) if firestore is not None else "n/a"
+        writes = firestore.get("docsWritten", 0) if firestore is not None else "n/a"
+        rpcs = sum(v for k, v in firestore.items() if not k.startswith("docs")) if firestore is not None else "n/a"
+        peak = row["peakMemoryMB"] if row["peakMemoryMB"] is not None else "n/a"
+        line = (f"   {row['job']:<11} {row['size']:>7} {row['items']:>6} {row['seconds']:>9.2f} "
+                f"{row['itemsPerSecond'] or 0:>9.1f} {peak:>8} {reads:>8} {writes:>7} {rpcs:>6}")
+        before = previous.get((row["job"], row["size"]))
+        if before and before.get("seconds"):
+            line += f" {100 * (row['seconds'] - before['seconds']) / before['seconds']:>+7.0f}%"
+        if row.get("bpmAccuracy") is not None:
+            line += f"  (BPM accuracy {row['bpmAccuracy']:.0%})"
+        if row["status"] != "ok":
+            line += f"  ❌ {row.get('error')}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the QueueMue jobs against synthetic catalogs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="catalog sizes (songs)")
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG,
+                        help="songs per job backlog (new tracks, missing BPM/lyrics/embeddings/audio)")
+    parser.add_argument("--jobs", nargs="+", choices=JOBS, default=JOBS, help="jobs to run")
+    parser.add_argument("--backend", choices=["fake", "emulator"], default="fake", help="Firestore backend")
+    parser.add_argument("--rpc-latency-ms", type=float, default=DEFAULT_RPC_LATENCY_MS,
+                        help="delay per fake Firestore RPC")
+    parser.add_argument("--storage-latency-ms", type=float, default=DEFAULT_STORAGE_LATENCY_MS,
+                        help="delay per fake Storage call")
+    parser.add_argument("--http-latency-ms", type=float, default=DEFAULT_HTTP_LATENCY_MS,
+                        help="delay per Spotify / lyrics / audio response")
+    parser.add_argument("--analysis-workers", type=int, default=None, help="BPM analyzer processes")
+    parser.add_argument("--no-memory", action="store_true", help="do not track peak memory (faster)")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directories")
+    parser.add_argument("--verbose", action="store_true", help="show the jobs' own output")
+    args = parser.parse_args()
+
+    if len(args.sizes) == 1:
+        results = run_size(args.sizes[0], args)
+    else:
+        results = run_sizes_in_subprocesses(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"createdAt": datetime.now(timezone.utc).isoformat(), "backend": args.backend,
+                       "results": results}, f, indent=1)
+        print(f"\n💾 Results saved to {args.output}")
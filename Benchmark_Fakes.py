@@ -0,0 +1,503 @@
+"""
+In-process fakes of the external services, used by `Benchmark.py`.
+
+Benchmarks must be reproducible and must not touch the production project, Spotify's rate limits
+or lyrics.ovh, so every dependency has a local stand-in:
+
+- `FakeFirestore`: an in-memory Firestore client with the API surface the scripts use (documents,
+  sub-collections, `where` / `order_by` / `limit` / `start_after` / `select` queries, `get_all`,
+  batched writes, `SERVER_TIMESTAMP`). Every call is counted in `rpc` (RPCs per kind, documents
+  read and written, as Firestore bills them) and can be slowed down by a fixed `latency`.
+  Tests can make commits fail with `fail_writes`, a predicate on the written document's path.
+- `FakeBucket`: an in-memory Firebase Storage bucket with per-call latency and counters.
+- `FakeServices`: one local HTTP server that answers as the Spotify Web API (`/v1/...`, token
+  endpoint `/api/token`), as lyrics.ovh (`/lyrics/{artist}/{title}`) and as Cloud Storage for
+  audio downloads (`/audio/{name}.wav`, with `x-goog-hash` / `x-goog-generation` headers), all
+  with an injected response delay.
+- `click_track_wav(...)` and `write_silent_mp3(...)` generate synthetic audio: WAV click tracks
+  at a known tempo for the BPM job, and tagged MP3 files (silent MPEG frames + ID3) for the
+  MP3 upload loop.
+
+Notes:
+- Synthetic audio for BPM is WAV, not MP3: encoding MP3 needs an encoder library the project does
+  not depend on, and the BPM job decodes both the same way (`Audio_Analysis.load_audio`).
+- Every generated object depends on its name, so no two songs share audio bytes (the feature store
+  would otherwise analyze each tempo only once).
+"""
+
+import io
+import json
+import time
+import uuid
+import wave
+import base64
+import hashlib
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from firebase_admin import firestore
+
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+# MPEG-1 Layer III frame: 128 kbps, 44.1 kHz, joint stereo; an all-zero body decodes to silence
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x64])
+MP3_FRAME_SIZE = 417
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+
+class RpcCounter:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    # Records one call (after the injected latency) and the documents it read or wrote
+    def record(self, kind, reads=0, writes=0):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            for name, amount in ((kind, 1), ("docsRead", reads), ("docsWritten", writes)):
+                if amount:
+                    self.counts[name] = self.counts.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+class FakeNotFound(Exception):
+    pass
+
+
+class FakeWriteError(Exception):
+    pass
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocument:
+    def __init__(self, db, parent, doc_id):
+        self.db = db
+        self.parent = parent
+        self.id = doc_id
+        self.path = f"{parent.path}/{doc_id}"
+
+    def collection(self, name):
+        return FakeCollection(self.db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None):
+        self.db.rpc.record("get", reads=1)
+        return self.db.snapshot(self, field_paths)
+
+    def set(self, data, merge=False):
+        batch = self.db.batch()
+        batch.set(self, data, merge=merge)
+        batch.commit()
+
+    def update(self, data):
+        batch = self.db.batch()
+        batch.update(self, data)
+        batch.commit()
+
+    def delete(self):
+        batch = self.db.batch()
+        batch.delete(self)
+        batch.commit()
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=(), orders=(), limit=None, cursor=None, fields=None):
+        self.db = db
+        self.path = path
+        self.filters = list(filters)
+        self.orders = list(orders)
+        self.limit_count = limit
+        self.cursor = cursor
+        self.fields = fields
+
+    def _copy(self, **changes):
+        options = dict(filters=self.filters, orders=self.orders, limit=self.limit_count,
+                       cursor=self.cursor, fields=self.fields)
+        options.update(changes)
+        return FakeQuery(self.db, self.path, **options)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self.filters + [(field, op, value)])
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self.orders + [(field, direction == "DESCENDING")])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(cursor=snapshot)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def _matches(self, doc_id, data):
+        for field, op, value in self.filters:
+            actual = doc_id if field == "__name__" else data.get(field)
+            if actual is None and field not in data:
+                return False
+            if op == "==":
+                ok = actual == value
+            elif op == "!=":
+                ok = actual != value
+            elif op == "in":
+                ok = actual in value
+            elif op == "array_contains":
+                ok = isinstance(actual, list) and value in actual
+            else:
+                try:
+                    ok = {">": actual > value, ">=": actual >= value, "<": actual < value, "<=": actual <= value}[op]
+                except TypeError:
+                    ok = False
+            if not ok:
+                return False
+        return True
+
+    # Firestore orders by the explicit order_by fields, then by the inequality field, then by document ID
+    def _sort_fields(self):
+        fields = [(field, descending) for field, descending in self.orders if field != "__name__"]
+        for field, op, _ in self.filters:
+            if op not in ("==", "in", "array_contains") and field not in [f for f, _ in fields]:
+                fields.append((field, False))
+        return fields
+
+    def stream(self):
+        sort_fields = self._sort_fields()
+        with self.db.lock:
+            docs = [(doc_id, data) for doc_id, data in self.db.collections.get(self.path, {}).items()
+                    if self._matches(doc_id, data) and all(field in data for field, _ in sort_fields)]
+
+        for field, descending in reversed(sort_fields + [("__name__", False)]):
+            docs.sort(key=lambda item: item[0] if field == "__name__" else item[1][field], reverse=descending)
+
+        if self.cursor is not None:
+            ids = [doc_id for doc_id, _ in docs]
+            docs = docs[ids.index(self.cursor.id) + 1:] if self.cursor.id in ids else docs
+        if self.limit_count is not None:
+            docs = docs[:self.limit_count]
+
+        # Like Firestore, an empty result still costs one read
+        self.db.rpc.record("runQuery", reads=max(len(docs), 1))
+        collection = FakeCollection(self.db, self.path)
+        for doc_id, data in docs:
+            yield self.db.project(FakeDocument(self.db, collection, doc_id), data, self.fields)
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path.split("/")[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocument(self.db, self, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, ref, data, merge=False):
+        self.ops.append(("set", ref, data, merge))
+
+    def update(self, ref, data):
+        self.ops.append(("update", ref, data, False))
+
+    def delete(self, ref):
+        self.ops.append(("delete", ref, None, False))
+
+    # Applies all writes atomically, like a Firestore commit
+    def commit(self):
+        if len(self.ops) > MAX_BATCH_WRITES:
+            raise ValueError(f"A batch can contain at most {MAX_BATCH_WRITES} writes")
+        self.db.rpc.record("commit", writes=len(self.ops))
+        now = datetime.now(timezone.utc)
+        with self.db.lock:
+            for op, ref, _, _ in self.ops:
+                if op == "update" and ref.id not in self.db.collections.get(ref.parent.path, {}):
+                    raise FakeNotFound(f"No document to update: {ref.path}")
+                if self.db.fail_writes and self.db.fail_writes(ref.path):
+                    raise FakeWriteError(f"Injected write failure: {ref.path}")
+            for op, ref, data, merge in self.ops:
+                self.db.apply(op, ref, data, merge, now)
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.collections = {}  # collection path -> {doc_id: data}
+        self.lock = threading.RLock()
+        self.rpc = RpcCounter(latency)
+        self.fail_writes = None  # Optional predicate(document path) -> True to make commits writing it fail
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, refs, field_paths=None):
+        refs = list(refs)
+        self.rpc.record("batchGet", reads=len(refs))
+        return [self.snapshot(ref, field_paths) for ref in refs]
+
+    def snapshot(self, ref, field_paths=None):
+        with self.lock:
+            data = self.collections.get(ref.parent.path, {}).get(ref.id)
+        return self.project(ref, data, field_paths)
+
+    @staticmethod
+    def project(ref, data, fields):
+        if data is not None and fields is not None:
+            data = {field: data[field] for field in fields if field in data}
+        return FakeSnapshot(ref, dict(data) if data is not None else None)
+
+    # Applies one write (called under the lock by FakeBatch.commit)
+    def apply(self, op, ref, data, merge, now):
+        docs = self.collections.setdefault(ref.parent.path, {})
+        if op == "delete":
+            docs.pop(ref.id, None)
+            return
+        values = {key: now if value is firestore.SERVER_TIMESTAMP else value for key, value in data.items()}
+        if op == "update" or merge:
+            docs.setdefault(ref.id, {}).update(values)
+        else:
+            docs[ref.id] = values
+
+    # Seeds documents directly, without counting RPCs
+    def load(self, collection_path, documents):
+        with self.lock:
+            self.collections.setdefault(collection_path, {}).update(documents)
+
+    def count(self, collection_path):
+        with self.lock:
+            return len(self.collections.get(collection_path, {}))
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.md5_hash = None
+        self.generation = None
+
+    def upload_from_filename(self, path, content_type=None):
+        with open(path, "rb") as f:
+            data = f.read()
+        self.bucket.rpc.record("storage.upload")
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode()
+        with self.bucket.lock:
+            self.generation = self.bucket.next_generation
+            self.bucket.next_generation += 1
+            self.bucket.blobs[self.name] = self
+            self.bucket.bytes_uploaded += len(data)
+
+    def make_public(self):
+        self.bucket.rpc.record("storage.acl")
+
+    @property
+    def public_url(self):
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+
+class FakeBucket:
+    def __init__(self, name="benchmark-bucket", latency=0.0):
+        self.name = name
+        self.blobs = {}
+        self.next_generation = 1
+        self.bytes_uploaded = 0
+        self.lock = threading.Lock()
+        self.rpc = RpcCounter(latency)
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        self.rpc.record("storage.get")
+        with self.lock:
+            return self.blobs.get(name)
+
+
+# Mono 16-bit WAV click track at the given tempo; the seed adds a little noise so every file is unique
+def click_track_wav(bpm, seconds=30, sample_rate=22050, seed=0):
+    rng = np.random.default_rng(seed)
+    signal = rng.normal(0, 0.01, int(seconds * sample_rate))
+    click = np.sin(2 * np.pi * 1000 * np.arange(int(0.03 * sample_rate)) / sample_rate) * np.hanning(int(0.03 * sample_rate))
+    for start in np.arange(0, seconds, 60.0 / bpm):
+        i = int(start * sample_rate)
+        signal[i:i + len(click)] += click[:len(signal) - i]
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.clip(signal, -1, 1) * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+# Writes a silent MP3 of the given length with ID3 title/artist tags (what `MP3_Upload.get_metadata` reads)
+def write_silent_mp3(path, title, artist, seconds=30):
+    from mutagen.easyid3 import EasyID3
+
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    with open(path, "wb") as f:
+        f.write(frame * int(seconds * MP3_FRAMES_PER_SECOND))
+    tags = EasyID3()
+    tags["title"] = title
+    tags["artist"] = artist
+    tags.save(path)
+
+
+# Deterministic Spotify objects for synthetic IDs: track "bench<n>" belongs to artist "artist<n % artists>"
+def fake_track(track_id, artist_count):
+    number = int(hashlib.md5(track_id.encode()).hexdigest(), 16)
+    artist_id = f"artist{number % artist_count}"
+    return {
+        "id": track_id,
+        "name": f"Benchmark Song {track_id}",
+        "type": "track",
+        "artists": [{"id": artist_id, "name": f"Benchmark Artist {artist_id}"}],
+        "duration_ms": 180000 + number % 60000,
+        "album": {"images": [{"url": f"https://i.scdn.co/image/{track_id}"}]},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+    }
+
+
+def fake_artist(artist_id, genres):
+    number = int(hashlib.md5(artist_id.encode()).hexdigest(), 16)
+    return {"id": artist_id, "name": f"Benchmark Artist {artist_id}",
+            "genres": [genres[number % len(genres)], genres[(number // 7) % len(genres)]]}
+
+
+class FakeServices:
+    def __init__(self, latency=0.0, genres=("pop", "rock"), artist_count=500, lyrics_miss_rate=0.1,
+                 audio_seconds=30, bpm_range=(80, 160)):
+        self.latency = latency
+        self.genres = list(genres)
+        self.artist_count = artist_count
+        self.lyrics_miss_rate = lyrics_miss_rate
+        self.audio_seconds = audio_seconds
+        self.bpm_range = bpm_range
+        self.requests = RpcCounter()
+        self.audio_md5 = {}  # name -> base64 MD5, so HEAD requests do not regenerate the file
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Tempo of a synthetic audio file (what a correct BPM job should find)
+    def audio_bpm(self, name):
+        low, high = self.bpm_range
+        return low + int(hashlib.md5(name.encode()).hexdigest(), 16) % (high - low)
+
+    def audio(self, name):
+        data = click_track_wav(self.audio_bpm(name), self.audio_seconds,
+                               seed=int(hashlib.md5(name.encode()).hexdigest()[:8], 16))
+        self.audio_md5[name] = base64.b64encode(hashlib.md5(data).digest()).decode()
+        return data
+
+    def lyrics(self, artist, title):
+        number = int(hashlib.md5(f"{artist}/{title}".encode()).hexdigest(), 16)
+        if number % 1000 < self.lyrics_miss_rate * 1000:
+            return None
+        return "\n".join(f"{title} line {i} by {artist}" for i in range(20 + number % 20))
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="application/json", headers=None, head=False):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+            def _json(self, status, payload):
+                self._send(status, json.dumps(payload).encode())
+
+            def _route(self, head=False):
+                url = urlparse(self.path)
+                parts = [unquote(part) for part in url.path.strip("/").split("/")]
+                query = parse_qs(url.query)
+                if services.latency:
+                    time.sleep(services.latency)
+                services.requests.record("/".join(parts[:2]))
+
+                if parts[:2] == ["api", "token"]:
+                    return self._json(200, {"access_token": "benchmark", "token_type": "Bearer", "expires_in": 3600})
+                if parts[:2] == ["v1", "tracks"]:
+                    ids = parts[2:3] or query.get("ids", [""])[0].split(",")
+                    tracks = [fake_track(track_id, services.artist_count) for track_id in ids]
+                    return self._json(200, tracks[0] if len(parts) > 2 else {"tracks": tracks})
+                if parts[:2] == ["v1", "artists"]:
+                    ids = parts[2:3] or query.get("ids", [""])[0].split(",")
+                    artists = [fake_artist(artist_id, services.genres) for artist_id in ids]
+                    return self._json(200, artists[0] if len(parts) > 2 else {"artists": artists})
+                if parts[0] == "lyrics" and len(parts) == 3:
+                    lyrics = services.lyrics(parts[1], parts[2])
+                    if lyrics is None:
+                        return self._json(404, {"error": "No lyrics found"})
+                    return self._json(200, {"lyrics": lyrics})
+                if parts[0] == "audio" and len(parts) == 2:
+                    name = parts[1]
+                    data = b"" if head and name in services.audio_md5 else services.audio(name)
+                    headers = {"x-goog-hash": f"md5={services.audio_md5[name]}", "x-goog-generation": "1"}
+                    return self._send(200, data, "audio/wav", headers, head=head)
+                return self._json(404, {"error": "Unknown path"})
+
+            def do_GET(self):
+                self._route()
+
+            def do_HEAD(self):
+                self._route(head=True)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._route()
+
+        return Handler
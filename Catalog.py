@@ -0,0 +1,301 @@
+"""
+Catalog access for the `songs` collection: per-job field projections and a local snapshot.
+
+Song documents carry large fields (`lyrics` text, 384-float `embedding` arrays) that most jobs
+never look at. Reading the catalog through this module keeps every job to the fields it needs,
+and lets read-mostly jobs work from a local copy instead of Firestore.
+
+How it works:
+1. `JOB_FIELDS` lists the fields each job reads; `stream_songs(db, "playlists")` runs the
+   matching projection query (`select`), so only those fields leave Firestore. Songs come in
+   document ID order, the same order the snapshot returns them in.
+2. `CatalogSnapshot` keeps the small fields (`SNAPSHOT_FIELDS`, no lyrics or embeddings) of
+   every song in `.queuemue_cache/catalog.sqlite`, one column per field.
+3. `snapshot.refresh(db)` only reads songs changed since the last refresh (`updatedAt`
+   watermark, see `Incremental_Scan.py`). Once a day (`FULL_REFRESH_AGE`), or with `full=True`,
+   it re-reads the whole catalog and drops songs that were deleted.
+4. `load_songs(db, job, source)` returns the job's songs from Firestore (`firestore`), from a
+   freshly refreshed snapshot (`snapshot`), or from the snapshot as it is (`offline`).
+5. Every writer keeps the status flags `needsAudio`, `needsBpm` and `needsLyrics` on the song
+   (see `status_flags`), so backlogs are indexed equality queries: `stream_backlog(db, {...})`
+   pages through them with a cursor and costs reads proportional to the backlog, not the catalog.
+
+Usage example:
+    for song in load_songs(db, "missing_mp3", source="snapshot"):
+        print(song.id, song.to_dict()["title"])
+
+    python Catalog.py --refresh [--full]
+    python Catalog.py --backfill-flags   # one-time: set the status flags on existing songs
+
+Notes:
+- Snapshot rows behave like Firestore snapshots (`.id`, `.to_dict()`), so jobs accept either.
+- Only jobs whose fields are all in `SNAPSHOT_FIELDS` can read from the snapshot.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+from Firestore_Writer import BatchedWriter
+from Id_Cache import CACHE_DIR
+from Incremental_Scan import UPDATED_AT, changed_songs_query
+from Metrics import timed_stream
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(CACHE_DIR, "catalog.sqlite")
+
+# Fields read by each job
+JOB_FIELDS = {
+    "bpm": ["audioUrl", "bpm", "title", "featuresVersion"],
+    "clusters": ["embedding", "bpm", "mainGenre"],
+    "embeddings": ["lyrics", "title", "embeddingSourceHash"],
+    "main_genre": ["genreId", "mainGenre"],
+    "matcher": ["title", "artistName", "duration"],
+    "missing_mp3": ["audioUrl", "title", "url"],
+    "playlists": ["genreId"],
+    "similarity": ["embedding", "title"],
+}
+
+# Fields kept in the local snapshot (lyrics and embeddings stay in Firestore)
+SNAPSHOT_FIELDS = ["title", "artistId", "artistName", "duration", "url", "cover", "audioUrl", "bpm", "genreId",
+                   "mainGenre"]
+
+SOURCES = ("firestore", "snapshot", "offline")
+
+# Re-read the whole catalog at least once a day, to notice deleted songs
+FULL_REFRESH_AGE = 24 * 3600
+
+# Rows written per SQLite transaction during a refresh
+REFRESH_CHUNK = 500
+
+# Status flags kept on every song by its writers
+NEEDS_AUDIO = "needsAudio"
+NEEDS_BPM = "needsBpm"
+NEEDS_LYRICS = "needsLyrics"
+
+# Documents per page of a backlog query
+DEFAULT_PAGE_SIZE = 300
+
+
+# Resolves a job name or an explicit field list to the list of fields to read
+def job_fields(job_or_fields):
+    if isinstance(job_or_fields, str):
+        return JOB_FIELDS[job_or_fields]
+    return list(job_or_fields)
+
+
+# Streams the songs with only the fields of a job (projection query)
+def stream_songs(db, job_or_fields):
+    query = db.collection("songs").select(job_fields(job_or_fields)).order_by("__name__")
+    return timed_stream("firestore.query", query.stream())
+
+
+# Status flags for a song document (or for the fields a write sets, when all three are known)
+def status_flags(data):
+    return {
+        NEEDS_AUDIO: not data.get("audioUrl"),
+        NEEDS_BPM: not data.get("bpm"),
+        NEEDS_LYRICS: not data.get("lyrics"),
+    }
+
+
+# Yields pages of the songs matching equality filters (e.g. {NEEDS_BPM: True}), paginated by document ID
+def backlog_pages(db, filters, fields=None, page_size=DEFAULT_PAGE_SIZE):
+    query = db.collection("songs")
+    for field, value in filters.items():
+        query = query.where(field, "==", value)
+    if fields:
+        query = query.select(list(fields))
+    query = query.order_by("__name__").limit(page_size)
+
+    last = None
+    while True:
+        page = list(timed_stream("firestore.query", (query.start_after(last) if last is not None else query).stream()))
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+# Streams the songs matching equality filters, one page at a time
+def stream_backlog(db, filters, fields=None, page_size=DEFAULT_PAGE_SIZE):
+    for page in backlog_pages(db, filters, fields, page_size):
+        yield from page
+
+
+# One-time migration: set the status flags on songs written before they existed (only where they differ)
+def backfill_status_flags(db):
+    changed = 0
+    flag_names = list(status_flags({}))
+    with BatchedWriter(db) as writer:
+        for doc in db.collection("songs").select(["audioUrl", "bpm", "lyrics"] + flag_names).stream():
+            data = doc.to_dict()
+            flags = status_flags(data)
+            if any(data.get(name) != value for name, value in flags.items()):
+                writer.update(doc.reference, flags)
+                changed += 1
+    print(f"✅ Status flags set on {changed} songs ({len(writer.errors)} failed).")
+
+
+# A snapshot row that reads like a Firestore document snapshot
+class SnapshotDoc:
+    exists = True
+
+    def __init__(self, song_id, data):
+        self.id = song_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class CatalogSnapshot:
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS songs (id TEXT PRIMARY KEY, updated_at TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+        # A field added to SNAPSHOT_FIELDS gets its column, and the next refresh is a full one
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(songs)")}
+        missing = [field for field in SNAPSHOT_FIELDS if field not in columns]
+        with self.conn:
+            for field in missing:
+                self.conn.execute(f'ALTER TABLE songs ADD COLUMN "{field}" TEXT')
+            if missing and columns - {"id", "updated_at"}:
+                self.conn.execute("DELETE FROM meta WHERE key IN ('watermark', 'fullRefreshAt')")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # True if every field is stored in the snapshot
+    @staticmethod
+    def covers(fields):
+        return set(fields) <= set(SNAPSHOT_FIELDS)
+
+    # Brings the snapshot up to date; returns (songs written, songs removed)
+    def refresh(self, db, full=False):
+        with self.lock:
+            watermark = self._get_meta("watermark")
+            full_refresh_at = float(self._get_meta("fullRefreshAt") or 0)
+        full = full or watermark is None or time.time() - full_refresh_at > FULL_REFRESH_AGE
+        start_watermark = None if full else datetime.fromisoformat(watermark)
+
+        placeholders = ", ".join("?" for _ in range(len(SNAPSHOT_FIELDS) + 2))
+        columns = ", ".join(f'"{field}"' for field in SNAPSHOT_FIELDS)
+        upsert = f"INSERT OR REPLACE INTO songs (id, updated_at, {columns}) VALUES ({placeholders})"
+
+        max_seen = start_watermark
+        seen_ids = set()
+        rows = []
+        written = 0
+
+        def flush():
+            with self.lock, self.conn:
+                self.conn.executemany(upsert, rows)
+            rows.clear()
+
+        for doc in timed_stream("firestore.query", changed_songs_query(db, start_watermark, SNAPSHOT_FIELDS).stream()):
+            data = doc.to_dict()
+            updated_at = data.get(UPDATED_AT)
+            if updated_at is not None and (max_seen is None or updated_at > max_seen):
+                max_seen = updated_at
+            seen_ids.add(doc.id)
+            rows.append([doc.id, updated_at.isoformat() if updated_at is not None else None]
+                        + [json.dumps(data[field], default=str) if field in data else None
+                           for field in SNAPSHOT_FIELDS])
+            written += 1
+            if len(rows) >= REFRESH_CHUNK:
+                flush()
+        flush()
+
+        removed = 0
+        with self.lock, self.conn:
+            if full:
+                stale = [(song_id,) for (song_id,) in self.conn.execute("SELECT id FROM songs")
+                         if song_id not in seen_ids]
+                self.conn.executemany("DELETE FROM songs WHERE id = ?", stale)
+                removed = len(stale)
+                self._set_meta("fullRefreshAt", str(time.time()))
+            if max_seen is not None:
+                self._set_meta("watermark", max_seen.isoformat())
+
+        print(f"📚 Catalog snapshot {'rebuilt' if full else 'refreshed'}: "
+              f"{written} songs written, {removed} removed, {len(self)} total.")
+        return written, removed
+
+    # Yields the songs stored in the snapshot, with only the given fields
+    def songs(self, fields=SNAPSHOT_FIELDS):
+        fields = list(fields)
+        if not self.covers(fields):
+            raise ValueError(f"Fields not in the catalog snapshot: {sorted(set(fields) - set(SNAPSHOT_FIELDS))}")
+        columns = ", ".join(["id"] + [f'"{field}"' for field in fields])
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {columns} FROM songs ORDER BY id").fetchall()
+        for row in rows:
+            yield SnapshotDoc(row[0], {field: json.loads(value)
+                                       for field, value in zip(fields, row[1:]) if value is not None})
+
+
+# Returns the songs of a job (only its fields) from Firestore or from the local snapshot
+def load_songs(db, job_or_fields, source="firestore", snapshot_path=DEFAULT_SNAPSHOT_PATH):
+    fields = job_fields(job_or_fields)
+    if source == "firestore" or not CatalogSnapshot.covers(fields):
+        if source != "firestore":
+            print(f"⚠️ {fields} are not all in the catalog snapshot, reading from Firestore.")
+        return stream_songs(db, fields)
+
+    snapshot = CatalogSnapshot(snapshot_path)
+    try:
+        if source == "snapshot":
+            snapshot.refresh(db)
+        elif not len(snapshot):
+            print("⚠️ The catalog snapshot is empty; run `python Catalog.py --refresh` first.")
+    except BaseException:
+        snapshot.close()
+        raise
+    return snapshot_songs(snapshot, fields)
+
+
+# Yields the songs of a snapshot and closes it once they were read (or the caller stopped early)
+def snapshot_songs(snapshot, fields):
+    try:
+        yield from snapshot.songs(fields)
+    finally:
+        snapshot.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the local catalog snapshot")
+    parser.add_argument("--refresh", action="store_true", help="bring the snapshot up to date")
+    parser.add_argument("--full", action="store_true", help="re-read the whole catalog")
+    parser.add_argument("--backfill-flags", action="store_true", help="set needsAudio/needsBpm/needsLyrics on all songs")
+    args = parser.parse_args()
+
+    snapshot = CatalogSnapshot()
+    if args.backfill_flags:
+        from Firebase_Setup import db
+        backfill_status_flags(db)
+    elif args.refresh or args.full:
+        from Firebase_Setup import db
+        snapshot.refresh(db, full=args.full)
+    else:
+        print(f"📚 Catalog snapshot '{snapshot.path}': {len(snapshot)} songs.")
@@ -1,44 +1,74 @@
-
 """
 This script updates the `mainGenre` field for each song in the Firestore `songs` collection
 based on the first genre listed in the `genreId` array.
 
 How it works:
-1. Fetches all song documents from the `songs` collection.
+1. Reads only `genreId` and `mainGenre` of the songs (field projection).
 2. For each song:
-   a. Checks if the `genreId` field exists and is a list.
-   b. Extracts the first genre from the list.
-   c. Saves it to a new field called `mainGenre` in the same document.
+   a. Derives the main genre: the first genre of the `genreId` list (`derive_main_genre`).
+   b. Skips the song if its `mainGenre` already has that value.
+   c. Otherwise queues the update; updates are committed in batches of up to 500 writes.
 
 Notes:
+- New songs get `mainGenre` when they are written (`Add_Song_To_DB.py` uses `derive_main_genre`),
+  so this job is only a backfill / repair pass.
+- Only songs changed since the last successful run are scanned (see `Incremental_Scan.py`);
+  pass `--full` to scan the whole collection.
 - Songs without any genre will be skipped.
 - Useful for quick access to the primary genre of a song without processing the full list.
 """
 
-import firebase_admin
-from firebase_admin import credentials, firestore
+import argparse
+
+from Catalog import JOB_FIELDS
+from Firebase_Setup import db
+from Firestore_Writer import BatchedWriter, MAX_BATCH_SIZE
+from Incremental_Scan import IncrementalScan, touch
+from Metrics import job_run
+
+# The main genre of a song: the first entry of its `genreId` list (None if it has no genres)
+def derive_main_genre(genre_ids):
+    if isinstance(genre_ids, list) and len(genre_ids) > 0:
+        return genre_ids[0]
+    return None
+
+def update_main_genre(full=False, flush_size=MAX_BATCH_SIZE):
+    scan = IncrementalScan(db, "main_genre", fields=JOB_FIELDS['main_genre'], full=full)
+    print(f"🔍 Updating mainGenre ({scan.describe()})...")
+
+    docs = {}
+    unchanged = 0
+    no_genre = 0
+    with BatchedWriter(db, flush_size=min(flush_size, MAX_BATCH_SIZE)) as writer:
+        for song in scan:
+            data = song.to_dict()
+            main_genre = derive_main_genre(data.get('genreId', []))
 
-# Initialize Firebase Admin SDK
-cred = credentials.Certificate(r"C:\Users\Yinon\PycharmProjects\QueueMue_Adding_Songs_To_DB\queuemueue-firebase-admin.json")
-firebase_admin.initialize_app(cred)
+            # Check if there is at least one genre, and write only what actually changes
+            if main_genre is None:
+                no_genre += 1
+            elif data.get('mainGenre') == main_genre:
+                unchanged += 1
+            else:
+                docs[song.id] = song
+                writer.update(song.reference, touch({'mainGenre': main_genre}, scan.job_name))
 
-db = firestore.client()
+    for path, _ in writer.errors:
+        scan.mark_failed(docs[path.split("/")[-1]])
+    scan.commit()
 
-def update_main_genre():
-    songs_ref = db.collection('songs')
-    songs = songs_ref.stream()
+    print(f"📊 mainGenre updated: {writer.written}, unchanged: {unchanged}, "
+          f"no genres: {no_genre}, failed: {len(writer.errors)}")
 
-    for song in songs:
-        data = song.to_dict()
-        genre_ids = data.get('genreId', [])
+# Command-line entry point (`python Create_Main_Genre.py` or `python QueueMue_CLI.py main-genre`)
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Set mainGenre on songs from their first genre")
+    parser.add_argument("--full", action="store_true", help="scan the whole catalog, not only changed songs")
+    parser.add_argument("--flush-size", type=int, default=MAX_BATCH_SIZE, help="updates committed per batch (max 500)")
+    args = parser.parse_args(argv)
 
-        # Check if there is at least one genre
-        if isinstance(genre_ids, list) and len(genre_ids) > 0:
-            main_genre = genre_ids[0]
-            song.reference.update({'mainGenre': main_genre})
-            print(f"✅ Updated mainGenre for song: {song.id} -> {main_genre}")
-        else:
-            print(f"⚠️ No genres found for song: {song.id}, skipped.")
+    with job_run("main_genre"):
+        update_main_genre(full=args.full, flush_size=args.flush_size)
 
 if __name__ == "__main__":
-    update_main_genre()
+    cli()
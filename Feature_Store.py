@@ -0,0 +1,121 @@
+"""
+Local audio feature store, keyed by the content hash of the audio file.
+
+Lets `BPM_Update.py` and `MP3_Upload.py` reuse features (BPM and anything else we extract)
+for audio that was already analyzed, so re-uploads and re-runs never decode the same bytes twice.
+
+How it works:
+1. Every analyzed file is stored under the SHA-256 of its bytes, together with its MD5
+   (base64, the same format Cloud Storage reports as `md5Hash` / `x-goog-hash`).
+2. Storage objects (`bucket/path#generation`) are linked to the content hash they hold,
+   so a known object can be resolved without even downloading it.
+3. Lookups can be made by content hash, by MD5, or by storage object key.
+4. Features are stored as a JSON map and merged on every `put`.
+
+Notes:
+- The store is a single SQLite file in `.queuemue_cache/features.sqlite`; it is safe to share
+  between the threads of one process (all access goes through one lock).
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import sqlite3
+import threading
+
+from Id_Cache import CACHE_DIR
+
+DEFAULT_STORE_PATH = os.path.join(CACHE_DIR, "features.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    content_hash TEXT PRIMARY KEY,
+    md5 TEXT,
+    features TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS features_md5 ON features (md5);
+CREATE TABLE IF NOT EXISTS storage_objects (
+    object_key TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL
+);
+"""
+
+
+# Returns (sha256 hex, md5 base64) of raw audio bytes
+def content_hashes(data):
+    md5 = base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+    return hashlib.sha256(data).hexdigest(), md5
+
+
+# Returns (sha256 hex, md5 base64) of a local file, reading it in 1 MB chunks
+def file_hashes(path):
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+            md5.update(chunk)
+    return sha256.hexdigest(), base64.b64encode(md5.digest()).decode("ascii")
+
+
+# Builds the storage object key used to link an uploaded object to its content hash
+def storage_object_key(bucket_name, blob_name, generation):
+    return f"{bucket_name}/{blob_name}#{generation}"
+
+
+class FeatureStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _features_where(self, column, value):
+        if not value:
+            return None
+        with self.lock:
+            row = self.conn.execute(f"SELECT features FROM features WHERE {column} = ?", (value,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Features for a SHA-256 content hash, or None
+    def get(self, content_hash):
+        return self._features_where("content_hash", content_hash)
+
+    # Features for a base64 MD5 (e.g. a blob's md5Hash), or None
+    def get_by_md5(self, md5):
+        return self._features_where("md5", md5)
+
+    # Features for a storage object key (see `storage_object_key`), or None
+    def get_by_object(self, object_key):
+        if not object_key:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT content_hash FROM storage_objects WHERE object_key = ?",
+                                    (object_key,)).fetchone()
+        return self.get(row[0]) if row else None
+
+    # Merge new features into the entry for a content hash (and optionally link a storage object to it)
+    def put(self, content_hash, md5, features, object_key=None):
+        merged = dict(self.get(content_hash) or {})
+        merged.update(features)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO features (content_hash, md5, features, updated_at) VALUES (?, ?, ?, ?)",
+                (content_hash, md5, json.dumps(merged), time.time()))
+            if object_key:
+                self.conn.execute("INSERT OR REPLACE INTO storage_objects (object_key, content_hash) VALUES (?, ?)",
+                                  (object_key, content_hash))
+        return merged
+
+    # Record which content hash a storage object holds
+    def link_object(self, object_key, content_hash):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO storage_objects (object_key, content_hash) VALUES (?, ?)",
+                              (object_key, content_hash))
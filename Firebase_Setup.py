@@ -0,0 +1,50 @@
+"""
+Shared Firebase initialization for all QueueMue scripts.
+
+Every script used to call `firebase_admin.initialize_app` at import time, which made it impossible
+to import two of them into one process (the second call raises "default app already exists").
+Importing `db` (and `bucket` for Storage) from here initializes the default app once per process,
+so the jobs can run in-process and share one Firestore client (see `Pipeline_Runner.py`).
+
+Usage example:
+    from Firebase_Setup import db
+    from Firebase_Setup import bucket
+
+Configuration:
+- `CREDENTIALS_PATH`: Path to your Firebase Admin SDK JSON credentials
+  (overridden by the `QUEUEMUE_CREDENTIALS` environment variable).
+- `BUCKET_NAME`: Firebase Storage bucket, e.g. `your-project-id.appspot.com`
+  (overridden by `QUEUEMUE_BUCKET`).
+- With `FIRESTORE_EMULATOR_HOST` set (e.g. `localhost:8080`), `db` talks to the Firestore emulator
+  for project `QUEUEMUE_PROJECT_ID` and no credentials are needed (used by `Benchmark.py`).
+"""
+
+import os
+import firebase_admin
+from firebase_admin import credentials, firestore, storage
+
+CREDENTIALS_PATH = os.getenv("QUEUEMUE_CREDENTIALS",
+                             r"C:\Users\Yinon\PycharmProjects\QueueMue_Adding_Songs_To_DB\queuemueue-firebase-admin.json")
+BUCKET_NAME = os.getenv("QUEUEMUE_BUCKET", 'queuemueue.firebasestorage.app')
+PROJECT_ID = os.getenv("QUEUEMUE_PROJECT_ID", 'queuemueue')
+
+if os.getenv("FIRESTORE_EMULATOR_HOST"):
+    # The emulator client uses anonymous credentials; Storage is not emulated
+    db = firestore.Client(project=PROJECT_ID)
+else:
+    # Initialize Firebase once, however many scripts import this module
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(CREDENTIALS_PATH)
+        firebase_admin.initialize_app(cred, {
+            'storageBucket': BUCKET_NAME
+        })
+
+    db = firestore.client()
+
+
+# Storage clients are only created by the scripts that upload or download audio
+def __getattr__(name):
+    if name == "bucket":
+        globals()["bucket"] = storage.bucket()
+        return globals()["bucket"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,151 @@
+"""
+Shared Firestore write layer used by the upload scripts.
+
+Instead of issuing a blocking `get()` + `set()` round-trip for every artist, genre and song,
+writes are buffered and flushed through Firestore batched writes.
+
+How it works:
+1. Scripts queue writes with `writer.set(...)`, `writer.update(...)` or `writer.delete(...)`.
+2. Once `flush_size` writes are pending, they are committed together as one `WriteBatch`.
+3. If a batch commit fails, its writes are retried one by one so every failing document
+   is reported individually (path + error) instead of failing the whole batch silently.
+4. `set_if_absent(...)` replaces per-document existence checks with a single `get_all`
+   for all candidate documents, then queues only the ones that do not exist yet.
+
+Usage example:
+    with BatchedWriter(db, flush_size=400) as writer:
+        set_if_absent(writer, [(db.collection("artists").document("ADELE"), {"name": "Adele"})])
+        writer.set(db.collection("songs").document("HELLO"), {...})
+
+Notes:
+- Firestore allows at most 500 writes per batch, so `flush_size` is capped at 500.
+- Batches are not transactions across flushes; a failed document does not roll back others.
+- Commits and `get_all` calls are measured in `Metrics.py` (latency, documents read/written).
+"""
+
+from Metrics import timed, count_docs
+
+# Firestore limit for writes in a single batch
+MAX_BATCH_SIZE = 500
+
+# Max document references per `get_all` call
+GET_ALL_CHUNK = 300
+
+
+class BatchedWriter:
+    def __init__(self, db, flush_size=400, on_error=None):
+        if not 0 < flush_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"flush_size must be between 1 and {MAX_BATCH_SIZE}, got {flush_size}")
+
+        self.db = db
+        self.flush_size = flush_size
+        self.on_error = on_error  # Optional callback(ref, exception) for each failed document
+        self.pending = []
+        self.written = 0
+        self.errors = []  # List of (document path, exception)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    # Queue a full document write (or a merge when merge=True)
+    def set(self, ref, data, merge=False):
+        self._queue("set", ref, data, merge)
+
+    # Queue a partial update of an existing document
+    def update(self, ref, data):
+        self._queue("update", ref, data)
+
+    # Queue a document deletion
+    def delete(self, ref):
+        self._queue("delete", ref)
+
+    def _queue(self, op, ref, data=None, merge=False):
+        self.pending.append((op, ref, data, merge))
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    # Commit all pending writes; returns the list of (path, exception) that failed in this flush
+    def flush(self):
+        if not self.pending:
+            return []
+
+        pending, self.pending = self.pending, []
+        batch = self.db.batch()
+        for op, ref, data, merge in pending:
+            _apply(batch, op, ref, data, merge)
+
+        try:
+            with timed("firestore.commit"):
+                batch.commit()
+            count_docs("firestore.commit", written=len(pending))
+            self.written += len(pending)
+            return []
+        except Exception as e:
+            print(f"⚠️ Batch of {len(pending)} writes failed ({e}), retrying one by one...")
+
+        failed = []
+        for op, ref, data, merge in pending:
+            try:
+                single = self.db.batch()
+                _apply(single, op, ref, data, merge)
+                with timed("firestore.commit"):
+                    single.commit()
+                count_docs("firestore.commit", written=1)
+                self.written += 1
+            except Exception as e:
+                print(f"❌ Write failed for {ref.path}: {e}")
+                failed.append((ref.path, e))
+                if self.on_error:
+                    self.on_error(ref, e)
+
+        self.errors.extend(failed)
+        return failed
+
+
+def _apply(batch, op, ref, data, merge):
+    if op == "set":
+        batch.set(ref, data, merge=merge)
+    elif op == "update":
+        batch.update(ref, data)
+    elif op == "delete":
+        batch.delete(ref)
+    else:
+        raise ValueError(f"Unknown write operation: {op}")
+
+
+# `db.get_all` with latency and document counts recorded; returns the snapshots as a list
+def get_all(db, refs, field_paths=None):
+    refs = list(refs)
+    with timed("firestore.get_all"):
+        snapshots = list(db.get_all(refs, field_paths=field_paths))
+    count_docs("firestore.get_all", read=len(refs))
+    return snapshots
+
+
+# Returns the paths of the given document references that already exist, using batched `get_all` calls
+def existing_paths(db, refs):
+    refs = list({ref.path: ref for ref in refs}.values())
+    found = set()
+    for i in range(0, len(refs), GET_ALL_CHUNK):
+        for snapshot in get_all(db, refs[i:i + GET_ALL_CHUNK]):
+            if snapshot.exists:
+                found.add(snapshot.reference.path)
+    return found
+
+
+# Queue `set` for every (ref, data) pair whose document does not exist yet; returns the refs that were queued
+def set_if_absent(writer, items):
+    items = list({ref.path: (ref, data) for ref, data in items}.values())
+    if not items:
+        return []
+
+    existing = existing_paths(writer.db, [ref for ref, _ in items])
+    queued = []
+    for ref, data in items:
+        if ref.path not in existing:
+            writer.set(ref, data)
+            queued.append(ref)
+    return queued
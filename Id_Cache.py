@@ -0,0 +1,101 @@
+"""
+Persistent, process-wide cache of known Firestore document IDs.
+
+It lets the ingestion scripts skip existence-check reads for artists and genres that are
+already known to exist (Spotify responses are cached by `Spotify_Client.py`).
+
+How it works:
+1. The cache is loaded from `.queuemue_cache/id_cache.json` on startup.
+2. If the file is missing or older than `WARM_MAX_AGE`, `warm(db)` runs one streamed,
+   ID-only scan of the `artists` and `genres` collections and replaces the known ID sets.
+3. IDs are added as soon as their documents are queued for writing, and removed again by
+   `invalidate_ref` (used as the `BatchedWriter` error callback) if the write fails.
+4. `save()` writes the cache back to disk atomically.
+
+Notes:
+- The cache trusts Firestore documents not to be deleted behind its back; a periodic warm
+  scan (see `WARM_MAX_AGE`) corrects any drift.
+- The cache directory is not `.cache` on purpose: spotipy stores its OAuth token in a `.cache` file.
+- One instance can be shared by the threads of a process (e.g. `Ingestion_Service.py`); all
+  access goes through one lock.
+"""
+
+import json
+import os
+import time
+import threading
+
+# Local cache directory of all scripts (`QUEUEMUE_CACHE_DIR` overrides it, e.g. for `Benchmark.py` runs)
+CACHE_DIR = os.getenv("QUEUEMUE_CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".queuemue_cache")
+DEFAULT_CACHE_PATH = os.path.join(CACHE_DIR, "id_cache.json")
+
+# Re-scan Firestore for known IDs once a day
+WARM_MAX_AGE = 24 * 3600
+
+CACHED_COLLECTIONS = ("artists", "genres")
+
+
+class IdCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.known = {name: set() for name in CACHED_COLLECTIONS}
+        self.warmed_at = 0
+        self.lock = threading.RLock()
+        self.load()
+
+    # Load the cache from disk (a missing or corrupt file just means an empty cache)
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable ID cache '{self.path}': {e}")
+            return
+
+        self.warmed_at = data.get("warmedAt", 0)
+        for name in CACHED_COLLECTIONS:
+            self.known[name] = set(data.get("known", {}).get(name, []))
+
+    # Write the cache to disk atomically
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            data = {
+                "warmedAt": self.warmed_at,
+                "known": {name: sorted(ids) for name, ids in self.known.items()},
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    # Reload known IDs with one ID-only scan per collection, unless the cache is still fresh
+    def warm(self, db, max_age=WARM_MAX_AGE):
+        if time.time() - self.warmed_at < max_age:
+            return False
+
+        known = {name: {doc.id for doc in db.collection(name).select(["__name__"]).stream()}
+                 for name in CACHED_COLLECTIONS}
+        with self.lock:
+            self.known.update(known)
+            self.warmed_at = time.time()
+        print(f"🔥 ID cache warmed: {len(self.known['artists'])} artists, {len(self.known['genres'])} genres")
+        return True
+
+    def contains(self, collection_name, doc_id):
+        with self.lock:
+            return doc_id in self.known.get(collection_name, ())
+
+    def add(self, collection_name, doc_id):
+        with self.lock:
+            self.known.setdefault(collection_name, set()).add(doc_id)
+
+    def discard(self, collection_name, doc_id):
+        with self.lock:
+            self.known.get(collection_name, set()).discard(doc_id)
+
+    # `BatchedWriter` error callback: forget a document whose write failed
+    def invalidate_ref(self, ref, error=None):
+        self.discard(ref.parent.id, ref.id)
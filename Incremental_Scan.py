@@ -0,0 +1,200 @@
+"""
+Change-driven incremental scans of the `songs` collection.
+
+Instead of streaming the whole catalog to find the few documents that need work, each job keeps
+a watermark (the newest `updatedAt` it has processed) and only queries documents modified since.
+
+How it works:
+1. Every writer of a song document sets `updatedAt` to the server timestamp and `updatedBy` to
+   the job that wrote it (None for content writers such as ingestion; see `touch`).
+2. A job iterates `IncrementalScan(db, "job_name")`, which queries `updatedAt > watermark`.
+   Without a stored watermark (first run) or with `full=True`, it falls back to a full scan.
+   Incremental scans do not yield documents whose last write was the job's own.
+3. After the job finished it calls `scan.commit()`, which stores the newest `updatedAt` it saw
+   in `job_state/{job_name}` (or, if it reported failures with `scan.mark_failed(doc)`, a
+   watermark just before the earliest failed document, so failures are retried next run).
+4. `watch_changed_songs(...)` runs the same query as a Firestore `on_snapshot` listener for
+   long-running daemon mode, committing the watermark after each handled change set (the job's
+   own writes are not handed to it).
+
+Usage example:
+    scan = IncrementalScan(db, "bpm", fields=["audioUrl", "bpm", "title"])
+    for doc in scan:
+        writer.update(doc.reference, touch({"bpm": 120}, scan.job_name))
+    scan.commit()
+
+Notes:
+- Songs written before `updatedAt` existed are only seen by full scans; run
+  `python Incremental_Scan.py --backfill` once to stamp them. A failed song without `updatedAt`
+  keeps the watermark where it was, so the next run scans it again.
+- A job's own writes still move `updatedAt`, so other jobs (and the `Catalog.py` snapshot) see
+  them; the job itself only pays one read per written document on its next run.
+"""
+
+import sys
+import threading
+from datetime import timedelta
+
+from Firestore_Writer import BatchedWriter
+from Metrics import timed_stream
+
+JOB_STATE_COLLECTION = "job_state"
+UPDATED_AT = "updatedAt"
+UPDATED_BY = "updatedBy"
+
+
+# Firestore's server timestamp sentinel; the SDK is imported on first use, so read-only users of
+# this module (e.g. offline reports through `Catalog.py`) start without it
+def server_timestamp():
+    from firebase_admin import firestore
+    return firestore.SERVER_TIMESTAMP
+
+
+# Adds the `updatedAt` server timestamp and the writing job (None outside incremental jobs) to a song write
+def touch(data, job_name=None):
+    data[UPDATED_AT] = server_timestamp()
+    data[UPDATED_BY] = job_name
+    return data
+
+
+# Returns the stored watermark of a job, or None if it never completed a run
+def load_watermark(db, job_name):
+    snapshot = db.collection(JOB_STATE_COLLECTION).document(job_name).get()
+    return snapshot.to_dict().get("watermark") if snapshot.exists else None
+
+
+# Stores the watermark of a job after a successful run
+def save_watermark(db, job_name, watermark):
+    db.collection(JOB_STATE_COLLECTION).document(job_name).set({
+        "watermark": watermark,
+        "lastRunAt": server_timestamp()
+    }, merge=True)
+
+
+# Query for songs changed after the watermark (or all songs when watermark is None)
+def changed_songs_query(db, watermark, fields=None, collection_name="songs"):
+    query = db.collection(collection_name)
+    if watermark is not None:
+        query = query.where(UPDATED_AT, ">", watermark).order_by(UPDATED_AT)
+    if fields:
+        query = query.select(list(dict.fromkeys(list(fields) + [UPDATED_AT, UPDATED_BY])))
+    return query
+
+
+class IncrementalScan:
+    def __init__(self, db, job_name, fields=None, full=False, collection_name="songs"):
+        self.db = db
+        self.job_name = job_name
+        self.fields = fields
+        self.collection_name = collection_name
+        self.start_watermark = None if full else load_watermark(db, job_name)
+        self.max_seen = self.start_watermark
+        self.earliest_failed = None
+        self.failed_unstamped = 0  # Failed documents without `updatedAt`
+        self.count = 0
+        self.skipped_own = 0
+
+    @property
+    def is_full(self):
+        return self.start_watermark is None
+
+    def __iter__(self):
+        query = changed_songs_query(self.db, self.start_watermark, self.fields, self.collection_name)
+        for doc in timed_stream("firestore.query", query.stream()):
+            self.count += 1
+            self.observe(doc)
+            if not self.is_full and doc.to_dict().get(UPDATED_BY) == self.job_name:
+                self.skipped_own += 1  # Written by this job since the watermark: nothing left to do
+                continue
+            yield doc
+
+    # Track the newest `updatedAt` seen so far
+    def observe(self, doc):
+        updated_at = doc.to_dict().get(UPDATED_AT)
+        if updated_at is not None and (self.max_seen is None or updated_at > self.max_seen):
+            self.max_seen = updated_at
+
+    # Remember a document the job failed on, so the watermark stays before it and it is retried next run
+    def mark_failed(self, doc):
+        updated_at = doc.to_dict().get(UPDATED_AT)
+        if updated_at is None:
+            self.failed_unstamped += 1
+        elif self.earliest_failed is None or updated_at < self.earliest_failed:
+            self.earliest_failed = updated_at
+
+    # Persist the watermark; call only after all scanned documents were handled
+    def commit(self):
+        if self.failed_unstamped:
+            # Only a scan from the current watermark sees them again
+            print(f"⚠️ [{self.job_name}] {self.failed_unstamped} failed songs have no {UPDATED_AT}; "
+                  f"watermark not advanced (run `python Incremental_Scan.py --backfill`)")
+            return
+        watermark = self.max_seen
+        if self.earliest_failed is not None:
+            watermark = self.earliest_failed - timedelta(microseconds=1)
+            if self.start_watermark is not None and watermark < self.start_watermark:
+                watermark = self.start_watermark
+        if watermark is not None and watermark != self.start_watermark:
+            save_watermark(self.db, self.job_name, watermark)
+
+    def describe(self):
+        if self.is_full:
+            return "full scan"
+        return f"changes since {self.start_watermark}"
+
+
+# Daemon mode: call handle_docs(list_of_snapshots) for every batch of changed songs, until interrupted
+def watch_changed_songs(db, job_name, handle_docs, fields=None, collection_name="songs"):
+    watermark = load_watermark(db, job_name)
+    query = changed_songs_query(db, watermark, fields, collection_name)
+    state = {"max_seen": watermark}
+    lock = threading.Lock()
+
+    def on_snapshot(snapshots, changes, read_time):
+        docs = [change.document for change in changes if change.type.name in ("ADDED", "MODIFIED")]
+        if not docs:
+            return
+        with lock:
+            try:
+                # The job's own writes come back as changes too; only the watermark needs them
+                changed = [doc for doc in docs if doc.to_dict().get(UPDATED_BY) != job_name]
+                if changed:
+                    handle_docs(changed)
+            except Exception as e:
+                print(f"❌ [{job_name}] Failed to handle {len(docs)} changed songs: {e}")
+                return
+            for doc in docs:
+                updated_at = doc.to_dict().get(UPDATED_AT)
+                if updated_at is not None and (state["max_seen"] is None or updated_at > state["max_seen"]):
+                    state["max_seen"] = updated_at
+            if state["max_seen"] is not None:
+                save_watermark(db, job_name, state["max_seen"])
+
+    print(f"👀 [{job_name}] Watching for changed songs (Ctrl+C to stop)...")
+    watch = query.on_snapshot(on_snapshot)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(f"\n🛑 [{job_name}] Stopped.")
+    finally:
+        watch.unsubscribe()
+
+
+# One-time migration: stamp `updatedAt` on songs that do not have it yet
+def backfill_updated_at(db, collection_name="songs"):
+    stamped = 0
+    with BatchedWriter(db) as writer:
+        for doc in db.collection(collection_name).select([UPDATED_AT]).stream():
+            if doc.to_dict().get(UPDATED_AT) is None:
+                writer.update(doc.reference, touch({}))
+                stamped += 1
+    print(f"✅ Stamped updatedAt on {stamped} songs ({len(writer.errors)} failed).")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] != "--backfill":
+        print("❌ Usage: python Incremental_Scan.py --backfill")
+        sys.exit(1)
+
+    from Firebase_Setup import db
+    backfill_updated_at(db)
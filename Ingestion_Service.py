@@ -0,0 +1,438 @@
+"""
+Async HTTP ingestion service for the QueueMue catalog.
+
+Lets the app backend submit tracks and jobs programmatically instead of a person pasting URLs into
+`Add_Song_To_DB.py`. Requests are accepted immediately (202) and run on an internal work queue.
+
+How it works:
+1. Every request becomes a job with an ID, queued on the work queue of its pool.
+2. Each pool (`POOL_SIZES`) has a bounded queue and a fixed number of workers, and runs the
+   blocking job functions (Spotify, Firestore, Storage, librosa) on its own thread pool, so a
+   slow BPM backlog never holds up ingestion of new tracks.
+3. Everything a job prints is captured as progress events, which can be streamed with
+   Server-Sent Events (`GET /jobs/{id}/events`). The job is tracked in a context variable, which
+   the jobs' inner thread pools (`Metrics.ContextThreadPoolExecutor`) carry into their threads.
+   Each job keeps its last `MAX_JOB_EVENTS` events; a stream that falls further behind skips ahead.
+4. Every job reports its latency: time spent queued, running, and in total.
+5. A Spotify ingest job with `postProcess` queues the post-upload pipeline (`Pipeline_Runner.py`)
+   for the new songs as a follow-up job.
+
+Endpoints:
+- `POST /songs` `{"urls": [...], "postProcess": true}` - track/album/playlist URLs to add
+- `POST /mp3?filename=song.mp3[&songId=ID]` - raw MP3 body; matched by ID3 tags unless `songId` is given
+- `POST /jobs/bpm`, `POST /jobs/embeddings` - run the BPM / embedding backlog
+- `POST /jobs/lyrics` `{"songIds": [...]}` - fill lyrics for songs
+- `GET /jobs`, `GET /jobs/{id}` - job status, result and latency
+- `GET /jobs/{id}/events` - progress stream (SSE)
+- `GET /health` - queue depths per pool, Spotify cache/throttle counters
+- `GET /metrics` - Prometheus metrics: job latencies plus the Firestore, Spotify, HTTP and audio
+  operations of all jobs run by this process (`Metrics.py`)
+
+Usage example:
+    uvicorn Ingestion_Service:app --host 0.0.0.0 --port 8000
+
+Notes:
+- Uploaded MP3 bodies are spooled to disk on the thread pool, so the event loop (and every
+  progress stream) keeps running while a large file arrives.
+- While the app runs, `sys.stdout` of the whole process is replaced by the job output router.
+  Output written outside of a job passes through unchanged; output of threads the job functions
+  start without copying their context (plain `threading.Thread`, other executors) is not captured.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import asyncio
+import threading
+import itertools
+import contextvars
+from typing import List, Optional
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel
+
+from Id_Cache import CACHE_DIR
+from Metrics import registry
+
+# Worker pools: concurrent jobs per pool
+POOL_SIZES = {
+    "spotify": 4,  # Spotify URL ingestion (network bound)
+    "audio": 4,  # Single MP3 uploads
+    "enrich": 2,  # Lyrics
+    "batch": 1,  # Whole-backlog jobs (BPM, embeddings, post-upload pipeline); they parallelize internally
+}
+MAX_QUEUED_JOBS = 1000  # Per pool; further submissions get 503
+MAX_KEPT_JOBS = 2000  # Finished jobs kept for status queries
+MAX_JOB_EVENTS = 500  # Most recent progress events kept per job
+SONG_INDEX_MAX_AGE = 600  # Seconds before the MP3 matcher index is rebuilt
+KEEPALIVE_SECONDS = 15
+
+SPOOL_DIR = os.path.join(CACHE_DIR, "spool")
+FINISHED = ("done", "failed")
+
+
+class Job:
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.events = deque(maxlen=MAX_JOB_EVENTS)  # (event, data), the most recent ones
+        self.published = 0  # Events published so far, including the ones no longer kept
+        self.changed = asyncio.Event()
+        self.partial_line = ""
+
+    # Add a progress event and wake up the streams waiting for one (event loop thread only)
+    def publish(self, event, data):
+        self.events.append((event, data))
+        self.published += 1
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    # Kept events after the first `position` ones, as (event ID, event, data); IDs count from 1
+    def events_after(self, position):
+        first = self.published - len(self.events)  # Events dropped from the front
+        start = max(position, first)
+        return [(start + i + 1, event, data)
+                for i, (event, data) in enumerate(itertools.islice(self.events, start - first, None))]
+
+    def latency(self):
+        now = time.time()
+        started = self.started_at or now
+        return {
+            "queuedSeconds": round(started - self.created_at, 3),
+            "runSeconds": round((self.finished_at or now) - started, 3) if self.started_at else 0.0,
+            "totalSeconds": round((self.finished_at or now) - self.created_at, 3),
+        }
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "latency": self.latency(),
+            "events": self.published,
+        }
+
+
+# Job run by the current thread (and by the pool threads it hands work to): (job, event loop)
+current_job = contextvars.ContextVar("current_job", default=(None, None))
+
+
+# Routes print() output written in a job's context into that job's progress events
+class JobOutput(io.TextIOBase):
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        job, loop = current_job.get()
+        if job is None:
+            return self.stream.write(text)
+
+        with self.lock:  # A job's pool threads share its partial line
+            lines = (job.partial_line + text).split("\n")
+            job.partial_line = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.stream.write(f"[{job.kind} {job.id}] {line}\n")
+                loop.call_soon_threadsafe(job.publish, "log", line)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+output = JobOutput(sys.stdout)
+
+
+# Job functions (run on worker threads; modules are imported on first use)
+def run_ingest(params):
+    from Add_Song_To_DB import db, id_cache, extract_batch_info, upload_songs
+    id_cache.warm(db)  # No-op while the cache is fresh
+    infos = extract_batch_info(params["urls"])
+    song_ids = upload_songs(infos)
+    return {"requested": len(params["urls"]), "resolved": len(infos), "songIds": song_ids}
+
+
+song_index_state = {"index": None, "built_at": 0}
+song_index_lock = threading.Lock()
+
+
+# MP3 matcher index, rebuilt from the incrementally refreshed catalog snapshot when stale
+def get_song_index():
+    from Firebase_Setup import db
+    from Song_Matcher import build_song_index
+    with song_index_lock:
+        if time.time() - song_index_state["built_at"] > SONG_INDEX_MAX_AGE:
+            song_index_state["index"] = build_song_index(db, source="snapshot")
+            song_index_state["built_at"] = time.time()
+        return song_index_state["index"]
+
+
+def run_mp3(params):
+    from MP3_Upload import upload_one
+    try:
+        song_index = None if params.get("songId") else get_song_index()
+        song_id, status, download_url = upload_one(params["path"], params["fileName"], params.get("songId"),
+                                                   song_index)
+        return {"songId": song_id, "status": status, "audioUrl": download_url}
+    finally:
+        os.remove(params["path"])
+
+
+def run_bpm(params):
+    from BPM_Update import process_missing_bpm
+    process_missing_bpm()
+    return {}
+
+
+def run_lyrics(params):
+    from Lyrics_Fill_Batch import fill_lyrics_for_songs
+    fill_lyrics_for_songs(params["songIds"])
+    return {}
+
+
+def run_embeddings(params):
+    from Pipeline_Runner import load_script
+    load_script("Songs_Embadding").update_song_embeddings()
+    return {}
+
+
+def run_post_upload(params):
+    from Pipeline_Runner import run_post_upload_pipeline
+    report = run_post_upload_pipeline(params["songIds"])
+    return {name: {"status": status, "seconds": round(seconds, 3)} for name, (status, seconds, _) in report.items()}
+
+
+# Job kind -> (pool, function)
+JOB_KINDS = {
+    "ingest": ("spotify", run_ingest),
+    "mp3": ("audio", run_mp3),
+    "bpm": ("batch", run_bpm),
+    "lyrics": ("enrich", run_lyrics),
+    "embeddings": ("batch", run_embeddings),
+    "post_upload": ("batch", run_post_upload),
+}
+
+
+class JobQueue:
+    def __init__(self):
+        self.jobs = OrderedDict()
+        self.queues = {}
+        self.executors = {}
+        self.workers = []
+
+    async def start(self):
+        for pool, size in POOL_SIZES.items():
+            self.queues[pool] = asyncio.Queue(maxsize=MAX_QUEUED_JOBS)
+            self.executors[pool] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"{pool}-job")
+            self.workers += [asyncio.create_task(self.worker(pool)) for _ in range(size)]
+
+    async def stop(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+
+    def submit(self, kind, params):
+        job = Job(kind, params)
+        pool, _ = JOB_KINDS[kind]
+        try:
+            self.queues[pool].put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail=f"The {pool} queue is full, retry later")
+
+        self.jobs[job.id] = job
+        while len(self.jobs) > MAX_KEPT_JOBS:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.status not in FINISHED:
+                break
+            self.jobs.popitem(last=False)
+        job.publish("status", job.to_dict())
+        return job
+
+    async def worker(self, pool):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queues[pool].get()
+            job.status = "running"
+            job.started_at = time.time()
+            job.publish("status", job.to_dict())
+            try:
+                job.result = await loop.run_in_executor(self.executors[pool], self.run, job, loop)
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+            job.finished_at = time.time()
+            latency = job.latency()
+            registry.observe("job_queued_seconds", latency["queuedSeconds"], kind=job.kind)
+            registry.observe("job_run_seconds", latency["runSeconds"], kind=job.kind)
+            registry.inc("jobs", kind=job.kind, status=job.status)
+
+            if job.status == "done" and job.kind == "ingest" and job.params.get("postProcess") \
+                    and job.result["songIds"]:
+                try:
+                    job.result["followUpJobId"] = self.submit("post_upload", {"songIds": job.result["songIds"]}).id
+                except HTTPException as e:
+                    job.result["followUpError"] = e.detail
+            job.publish("status", job.to_dict())
+            self.queues[pool].task_done()
+
+    # Runs a job function on a worker thread with its output captured as progress events
+    @staticmethod
+    def run(job, loop):
+        token = current_job.set((job, loop))
+        try:
+            return JOB_KINDS[job.kind][1](job.params)
+        finally:
+            current_job.reset(token)
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+        return job
+
+
+job_queue = JobQueue()
+
+
+# Installs the job output router as the process-wide stdout for the lifetime of the app (see Notes)
+@asynccontextmanager
+async def lifespan(app):
+    if sys.stdout is not output:
+        output.stream, sys.stdout = sys.stdout, output
+    await job_queue.start()
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        if sys.stdout is output:
+            sys.stdout = output.stream
+
+
+app = FastAPI(title="QueueMue Ingestion Service", lifespan=lifespan)
+
+
+class SongsRequest(BaseModel):
+    urls: List[str]
+    postProcess: bool = True
+
+
+class LyricsRequest(BaseModel):
+    songIds: List[str]
+
+
+@app.post("/songs", status_code=202)
+async def submit_songs(request: SongsRequest):
+    urls = [url.strip() for url in request.urls if url.strip()]
+    if not urls:
+        raise HTTPException(status_code=400, detail="No Spotify URLs given")
+    return job_queue.submit("ingest", {"urls": urls, "postProcess": request.postProcess}).to_dict()
+
+
+# Deletes a spooled upload, if it was created
+def remove_spooled(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@app.post("/mp3", status_code=202)
+async def submit_mp3(request: Request, filename: str, songId: Optional[str] = None):
+    file_name = os.path.basename(filename)
+    if not file_name.lower().endswith(".mp3"):
+        raise HTTPException(status_code=400, detail="filename must end with .mp3")
+
+    # Spool the body to disk as it arrives, so large uploads are never held in memory; the file
+    # operations run on the thread pool, so they never block the event loop
+    await run_in_threadpool(os.makedirs, SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, f"{uuid.uuid4().hex}_{file_name}")
+    size = 0
+    try:
+        f = await run_in_threadpool(open, path, "wb")
+        try:
+            async for chunk in request.stream():
+                size += await run_in_threadpool(f.write, chunk)
+        finally:
+            await run_in_threadpool(f.close)
+    except BaseException:
+        await run_in_threadpool(remove_spooled, path)
+        raise
+    if not size:
+        await run_in_threadpool(remove_spooled, path)
+        raise HTTPException(status_code=400, detail="Empty request body")
+    return job_queue.submit("mp3", {"path": path, "fileName": file_name, "songId": songId}).to_dict()
+
+
+@app.post("/jobs/lyrics", status_code=202)
+async def submit_lyrics(request: LyricsRequest):
+    return job_queue.submit("lyrics", {"songIds": request.songIds}).to_dict()
+
+
+@app.post("/jobs/{kind}", status_code=202)
+async def submit_backlog_job(kind: str):
+    if kind not in ("bpm", "embeddings"):
+        raise HTTPException(status_code=404, detail=f"Unknown job kind '{kind}'")
+    return job_queue.submit(kind, {}).to_dict()
+
+
+@app.get("/jobs")
+async def list_jobs(limit: int = 50):
+    return [job.to_dict() for job in list(job_queue.jobs.values())[-limit:]]
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return job_queue.get(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    job = job_queue.get(job_id)
+
+    async def events():
+        sent = 0
+        while True:
+            changed = job.changed
+            for sent, event, data in job.events_after(sent):
+                yield f"id: {sent}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            if job.status in FINISHED:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/health")
+async def health():
+    status = {pool: {"queued": queue.qsize(), "workers": POOL_SIZES[pool]} for pool, queue in job_queue.queues.items()}
+    ingest = sys.modules.get("Add_Song_To_DB")  # Loaded by the first ingest job
+    if ingest is not None:
+        status["spotifyClient"] = dict(ingest.spotify.metrics)
+    return status
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.to_prometheus(), media_type="text/plain; version=0.0.4")
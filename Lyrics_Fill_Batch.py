@@ -1,102 +1,246 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-import requests
+import os
 import sys
+import time
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import as_completed
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from Catalog import NEEDS_LYRICS
+from Firebase_Setup import db
+from Firestore_Writer import BatchedWriter, GET_ALL_CHUNK, get_all
+from Id_Cache import CACHE_DIR
+from Incremental_Scan import touch
+from Metrics import ContextThreadPoolExecutor, timed, count_bytes, job_run
 
 """
 This script receives a comma-separated list of song IDs via command line,
 and fills in missing lyrics for each one by calling the lyrics.ovh API.
 
+How it works:
+1. Song documents are read in bulk with `get_all` (only the fields we need).
+2. The artist comes from the song's `artistName`; only songs without it fall back to
+   one bulk read of their `artists` documents.
+3. Lyrics are fetched concurrently (`--workers`) over one pooled HTTP session with timeouts,
+   retrying 429/5xx responses with exponential backoff (honoring `Retry-After`).
+4. Found lyrics are written back through batched Firestore writes.
+
+Notes:
+- (artist, title) pairs the API answered with 404 are remembered in
+  `.queuemue_cache/lyrics_misses.sqlite` for `MISS_TTL` and not queried again until then;
+  pass `--retry-misses` to ignore that cache. Every miss is written as it is found, so jobs running
+  at the same time (e.g. two lyrics jobs in `Ingestion_Service.py`) share the cache without
+  overwriting each other's misses.
+- A song chunk that cannot be read is reported and its songs count as failed; the other chunks
+  are still processed.
+
 Usage example:
 python Lyrics_Fill_Batch.py SONG_ID1,SONG_ID2,SONG_ID3
 """
 
-# Initialize Firebase connection
-cred = credentials.Certificate(r"C:\Users\Yinon\PycharmProjects\QueueMue_Adding_Songs_To_DB\queuemueue-firebase-admin.json")
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Lyrics API settings
+LYRICS_API_URL = "https://api.lyrics.ovh/v1/{artist}/{title}"
+DEFAULT_WORKERS = 8
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) seconds
+# Retries of a failed request; with urllib3 2.x the backoff is backoff_factor * 2 ** (n - 1) before the
+# n-th retry except the first, i.e. 0s, 2s, 4s, 8s (a `Retry-After` header takes precedence)
+MAX_RETRIES = 4
+RETRY_BACKOFF_FACTOR = 1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Known misses are re-checked after 30 days, lyrics do get added over time
+MISSES_PATH = os.path.join(CACHE_DIR, "lyrics_misses.sqlite")
+MISS_TTL = 30 * 24 * 3600
+
+MISSES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS misses (
+    key TEXT PRIMARY KEY,
+    missed_at REAL NOT NULL
+);
+"""
+
+SONG_FIELDS = ["title", "artistName", "artistId", "lyrics"]
+
+
+# Shared HTTP session: pooled keep-alive connections for all workers, retries with exponential backoff
+def create_session(workers=DEFAULT_WORKERS):
+    retry = Retry(total=MAX_RETRIES, backoff_factor=RETRY_BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=["GET"], respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Persistent set of (artist, title) pairs the lyrics API does not know, in a SQLite file shared by
+# concurrent jobs (each change is committed at once, so no job overwrites another one's misses)
+class LyricsMissCache:
+    def __init__(self, path=MISSES_PATH, ttl=MISS_TTL):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.executescript(MISSES_SCHEMA)
+
+    @staticmethod
+    def key(artist, title):
+        return f"{artist.strip().lower()}\t{title.strip().lower()}"
+
+    def contains(self, artist, title):
+        with self.lock:
+            row = self.conn.execute("SELECT missed_at FROM misses WHERE key = ?", (self.key(artist, title),)).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def add(self, artist, title):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO misses (key, missed_at) VALUES (?, ?)",
+                              (self.key(artist, title), time.time()))
+
+    def discard(self, artist, title):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM misses WHERE key = ?", (self.key(artist, title),))
+
+    # Drop expired misses and close the file
+    def close(self):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM misses WHERE missed_at < ?", (time.time() - self.ttl,))
+            self.conn.close()
+
+
+# Read song documents in bulk; returns {song_id: data} for the songs that exist and could be read
+def get_songs(song_ids):
+    songs = {}
+    for i in range(0, len(song_ids), GET_ALL_CHUNK):
+        refs = [db.collection("songs").document(song_id) for song_id in song_ids[i:i + GET_ALL_CHUNK]]
+        try:
+            for doc in get_all(db, refs, field_paths=SONG_FIELDS):
+                if doc.exists:
+                    songs[doc.id] = doc.to_dict()
+        except Exception as e:
+            print(f"❌ Error fetching songs {refs[0].id}..{refs[-1].id}: {e}")
+    return songs
+
+
+# Fetch artist names by artist document IDs in bulk; returns {artist_id: name}
+def get_artist_names_by_ids(artist_ids):
+    artist_ids = list(artist_ids)
+    names = {}
+    for i in range(0, len(artist_ids), GET_ALL_CHUNK):
+        refs = [db.collection("artists").document(artist_id) for artist_id in artist_ids[i:i + GET_ALL_CHUNK]]
+        try:
+            for doc in get_all(db, refs, field_paths=["name"]):
+                if doc.exists and doc.to_dict().get("name"):
+                    names[doc.id] = doc.to_dict()["name"]
+        except Exception as e:
+            print(f"❌ Error fetching artist names: {e}")
+    return names
 
-# Fetch artist name by artist document ID
-def get_artist_name_by_id(artist_id):
-    try:
-        doc = db.collection("artists").document(artist_id).get()
-        if doc.exists:
-            return doc.to_dict().get("name", "")
-    except Exception as e:
-        print(f"❌ Error fetching artist name: {e}")
-    return None
 
-# Fetch lyrics from external API (lyrics.ovh)
-def fetch_lyrics(artist, title):
+# Fetch lyrics from external API (lyrics.ovh); returns (status_code, lyrics), status_code None on network errors
+def fetch_lyrics(session, artist, title):
     try:
         print(f"🌐 Fetching lyrics for: {artist} – {title}")
-        url = f"https://api.lyrics.ovh/v1/{artist}/{title}"
-        response = requests.get(url)
+        url = LYRICS_API_URL.format(artist=quote(artist, safe=""), title=quote(title, safe=""))
+        with timed("lyrics.request"):
+            response = session.get(url, timeout=REQUEST_TIMEOUT)
+        count_bytes("lyrics.request", received=len(response.content))
         if response.status_code == 200:
-            return response.json().get("lyrics", "")
-        else:
-            print(f"⚠️ Not found: {response.status_code}")
+            return 200, response.json().get("lyrics", "")
+        print(f"⚠️ Not found: {response.status_code}")
+        return response.status_code, None
     except Exception as e:
         print(f"❌ Error fetching lyrics: {e}")
-    return None
+    return None, None
 
 # Fill missing lyrics for a list of song IDs
-def fill_lyrics_for_songs(song_ids):
+def fill_lyrics_for_songs(song_ids, workers=DEFAULT_WORKERS, retry_misses=False):
     updated = 0
     skipped = 0
     failed = 0
+    known_misses = 0
 
+    song_ids = list(dict.fromkeys(song_ids))
+    songs = get_songs(song_ids)
     for song_id in song_ids:
-        print(f"\n🎯 Processing: {song_id}")
-        try:
-            doc_ref = db.collection("songs").document(song_id)
-            doc = doc_ref.get()
-            if not doc.exists:
-                print(f"❌ Song '{song_id}' not found.")
-                failed += 1
-                continue
-
-            data = doc.to_dict()
-            title = data.get("title", "").strip()
-            artist_id = data.get("artistId")
-            lyrics = data.get("lyrics", "")
+        if song_id not in songs:
+            print(f"❌ Song '{song_id}' not found or could not be read.")
+            failed += 1
 
-            if lyrics:
-                print("⏭️ Already has lyrics.")
-                skipped += 1
-                continue
+    # Only songs without a denormalized artistName need their artist document
+    missing_names = {data.get("artistId") for data in songs.values()
+                     if not data.get("lyrics") and not data.get("artistName") and data.get("artistId")}
+    artist_names = get_artist_names_by_ids(missing_names) if missing_names else {}
+
+    misses = LyricsMissCache()
+    pending = []  # (song_id, artist, title)
+    for song_id, data in songs.items():
+        title = data.get("title", "").strip()
+        if data.get("lyrics"):
+            skipped += 1
+            continue
+
+        artist_name = data.get("artistName") or artist_names.get(data.get("artistId"))
+        if not artist_name or not title:
+            print(f"❌ Artist not found for '{song_id}' (artist ID: {data.get('artistId')})")
+            failed += 1
+        elif not retry_misses and misses.contains(artist_name, title):
+            known_misses += 1
+        else:
+            pending.append((song_id, artist_name, title))
 
-            artist_name = get_artist_name_by_id(artist_id)
-            if not artist_name:
-                print(f"❌ Artist not found for ID: {artist_id}")
-                failed += 1
-                continue
+    print(f"🎯 {len(pending)} songs to fetch, {skipped} already have lyrics, {known_misses} known misses.")
 
-            found_lyrics = fetch_lyrics(artist_name, title)
+    session = create_session(workers)
+    with ContextThreadPoolExecutor(max_workers=workers) as pool, BatchedWriter(db) as writer:
+        futures = {pool.submit(fetch_lyrics, session, artist, title): (song_id, artist, title)
+                   for song_id, artist, title in pending}
+        for future in as_completed(futures):
+            song_id, artist_name, title = futures[future]
+            status, found_lyrics = future.result()
             if found_lyrics:
-                doc_ref.update({"lyrics": found_lyrics})
+                writer.update(db.collection("songs").document(song_id), touch({"lyrics": found_lyrics, NEEDS_LYRICS: False}))
+                misses.discard(artist_name, title)
                 print(f"✅ Updated lyrics for '{title}' by {artist_name}")
                 updated += 1
             else:
+                # Only a definite "not found" is cached; timeouts and 5xx are retried next run
+                if status in (200, 404):
+                    misses.add(artist_name, title)
                 failed += 1
 
-        except Exception as e:
-            print(f"❌ Error processing '{song_id}': {e}")
-            failed += 1
+    failed += len(writer.errors)
+    updated -= len(writer.errors)
+    misses.close()
 
     print("\n📊 Lyrics Update Summary:")
     print(f"✅ Updated: {updated}")
     print(f"⏭ Skipped: {skipped}")
+    print(f"🚫 Known misses: {known_misses}")
     print(f"❌ Failed: {failed}")
 
 
-# Read song IDs from command-line arguments and run the update
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
+# Command-line entry point (`python Lyrics_Fill_Batch.py` or `python QueueMue_CLI.py lyrics`)
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Fill missing lyrics for songs")
+    parser.add_argument("song_ids", help="comma-separated list of song IDs")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="concurrent lyrics requests")
+    parser.add_argument("--retry-misses", action="store_true", help="query songs the API recently answered 404 for")
+    args = parser.parse_args(argv)
+
+    song_ids = [sid.strip() for sid in args.song_ids.split(",") if sid.strip()]
+    if not song_ids:
         print("❌ Please provide a comma-separated list of song IDs.")
         sys.exit(1)
+    with job_run("lyrics"):
+        fill_lyrics_for_songs(song_ids, args.workers, args.retry_misses)
+
 
-    song_ids_str = sys.argv[1]
-    song_ids = [sid.strip() for sid in song_ids_str.split(",") if sid.strip()]
-    fill_lyrics_for_songs(song_ids)
+if __name__ == "__main__":
+    cli()
@@ -1,147 +1,298 @@
 import os
-import subprocess
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
+import json
+import argparse
+from concurrent.futures import as_completed
 from mutagen.easyid3 import EasyID3
 from mutagen.mp3 import MP3
 
+from Audio_Analysis import FEATURES_COLLECTION, features_current, song_feature_fields
+from Catalog import NEEDS_AUDIO, NEEDS_BPM
+from Firebase_Setup import db, bucket, BUCKET_NAME
+from Feature_Store import FeatureStore, file_hashes, storage_object_key
+from Firestore_Writer import BatchedWriter
+from Song_Matcher import build_song_index
+from Incremental_Scan import touch
+from Pipeline_Runner import run_post_mp3_pipeline
+from Metrics import ContextThreadPoolExecutor, timed, count_bytes, job_run
+
 """
 This script scans a local folder for MP3 files, extracts the title metadata from each file,
-and uploads the corresponding file to Firebase Storage if a matching song document (by title) exists in Firestore.
+and uploads the corresponding file to Firebase Storage if a matching song document exists in Firestore.
 Once uploaded, it updates the `audioUrl` field in the Firestore song document with the public URL of the uploaded file.
 
 Features:
 - Reads `.mp3` files from a specified local directory.
-- Extracts `title` from ID3 metadata using `mutagen`.
-- Matches the extracted title with song documents in Firestore (`songs` collection).
+- Extracts `title`, `artist` and the track length from the MP3 using `mutagen`.
+- Matches them against song documents in Firestore (`songs` collection) with a fuzzy trigram index
+  (`Song_Matcher.py`), cross-checking artist and `duration`.
 - Uploads matched files to Firebase Storage under the `songs/` directory.
 - Sets the uploaded file to be public and updates the song document with the `audioUrl`.
 - Generates log files for successful and failed uploads.
+- Uploads run in parallel on a thread pool (`--workers`); files larger than `RESUMABLE_THRESHOLD`
+  use chunked, resumable uploads.
+- Files whose local MD5 equals the existing blob's `md5Hash` are not uploaded again.
+- Progress is saved to `logs/upload_checkpoint.json` (keyed by the file's full path) after every
+  committed batch of `audioUrl` updates, so an interrupted run resumes where it stopped.
+- `audioUrl` updates are written through batched Firestore writes (`Firestore_Writer.py`).
+- Looks up each file's content hash in the local feature store (`Feature_Store.py`): if the same audio
+  was analyzed before (with the current `FEATURES_VERSION`), its BPM, `featuresVersion` and scalar
+  features are written together with `audioUrl`, and its full feature vector to `audio_features/{id}`,
+  exactly as `BPM_Update.py` writes them, so neither a normal nor a `--refresh-features` run analyzes
+  it again. Features of an older version only contribute the BPM.
 
 Technologies used:
 - `firebase-admin` for Firestore and Firebase Storage operations.
 - `mutagen` to read ID3 metadata from MP3 files.
 - `os` and file I/O for filesystem operations and logging.
 
-Logs:
+Logs (in a `logs` folder inside the uploaded folder):
 - `uploaded_log.txt` — Lists all successfully uploaded songs and their download URLs.
 - `failed_log.txt` — Lists all files that failed to upload, including reasons (missing title, not found in DB, etc.).
 
 Configuration:
-- `FOLDER_PATH`: Path to the folder containing `.mp3` files.
-- `CREDENTIALS_PATH`: Path to your Firebase Admin SDK JSON credentials.
-- `BUCKET_NAME`: Firebase Storage bucket (e.g., `your-project-id.appspot.com`).
+- `FOLDER_PATH`: Default folder containing the `.mp3` files (`--folder` overrides it).
+- Firebase credentials and the Storage bucket are configured in `Firebase_Setup.py`.
 
 Notes:
-- File matching is based **only** on the lowercase `title` field in metadata and Firestore.
-- Songs in Firestore **must already exist** with a matching `title` before running this script.
+- Matching tolerates accents, punctuation and suffixes like "(feat. X)" or " - Remastered";
+  ambiguous or low-scoring matches are logged to `failed_log.txt` with the reason.
+- Songs in Firestore **must already exist** before running this script.
+- Storage lookups, uploads and uploaded bytes are recorded in the run's metrics (`Metrics.py`).
 """
 
 # Configuration
 FOLDER_PATH = r"C:\Users\yinon\Desktop\SongsToUpload"
-BUCKET_NAME = 'queuemueue.firebasestorage.app'
-LOGS_FOLDER = os.path.join(FOLDER_PATH, 'logs')
-CREDENTIALS_PATH = r"C:\Users\Yinon\PycharmProjects\QueueMue_Adding_Songs_To_DB\queuemueue-firebase-admin.json"
-
-# Create logs folder if it doesn't exist
-os.makedirs(LOGS_FOLDER, exist_ok=True)
-uploaded_log_path = os.path.join(LOGS_FOLDER, "uploaded_log.txt")
-failed_log_path = os.path.join(LOGS_FOLDER, "failed_log.txt")
-
-# Initialize Firebase connection
-cred = credentials.Certificate(CREDENTIALS_PATH)
-firebase_admin.initialize_app(cred, {
-    'storageBucket': BUCKET_NAME
-})
-
-db = firestore.client()
-bucket = storage.bucket()
-
-# Test Firestore connection and load existing songs
-try:
-    songs_ref = db.collection('songs').stream()
-    songs_by_title = {}
-    count = 0
-    for song in songs_ref:
-        data = song.to_dict()
-        title = data.get('title', '').strip()
-        if title:
-            songs_by_title[title.lower()] = song.id
-            count += 1
-    print(f"🔍 Connected to Firestore! Found {count} songs.")
-except Exception as e:
-    print(f"❌ Error connecting to Firestore: {str(e)}")
-    exit()
-
-# Extract the title from MP3 file metadata using mutagen
-def get_title_from_metadata(file_path):
+LOGS_FOLDER_NAME = 'logs'  # Created inside the uploaded folder by `upload_all`
+
+# Upload tuning
+DEFAULT_WORKERS = 8
+DEFAULT_FLUSH_SIZE = 100
+RESUMABLE_THRESHOLD = 8 * 1024 * 1024  # Files above this size use chunked, resumable uploads
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Must be a multiple of 256 KB
+
+# Extract (title, artist, length in seconds) from MP3 file metadata using mutagen
+def get_metadata(file_path):
     try:
         audio = MP3(file_path, ID3=EasyID3)
         title = audio.get('title', [None])[0]
-        return title.strip() if title else None
+        artist = audio.get('artist', [None])[0]
+        return (title.strip() if title else None,
+                artist.strip() if artist else None,
+                int(audio.info.length) if audio.info else None)
     except Exception as e:
         print(f"⚠️ Error reading metadata from '{file_path}': {e}")
-        return None
+        return None, None, None
 
-# Process and upload each MP3 file
-files = [f for f in os.listdir(FOLDER_PATH) if f.lower().endswith(".mp3")]
-uploaded_log, failed_log = [], []
+# Local cache of features of already-analyzed audio
+feature_store = FeatureStore()
 
-print(f"\n📁 Found {len(files)} MP3 files to process.\n")
+# Paths of the (uploaded log, failed log, checkpoint) of a run
+def log_paths(logs_folder):
+    return (os.path.join(logs_folder, "uploaded_log.txt"),
+            os.path.join(logs_folder, "failed_log.txt"),
+            os.path.join(logs_folder, "upload_checkpoint.json"))
 
-for file_name in files:
-    local_path = os.path.join(FOLDER_PATH, file_name)
+# Load the checkpoint of files completed by previous runs: full file path -> {md5, songId, audioUrl}
+def load_checkpoint(checkpoint_path):
+    try:
+        with open(checkpoint_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
 
-    title = get_title_from_metadata(local_path)
-    if not title:
-        print(f"❌ No title found in metadata: {file_name}")
-        failed_log.append(f"{file_name} -> MISSING TITLE")
-        continue
+# Save the checkpoint atomically
+def save_checkpoint(checkpoint, checkpoint_path):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, checkpoint_path)
 
-    key = title.lower()
-    if key not in songs_by_title:
-        print(f"❌ Song not found in Firestore: '{title}' (from file: {file_name})")
-        failed_log.append(f"{file_name} -> TITLE NOT FOUND IN DB: {title}")
-        continue
+# Upload one file (runs on a worker thread); returns ((song_update, audio_features or None, md5) or None,
+# status, download_url)
+def upload_file(file_name, local_path, title, song_id, checkpoint_entry):
+    content_hash, md5 = file_hashes(local_path)
+    if checkpoint_entry and checkpoint_entry.get('md5') == md5 and checkpoint_entry.get('songId') == song_id:
+        return None, "resumed", checkpoint_entry['audioUrl']
 
-    song_id = songs_by_title[key]
+    cached_features = feature_store.get(content_hash) or {}
     firebase_path = f"songs/{file_name}"
 
-    try:
-        blob = bucket.blob(firebase_path)
-        blob.upload_from_filename(local_path)
+    with timed("storage.get_blob"):
+        blob = bucket.get_blob(firebase_path)
+    if blob is not None and blob.md5_hash == md5:
+        status = "unchanged"
+    else:
+        size = os.path.getsize(local_path)
+        chunk_size = UPLOAD_CHUNK_SIZE if size > RESUMABLE_THRESHOLD else None
+        blob = bucket.blob(firebase_path, chunk_size=chunk_size)
+        with timed("storage.upload"):
+            blob.upload_from_filename(local_path, content_type="audio/mpeg")
+        count_bytes("storage.upload", sent=size)
+        status = "uploaded"
+
+    # Also for unchanged blobs: a previous run may have stopped between upload and make_public
+    with timed("storage.make_public"):
         blob.make_public()
-        download_url = blob.public_url
 
-        db.collection('songs').document(song_id).update({
-            'audioUrl': download_url
-        })
+    download_url = blob.public_url
+    feature_store.link_object(storage_object_key(BUCKET_NAME, firebase_path, blob.generation), content_hash)
+
+    song_update = touch({'audioUrl': download_url, NEEDS_AUDIO: False})
+    audio_features = None
+    if features_current(cached_features):
+        audio_features = cached_features
+        song_update.update(song_feature_fields(cached_features))
+        song_update[NEEDS_BPM] = False
+        print(f"♻️ Reusing cached features (BPM = {cached_features['bpm']}) for '{title}'")
+    elif cached_features.get('bpm'):
+        song_update['bpm'] = cached_features['bpm']
+        song_update[NEEDS_BPM] = False
+        print(f"♻️ Reusing cached BPM = {cached_features['bpm']} for '{title}'")
+    return (song_update, audio_features, md5), status, download_url
 
-        print(f"✅ Uploaded: {file_name} -> title: '{title}'")
-        uploaded_log.append(f"{file_name} -> {download_url}")
+# Upload a single MP3 (e.g. one received by `Ingestion_Service.py`) and link it to its song.
+# The file is matched by its ID3 tags unless song_id is given; returns (song_id, status, download_url).
+def upload_one(local_path, file_name=None, song_id=None, song_index=None):
+    file_name = file_name or os.path.basename(local_path)
+    title, artist, length = get_metadata(local_path)
+    if song_id is None:
+        if not title:
+            raise ValueError(f"{file_name} -> MISSING TITLE")
+        song_id, score = (song_index or build_song_index(db)).match(title, artist, length)
+        if not song_id:
+            raise LookupError(f"{file_name} -> TITLE NOT FOUND IN DB: {title} ({score})")
+
+    (song_update, audio_features, _), status, download_url = upload_file(file_name, local_path, title or file_name,
+                                                                         song_id, None)
+    db.collection('songs').document(song_id).update(song_update)
+    if audio_features:
+        db.collection(FEATURES_COLLECTION).document(song_id).set(audio_features)
+    print(f"✅ {status.capitalize()}: {file_name} -> {song_id}")
+    return song_id, status, download_url
+
+# Upload all matched files in parallel and batch their Firestore updates.
+# Logs and the checkpoint go to `<folder_path>/logs` unless logs_folder is given.
+def upload_all(folder_path, workers=DEFAULT_WORKERS, flush_size=DEFAULT_FLUSH_SIZE, logs_folder=None):
+    # Test Firestore connection and index existing songs
+    try:
+        song_index = build_song_index(db)
+        print(f"🔍 Connected to Firestore! Indexed {len(song_index)} songs.")
     except Exception as e:
-        print(f"❌ Upload error for {file_name}: {str(e)}")
-        failed_log.append(f"{file_name} -> ERROR: {str(e)}")
+        print(f"❌ Error connecting to Firestore: {str(e)}")
+        raise
+
+    files = [f for f in os.listdir(folder_path) if f.lower().endswith(".mp3")]
+    logs_folder = logs_folder or os.path.join(folder_path, LOGS_FOLDER_NAME)
+    uploaded_log_path, failed_log_path, checkpoint_path = log_paths(logs_folder)
+    os.makedirs(logs_folder, exist_ok=True)
+    uploaded_log, failed_log = [], []
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    print(f"\n📁 Found {len(files)} MP3 files to process.\n")
+
+    jobs = []
+    for file_name in files:
+        local_path = os.path.join(folder_path, file_name)
+
+        title, artist, length = get_metadata(local_path)
+        if not title:
+            print(f"❌ No title found in metadata: {file_name}")
+            failed_log.append(f"{file_name} -> MISSING TITLE")
+            continue
+
+        song_id, score = song_index.match(title, artist, length)
+        if not song_id:
+            print(f"❌ Song not found in Firestore: '{title}' (from file: {file_name}) - {score}")
+            failed_log.append(f"{file_name} -> TITLE NOT FOUND IN DB: {title} ({score})")
+            continue
+        if score < 1:
+            print(f"🔎 Fuzzy match: '{title}' -> {song_id} (score {score:.2f})")
+
+        jobs.append((file_name, local_path, title, song_id))
+
+    writer = BatchedWriter(db, flush_size=500)
+    unflushed = []  # (file_name, local_path, song_id, md5, download_url) waiting for the next batch commit
+    errors_seen = 0  # writer.errors before this batch
+
+    # Commit pending audioUrl updates and checkpoint the files whose update succeeded
+    def commit_batch():
+        nonlocal errors_seen
+        writer.flush()
+        failed_paths = {path for path, _ in writer.errors[errors_seen:]}
+        errors_seen = len(writer.errors)
+        for file_name, local_path, song_id, md5, download_url in unflushed:
+            if f"songs/{song_id}" in failed_paths or f"{FEATURES_COLLECTION}/{song_id}" in failed_paths:
+                failed_log.append(f"{file_name} -> ERROR: Firestore update failed")
+                continue
+            checkpoint[os.path.abspath(local_path)] = {'md5': md5, 'songId': song_id, 'audioUrl': download_url}
+            uploaded_log.append(f"{file_name} -> {download_url}")
+        unflushed.clear()
+        save_checkpoint(checkpoint, checkpoint_path)
+
+    with ContextThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(upload_file, file_name, local_path, title, song_id,
+                               checkpoint.get(os.path.abspath(local_path))):
+                   (file_name, local_path, title, song_id)
+                   for file_name, local_path, title, song_id in jobs}
+
+        for future in as_completed(futures):
+            file_name, local_path, title, song_id = futures[future]
+            try:
+                update, status, download_url = future.result()
+            except Exception as e:
+                print(f"❌ Upload error for {file_name}: {str(e)}")
+                failed_log.append(f"{file_name} -> ERROR: {str(e)}")
+                continue
+
+            if update is None:
+                print(f"⏭️ Already done in a previous run: {file_name}")
+                uploaded_log.append(f"{file_name} -> {download_url}")
+                continue
+
+            song_update, audio_features, md5 = update
+            label = "Uploaded" if status == "uploaded" else "Unchanged, linked"
+            print(f"✅ {label}: {file_name} -> title: '{title}'")
+            writer.update(db.collection('songs').document(song_id), song_update)
+            if audio_features:
+                writer.set(db.collection(FEATURES_COLLECTION).document(song_id), audio_features)
+            unflushed.append((file_name, local_path, song_id, md5, download_url))
+            if len(unflushed) >= flush_size:
+                commit_batch()
+
+    commit_batch()
+
+    # Write logs to file
+    with open(uploaded_log_path, 'w', encoding='utf-8') as f:
+        f.write("✅ Successfully uploaded:\n" + "\n".join(uploaded_log))
+
+    with open(failed_log_path, 'w', encoding='utf-8') as f:
+        f.write("❌ Failed uploads:\n" + "\n".join(failed_log))
 
-# Write logs to file
-with open(uploaded_log_path, 'w', encoding='utf-8') as f:
-    f.write("✅ Successfully uploaded:\n" + "\n".join(uploaded_log))
+    print("\n📄 Logs written to:")
+    print(f"  📁 Success: {uploaded_log_path}")
+    print(f"  📁 Failures: {failed_log_path}")
 
-with open(failed_log_path, 'w', encoding='utf-8') as f:
-    f.write("❌ Failed uploads:\n" + "\n".join(failed_log))
+# Command-line entry point (`python MP3_Upload.py` or `python QueueMue_CLI.py upload-mp3`)
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Upload local MP3 files to Firebase Storage")
+    parser.add_argument("--folder", default=FOLDER_PATH, help="folder containing the .mp3 files")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="parallel uploads")
+    parser.add_argument("--flush-size", type=int, default=DEFAULT_FLUSH_SIZE,
+                        help="audioUrl updates committed (and checkpointed) per Firestore batch")
+    args = parser.parse_args(argv)
 
-print("\n📄 Logs written to:")
-print(f"  📁 Success: {uploaded_log_path}")
-print(f"  📁 Failures: {failed_log_path}")
+    with job_run("mp3_upload"):
+        upload_all(args.folder, args.workers, min(args.flush_size, 500))
+        feature_store.close()
 
-# Run BPM update script after uploads
-print("\n🚀 Running BPM_Update.py to calculate BPM...")
+        # Run the BPM update in-process after uploads
+        print("\n🚀 Running BPM update to calculate BPM...")
+        report = run_post_mp3_pipeline()
 
-venv_python = r"C:\Users\yinon\PycharmProjects\quemueFirestoreAddSongs\venv\Scripts\python.exe"
-bpm_script = os.path.join(os.getcwd(), "BPM_Update.py")
-result = subprocess.run([venv_python, bpm_script])
+    if all(status == "ok" for status, _, _ in report.values()):
+        print("✅ BPM update completed successfully.")
+    else:
+        print("❌ Error running BPM update.")
 
-if result.returncode == 0:
-    print("✅ BPM_Update.py completed successfully.")
-else:
-    print("❌ Error running BPM_Update.py.")
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,343 @@
+"""
+Per-operation instrumentation shared by all QueueMue jobs.
+
+The jobs used to report only emoji progress lines and final `updated/skipped/failed` counters, which
+does not say where a run's wall time goes. The shared layers (Firestore writer and scans, Spotify
+client, lyrics and audio HTTP, Storage uploads, audio decodes, model encodes) record every call here.
+
+How it works:
+1. `timed("op")` measures one call into a latency histogram (`LATENCY_BUCKETS`) labeled with the
+   operation, and counts the calls that raised.
+2. `timed_stream("op", iterable)` measures a streamed query: the time spent waiting for documents
+   (not the time the caller spends on them) and the number of documents read.
+3. `count_docs(...)`, `count_bytes(...)` and `count(...)` add documents read/written, bytes
+   transferred and other counters.
+4. A job wraps its run in `job_run("bpm")`. At the end of the run it appends a structured JSON line
+   to `<metrics dir>/<job>.jsonl`, writes a Prometheus text file `<metrics dir>/<job>.prom` (for
+   node_exporter's textfile collector) and prints the operations that took the most time.
+5. With `QUEUEMUE_PROFILE=cprofile` (or `pyinstrument`, if installed) the run is also profiled,
+   into `<metrics dir>/<job>.prof` (or `<job>.html`).
+
+Usage example:
+    with timed("lyrics.request"):
+        response = session.get(url)
+
+    with job_run("lyrics"):
+        fill_lyrics_for_songs(song_ids)
+
+Notes:
+- The metrics directory is `.queuemue_cache/metrics/`, or `QUEUEMUE_METRICS_DIR` when set.
+- Worker processes (BPM analyzers) record into their own registry; `registry.drain()` there and
+  `registry.merge(...)` in the parent carries their measurements over.
+- Everything is kept in memory per process; the overhead is one lock and a few additions per call.
+- The jobs' inner thread pools are `ContextThreadPoolExecutor`s: their tasks run in the submitting
+  thread's `contextvars` context, so per-job state (e.g. which job of `Ingestion_Service.py` a
+  print belongs to) follows the work into the pool.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from Id_Cache import CACHE_DIR
+
+METRICS_DIR = os.getenv("QUEUEMUE_METRICS_DIR") or os.path.join(CACHE_DIR, "metrics")
+PREFIX = "queuemue"
+
+# Histogram bucket upper bounds (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Operations listed in the end-of-run summary
+SUMMARY_TOP = 8
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot: above the largest bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Latency below which the given share of observations fall (upper bucket bound)
+    def quantile(self, q):
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+    def merge(self, data):
+        for i, count in enumerate(data["counts"]):
+            self.counts[i] += count
+        self.sum += data["sum"]
+        self.count += data["count"]
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> number
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        if not amount:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": [{"name": name, "labels": dict(labels), **histogram.to_dict()}
+                               for (name, labels), histogram in self.histograms.items()],
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self.counters.items()],
+            }
+
+    # Returns everything recorded so far and starts over (used by worker processes)
+    def drain(self):
+        snapshot = self.snapshot()
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        for item in snapshot["histograms"]:
+            key = self._key(item["name"], item["labels"])
+            with self.lock:
+                self.histograms.setdefault(key, Histogram()).merge(item)
+        for item in snapshot["counters"]:
+            self.inc(item["name"], item["value"], **item["labels"])
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    # Prometheus text exposition format
+    def to_prometheus(self, extra_labels=None):
+        extra = dict(extra_labels or {})
+
+        def label_text(labels, **more):
+            pairs = {**extra, **dict(labels), **more}
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs.items()) + "}"
+
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        seen = set()
+        for (name, labels), histogram in histograms:
+            metric = f"{PREFIX}_{name}"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} histogram")
+                seen.add(metric)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{metric}_bucket{label_text(labels, le=le)} {cumulative}")
+            lines.append(f"{metric}_sum{label_text(labels)} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{label_text(labels)} {histogram.count}")
+
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Process-wide registry used by all instrumented layers
+registry = Registry()
+
+
+# Thread pool whose tasks run in a copy of the submitting thread's context
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Measures one operation (latency histogram, error counter)
+@contextmanager
+def timed(op, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        registry.inc("operation_errors", op=op, **labels)
+        raise
+    finally:
+        registry.observe("operation_seconds", time.perf_counter() - start, op=op, **labels)
+
+
+# Yields from a streamed query, measuring the time spent waiting for documents and counting them
+def timed_stream(op, iterable, **labels):
+    iterator = iter(iterable)
+    waited = 0.0
+    docs = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                waited += time.perf_counter() - start
+                return
+            waited += time.perf_counter() - start
+            docs += 1
+            yield item
+    finally:
+        registry.observe("operation_seconds", waited, op=op, **labels)
+        count_docs(op, read=docs)
+
+
+def count_docs(op, read=0, written=0):
+    registry.inc("documents_read", read, op=op)
+    registry.inc("documents_written", written, op=op)
+
+
+def count_bytes(op, received=0, sent=0):
+    registry.inc("bytes_received", received, op=op)
+    registry.inc("bytes_sent", sent, op=op)
+
+
+def count(name, amount=1, **labels):
+    registry.inc(name, amount, **labels)
+
+
+# Starts the profiler named by QUEUEMUE_PROFILE (or the argument); returns (kind, profiler) or None
+def start_profiler(kind=None):
+    kind = (kind or os.getenv("QUEUEMUE_PROFILE") or "").lower()
+    if kind == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return kind, profiler
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("⚠️ pyinstrument is not installed, profiling with cProfile instead.")
+            return start_profiler("cprofile")
+        profiler = Profiler()
+        profiler.start()
+        return kind, profiler
+    if kind:
+        print(f"⚠️ Unknown profiler '{kind}' (use cprofile or pyinstrument).")
+    return None
+
+
+def stop_profiler(profiling, job, metrics_dir=METRICS_DIR):
+    if profiling is None:
+        return None
+    kind, profiler = profiling
+    if kind == "cprofile":
+        profiler.disable()
+        path = os.path.join(metrics_dir, f"{job}.prof")
+        profiler.dump_stats(path)
+    else:
+        profiler.stop()
+        path = os.path.join(metrics_dir, f"{job}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+    print(f"🔬 Profile written to {path}")
+    return path
+
+
+# Prints the operations that took the most time in this run
+def print_summary(job, seconds):
+    with registry.lock:
+        histograms = [(dict(labels), histogram) for (name, labels), histogram in registry.histograms.items()
+                      if name == "operation_seconds"]
+    if not histograms:
+        return
+    histograms.sort(key=lambda item: item[1].sum, reverse=True)
+    print(f"\n🧭 [{job}] Where the time went ({seconds:.1f}s wall time; parallel calls overlap):")
+    for labels, histogram in histograms[:SUMMARY_TOP]:
+        name = labels.pop("op")
+        extra = f" {labels}" if labels else ""
+        print(f"  {name + extra:<32} {histogram.count:>7} calls {histogram.sum:>9.1f}s "
+              f"(p50 ≤ {histogram.quantile(0.5)}s, p95 ≤ {histogram.quantile(0.95)}s)")
+
+
+# Writes the JSON log line and the Prometheus text file of a finished run
+def write_report(job, seconds, status, metrics_dir=METRICS_DIR):
+    os.makedirs(metrics_dir, exist_ok=True)
+    finished_at = datetime.now(timezone.utc)
+
+    with open(os.path.join(metrics_dir, f"{job}.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"timestamp": finished_at.isoformat(), "job": job, "status": status,
+                            "seconds": round(seconds, 3), **registry.snapshot()}) + "\n")
+
+    labels = f'{{job="{_escape(job)}"}}'
+    text = registry.to_prometheus({"job": job}) + "\n".join([
+        f"# TYPE {PREFIX}_job_duration_seconds gauge",
+        f"{PREFIX}_job_duration_seconds{labels} {seconds:.3f}",
+        f"# TYPE {PREFIX}_job_success gauge",
+        f"{PREFIX}_job_success{labels} {1 if status == 'ok' else 0}",
+        f"# TYPE {PREFIX}_job_last_run_timestamp_seconds gauge",
+        f"{PREFIX}_job_last_run_timestamp_seconds{labels} {finished_at.timestamp():.0f}",
+    ]) + "\n"
+    path = os.path.join(metrics_dir, f"{job}.prom")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Wraps a job's run: optional profiling, then the summary, JSON log and Prometheus file at the end
+@contextmanager
+def job_run(job, profile=None, metrics_dir=METRICS_DIR):
+    os.makedirs(metrics_dir, exist_ok=True)
+    profiling = start_profiler(profile)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield registry
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stop_profiler(profiling, job, metrics_dir)
+        print_summary(job, seconds)
+        path = write_report(job, seconds, status, metrics_dir)
+        print(f"📈 Metrics written to {path}")
@@ -0,0 +1,189 @@
+"""
+In-process pipeline runner for the post-upload jobs.
+
+Replaces the subprocess chain (`Add_Song_To_DB.py` -> playlists / missing-MP3 report / lyrics,
+`MP3_Upload.py` -> BPM) that started a new interpreter per job, re-initialized Firebase in each
+one and re-scanned the `songs` collection for every job.
+
+How it works:
+1. A pipeline is a list of `Step(name, func, after=[...])`; `after` names the steps it depends on.
+2. `run_pipeline(steps)` runs every step whose dependencies finished, concurrently in a thread
+   pool, and calls `func` with the results of its dependencies as keyword arguments.
+3. A failed step skips everything that depends on it; independent steps keep running.
+4. All jobs share the Firestore client from `Firebase_Setup.py`, and the steps that read the
+   whole catalog share one snapshot loaded by the `catalog` step (the local catalog snapshot of
+   `Catalog.py`, refreshed with only the songs changed since its last refresh).
+5. A per-step timing report is printed at the end; step durations also go to the run's metrics
+   (`Metrics.py`) next to the Firestore, Spotify and audio operations of the steps.
+
+Usage example:
+    python Pipeline_Runner.py post-upload SONG_ID1,SONG_ID2
+    python Pipeline_Runner.py post-upload SONG_ID1,SONG_ID2 --embeddings
+    python Pipeline_Runner.py post-mp3
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib.util
+from importlib.machinery import SourceFileLoader
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from Catalog import JOB_FIELDS, load_songs
+from Firebase_Setup import db
+from Metrics import ContextThreadPoolExecutor, timed as timed_operation, job_run
+
+DEFAULT_WORKERS = 4
+
+# Fields of the shared catalog snapshot (union of what the catalog-wide steps read)
+CATALOG_FIELDS = list(dict.fromkeys(JOB_FIELDS["playlists"] + JOB_FIELDS["missing_mp3"]))
+
+
+class Step:
+    def __init__(self, name, func, after=()):
+        self.name = name
+        self.func = func
+        self.after = list(after)
+
+
+# Import a script that has no `.py` extension (e.g. `Songs_Embadding`) as a module
+def load_script(name, file_name=None):
+    if name in sys.modules:
+        return sys.modules[name]
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name or name)
+    loader = SourceFileLoader(name, path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+# Runs the steps in dependency order, independent ones concurrently; returns {name: (status, seconds, result)}
+def run_pipeline(steps, workers=DEFAULT_WORKERS):
+    pending = {step.name: step for step in steps}
+    names = set(pending)
+    report = {}
+    started = time.perf_counter()
+
+    def timed(step, kwargs):
+        step_start = time.perf_counter()
+        try:
+            with timed_operation("pipeline.step", step=step.name):
+                status, result = "ok", step.func(**kwargs)
+        except Exception as e:
+            print(f"❌ Step '{step.name}' failed: {e}")
+            status, result = "failed", None
+        seconds = time.perf_counter() - step_start
+        print(f"⏱️ Step '{step.name}' finished in {seconds:.1f}s")
+        return status, seconds, result
+
+    with ContextThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running:
+            for name, step in list(pending.items()):
+                statuses = [report[dep][0] if dep in report else None for dep in step.after]
+                if any(status not in (None, "ok") for status in statuses) \
+                        or any(dep not in names for dep in step.after):
+                    print(f"⏭️ Skipping step '{name}' (a dependency failed or is missing)")
+                    report[name] = ("skipped", 0.0, None)
+                    del pending[name]
+                elif all(status == "ok" for status in statuses):
+                    print(f"▶️ Starting step '{name}'")
+                    kwargs = {dep: report[dep][2] for dep in step.after}
+                    running[pool.submit(timed, step, kwargs)] = name
+                    del pending[name]
+
+            if not running:
+                break  # Only steps waiting on each other are left
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                report[running.pop(future)] = future.result()
+
+    for name in pending:
+        report[name] = ("skipped", 0.0, None)
+    report = {step.name: report[step.name] for step in steps}
+
+    print_report(report, time.perf_counter() - started)
+    return report
+
+
+# Prints the per-step timing summary
+def print_report(report, total_seconds):
+    print("\n📊 Pipeline summary:")
+    for name, (status, seconds, _) in report.items():
+        icon = {"ok": "✅", "failed": "❌", "skipped": "⏭️"}[status]
+        print(f"  {icon} {name:<12} {status:<8} {seconds:8.1f}s")
+    print(f"  ⏱️ Total wall time: {total_seconds:.1f}s")
+
+
+# Loads the catalog snapshot shared by the catalog-wide steps (incrementally refreshed local copy)
+def load_catalog():
+    songs = list(load_songs(db, CATALOG_FIELDS, source="snapshot"))
+    print(f"📚 Loaded catalog snapshot: {len(songs)} songs")
+    return songs
+
+
+# Steps run after songs were added by `Add_Song_To_DB.py`
+def post_upload_steps(song_ids, embeddings=False):
+    def playlists(catalog):
+        from System_Playlists_Update import build_system_playlists
+        build_system_playlists(songs=catalog)
+
+    def missing_mp3(catalog):
+        from Songs_With_No_MP3_List import list_songs_without_mp3
+        list_songs_without_mp3(songs=catalog)
+
+    def lyrics():
+        from Lyrics_Fill_Batch import fill_lyrics_for_songs
+        fill_lyrics_for_songs(song_ids)
+
+    def embed(lyrics):
+        load_script("Songs_Embadding").update_song_embeddings()
+
+    steps = [
+        Step("catalog", load_catalog),
+        Step("playlists", playlists, after=["catalog"]),
+        Step("missing_mp3", missing_mp3, after=["catalog"]),
+        Step("lyrics", lyrics),
+    ]
+    if embeddings:
+        steps.append(Step("embeddings", embed, after=["lyrics"]))
+    return steps
+
+
+# Steps run after audio was uploaded by `MP3_Upload.py`
+def post_mp3_steps():
+    def bpm():
+        from BPM_Update import process_missing_bpm
+        process_missing_bpm()
+
+    return [Step("bpm", bpm)]
+
+
+# Entry points used by the upload scripts
+def run_post_upload_pipeline(song_ids, embeddings=False, workers=DEFAULT_WORKERS):
+    return run_pipeline(post_upload_steps(song_ids, embeddings), workers)
+
+
+def run_post_mp3_pipeline(workers=DEFAULT_WORKERS):
+    return run_pipeline(post_mp3_steps(), workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the post-upload jobs in one process")
+    subparsers = parser.add_subparsers(dest="pipeline", required=True)
+    post_upload = subparsers.add_parser("post-upload", help="playlists, missing-MP3 report and lyrics")
+    post_upload.add_argument("song_ids", help="comma-separated list of the uploaded song IDs")
+    post_upload.add_argument("--embeddings", action="store_true", help="embed the new lyrics afterwards")
+    subparsers.add_parser("post-mp3", help="BPM for the uploaded audio")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="steps run concurrently")
+    args = parser.parse_args()
+
+    with job_run(f"pipeline_{args.pipeline.replace('-', '_')}"):
+        if args.pipeline == "post-upload":
+            ids = [sid.strip() for sid in args.song_ids.split(",") if sid.strip()]
+            results = run_post_upload_pipeline(ids, args.embeddings, args.workers)
+        else:
+            results = run_post_mp3_pipeline(args.workers)
+    sys.exit(0 if all(status == "ok" for status, _, _ in results.values()) else 1)
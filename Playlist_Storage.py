@@ -0,0 +1,373 @@
+"""
+Chunked storage format for system playlists.
+
+The original layout stores a playlist as a metadata document plus one `songs/{song_id}` document
+per member (with an `isLast` flag), so writing a genre playlist costs one write per song and a
+client needs one read per song to load it. The chunked format packs the ordered song IDs into a
+few documents instead.
+
+Layout:
+- `system_playlists/{id}` keeps `name`, `numSongs` and `songsHash`, plus:
+  `format: "chunked"`, `formatVersion`, `version` (incremented on every content change), `etag`,
+  `chunkSize`, and `chunks`: a list of `{"id", "etag", "numSongs"}`, one per chunk, in order.
+- `system_playlists/{id}/chunks/{0000, 0001, ...}` hold `songIds` (ordered) and, optionally,
+  `songs`: cached `title`, `artistName`, `cover` and `duration` of each song, aligned with
+  `songIds`, so a client can render the playlist without reading the song documents.
+- Chunks hold `CHUNK_SIZE` songs. If a chunk would come close to Firestore's 1 MiB document limit
+  (`MAX_CHUNK_BYTES`, only possible with very long cached details), the playlist's chunk size is
+  halved until every chunk fits.
+
+How it works:
+1. `write_chunked_playlist(...)` splits the playlist into chunks and hashes each one (its etag).
+   Only chunks whose etag differs from the one listed in the stored parent are written; surplus
+   chunks are deleted. The parent's `etag` covers the name and all chunk etags.
+2. `load_playlist(db, playlist_id, cached)` reads the parent (1 read). If its `etag` equals the
+   cached one nothing else is read; otherwise only the chunks whose etag changed are fetched, with
+   one `get_all`. A chunk that does not match the etag its parent lists (a rebuild in progress)
+   makes it start over, up to `LOAD_ATTEMPTS` times.
+3. `migrate_playlists(db)` (`python Playlist_Storage.py --migrate`) converts playlists still stored
+   as a `songs` subcollection, in the order a client reading the subcollection sees them
+   (document ID order, the `isLast` song last). A playlist with a failed write gets an empty
+   `etag` and `migrationFailed: true`, so the next migration converts it again and no rebuild
+   takes its chunks as up to date.
+4. `drop_legacy_subcollections(db)` (`python Playlist_Storage.py --drop-subcollections`, on its own
+   or after `--migrate`) deletes the old membership documents, once no client reads them anymore,
+   and only for playlists already migrated to complete chunks (non-empty `etag`, no `migrationFailed`).
+5. When some writes of a rebuild fail, `stored_chunk_listing(...)` re-lists the chunk documents as
+   they are actually stored, with an empty `etag`: readers load the playlist (partly old content)
+   instead of giving up after `LOAD_ATTEMPTS`, and the next rebuild rewrites every chunk.
+
+Usage example:
+    python System_Playlists_Update.py --storage chunked --song-details
+    python Playlist_Storage.py --migrate
+    python Playlist_Storage.py --drop-subcollections
+    python Playlist_Storage.py --show rock
+
+    playlist = load_playlist(db, "rock")
+    playlist = load_playlist(db, "rock", cached=playlist)  # 1 read if unchanged
+
+Notes:
+- A 10,000-song playlist is 10 chunk documents: rebuilding it writes only the changed chunks plus
+  the parent, and loading it costs 11 reads (1 when unchanged), instead of 10,000 of each.
+- Chunk boundaries are positional, so a song inserted early in a playlist changes the chunks after
+  it; appends and removals near the end touch only the last chunks.
+- Playlists written with `--storage subcollection` (the default) overwrite the parent without the
+  chunk fields; chunk documents left behind are ignored by readers.
+"""
+
+import json
+import hashlib
+import argparse
+
+from Firestore_Writer import BatchedWriter, GET_ALL_CHUNK, get_all
+from Metrics import timed_stream
+
+PLAYLISTS_COLLECTION = "system_playlists"
+CHUNKS_COLLECTION = "chunks"
+LEGACY_SONGS_COLLECTION = "songs"
+
+CHUNKED_FORMAT = "chunked"
+FORMAT_VERSION = 1
+
+# Songs per chunk document, and the size a chunk must stay under (Firestore's limit is 1 MiB)
+CHUNK_SIZE = 1000
+MAX_CHUNK_BYTES = 900 * 1024
+
+# Song fields cached in the chunks with song details
+DETAIL_FIELDS = ["title", "artistName", "cover", "duration"]
+
+# Parent fields read to decide what to rewrite
+STORED_FIELDS = ["name", "songsHash", "format", "version", "etag", "chunks"]
+
+# Parent field marking a playlist whose migration did not complete (removed by the next full write)
+MIGRATION_FAILED = "migrationFailed"
+
+LOAD_ATTEMPTS = 3
+
+
+def chunk_id(index):
+    return f"{index:04d}"
+
+
+# Stable fingerprint of a playlist's ordered membership (stored as `songsHash` in both layouts)
+def songs_hash(song_ids):
+    return hashlib.sha1("\n".join(song_ids).encode("utf-8")).hexdigest()
+
+
+# Details of one song to cache in the chunks, from its document data (read with DETAIL_FIELDS)
+def song_detail(data):
+    return {field: data[field] for field in DETAIL_FIELDS if data.get(field) is not None}
+
+
+def song_details(songs):
+    return {song.id: song_detail(song.to_dict()) for song in songs}
+
+
+# Approximate stored size of a Firestore value (strings and field names count their UTF-8 bytes + 1)
+def estimate_size(value):
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) + 1
+    if isinstance(value, dict):
+        return sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    return 8
+
+
+def hash_json(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# Splits a playlist into chunk documents; returns (chunk size, [chunk data, ...])
+def build_chunks(song_ids, details=None, chunk_size=CHUNK_SIZE):
+    while True:
+        chunks = []
+        for start in range(0, len(song_ids), chunk_size):
+            ids = list(song_ids[start:start + chunk_size])
+            data = {"songIds": ids}
+            if details is not None:
+                data["songs"] = [details.get(song_id, {}) for song_id in ids]
+            data["etag"] = hash_json(data)
+            chunks.append(data)
+        if chunk_size == 1 or all(estimate_size(data) <= MAX_CHUNK_BYTES for data in chunks):
+            return chunk_size, chunks
+        chunk_size //= 2
+
+
+# Writes a playlist in the chunked format. `stored` is the parent as last written (STORED_FIELDS),
+# or None; only chunks whose etag changed are written, unless `force`. Returns the number of chunk
+# documents written or deleted, or None if the playlist is unchanged.
+def write_chunked_playlist(writer, playlist_ref, name, song_ids, details=None, stored=None, force=False):
+    stored = stored or {}
+    chunk_size, chunks = build_chunks(song_ids, details)
+    listing = [{"id": chunk_id(i), "etag": data["etag"], "numSongs": len(data["songIds"])}
+               for i, data in enumerate(chunks)]
+    etag = hash_json({"name": name, "chunks": [item["etag"] for item in listing]})
+    if not force and stored.get("format") == CHUNKED_FORMAT and stored.get("etag") == etag:
+        return None
+
+    # A cleared etag marks a playlist whose last write failed: its chunk list cannot be trusted
+    trusted = stored.get("format") == CHUNKED_FORMAT and stored.get("etag") and not force
+    previous = {item["id"]: item["etag"] for item in stored.get("chunks", [])} if trusted else {}
+
+    changes = 0
+    chunks_ref = playlist_ref.collection(CHUNKS_COLLECTION)
+    for item, data in zip(listing, chunks):
+        if previous.get(item["id"]) != item["etag"]:
+            writer.set(chunks_ref.document(item["id"]), data)
+            changes += 1
+    for old in stored.get("chunks", []):
+        if old["id"] not in {item["id"] for item in listing}:
+            writer.delete(chunks_ref.document(old["id"]))
+            changes += 1
+
+    writer.set(playlist_ref, {
+        "name": name,
+        "numSongs": len(song_ids),
+        "songsHash": songs_hash(song_ids),
+        "format": CHUNKED_FORMAT,
+        "formatVersion": FORMAT_VERSION,
+        "version": stored.get("version", 0) + 1,
+        "etag": etag,
+        "chunkSize": chunk_size,
+        "chunks": listing,
+    })
+    return changes
+
+
+# Loads a playlist: {"id", "name", "version", "etag", "songIds", "songs" (or None), "chunks"}.
+# Pass the previous result as `cached` to read only what changed since. Returns None if it does not exist.
+def load_playlist(db, playlist_id, cached=None):
+    playlist_ref = db.collection(PLAYLISTS_COLLECTION).document(playlist_id)
+    for _ in range(LOAD_ATTEMPTS):
+        snapshot = playlist_ref.get()
+        if not snapshot.exists:
+            return None
+        parent = snapshot.to_dict()
+        if parent.get("format") != CHUNKED_FORMAT or parent.get(MIGRATION_FAILED):
+            return load_legacy_playlist(playlist_ref, parent)  # A failed migration kept the subcollection
+        if cached and parent.get("etag") and cached.get("etag") == parent["etag"]:
+            return cached
+
+        known = (cached or {}).get("chunks", {})
+        missing = [item["id"] for item in parent["chunks"] if known.get(item["id"], {}).get("etag") != item["etag"]]
+        fetched = {}
+        for i in range(0, len(missing), GET_ALL_CHUNK):
+            refs = [playlist_ref.collection(CHUNKS_COLLECTION).document(cid) for cid in missing[i:i + GET_ALL_CHUNK]]
+            for chunk in get_all(db, refs):
+                fetched[chunk.id] = chunk.to_dict() if chunk.exists else None
+
+        chunks = {}
+        for item in parent["chunks"]:
+            data = fetched[item["id"]] if item["id"] in fetched else known[item["id"]]
+            if data is None or data.get("etag") != item["etag"]:
+                break  # The playlist is being rewritten; read it again
+            chunks[item["id"]] = data
+        else:
+            return assemble_playlist(playlist_id, parent, chunks)
+    raise RuntimeError(f"Playlist '{playlist_id}' changed while it was read {LOAD_ATTEMPTS} times; try again later")
+
+
+# Parent fields listing the chunk documents as actually stored, for a playlist whose rebuild had failed
+# writes: `previous_chunks` is the chunk list before the rebuild, the parent's current one is read here.
+# The empty etag makes the next rebuild rewrite every chunk.
+def stored_chunk_listing(db, playlist_ref, previous_chunks=()):
+    parent = playlist_ref.get(field_paths=["chunks"])
+    listed = [item["id"] for item in previous_chunks]
+    if parent.exists:
+        listed += [item["id"] for item in parent.to_dict().get("chunks", [])]
+
+    refs = [playlist_ref.collection(CHUNKS_COLLECTION).document(cid) for cid in sorted(set(listed))]
+    listing = []
+    for i in range(0, len(refs), GET_ALL_CHUNK):
+        for chunk in get_all(db, refs[i:i + GET_ALL_CHUNK]):
+            if chunk.exists:
+                data = chunk.to_dict()
+                listing.append({"id": chunk.id, "etag": data["etag"], "numSongs": len(data["songIds"])})
+    return {"etag": "", "numSongs": sum(item["numSongs"] for item in listing), "chunks": listing}
+
+
+def assemble_playlist(playlist_id, parent, chunks):
+    ordered = [chunks[item["id"]] for item in parent["chunks"]]
+    has_details = bool(ordered) and all("songs" in data for data in ordered)
+    return {
+        "id": playlist_id,
+        "name": parent.get("name"),
+        "version": parent.get("version"),
+        "etag": parent.get("etag"),
+        "songIds": [song_id for data in ordered for song_id in data["songIds"]],
+        "songs": [song for data in ordered for song in data["songs"]] if has_details else None,
+        "chunks": chunks,
+    }
+
+
+# Song IDs of a playlist in the subcollection layout, in the order a client reading it sees them
+def legacy_song_ids(playlist_ref):
+    stored = [(doc.id, doc.to_dict().get("isLast", False)) for doc in timed_stream(
+        "firestore.query", playlist_ref.collection(LEGACY_SONGS_COLLECTION).select(["isLast"]).stream())]
+    return [song_id for song_id, is_last in stored if not is_last] + [song_id for song_id, is_last in stored if is_last]
+
+
+def load_legacy_playlist(playlist_ref, parent):
+    return {
+        "id": playlist_ref.id,
+        "name": parent.get("name"),
+        "version": None,
+        "etag": None,
+        "songIds": legacy_song_ids(playlist_ref),
+        "songs": None,
+        "chunks": {},
+    }
+
+
+# Cached details of the given songs, read with batched `get_all` calls
+def fetch_song_details(db, song_ids):
+    songs = []
+    refs = [db.collection("songs").document(song_id) for song_id in song_ids]
+    for i in range(0, len(refs), GET_ALL_CHUNK):
+        songs.extend(snapshot for snapshot in get_all(db, refs[i:i + GET_ALL_CHUNK], field_paths=DETAIL_FIELDS)
+                     if snapshot.exists)
+    return song_details(songs)
+
+
+# True for a playlist migrated to the chunked format whose chunks were all written
+def migration_complete(parent):
+    return parent.get("format") == CHUNKED_FORMAT and bool(parent.get("etag")) and not parent.get(MIGRATION_FAILED)
+
+
+# Converts every playlist still in the subcollection layout (or whose earlier migration failed) to the
+# chunked format. With `drop_subcollections`, the old `songs` subcollections of the playlists whose
+# chunks are complete are deleted afterwards. Returns the IDs of the playlists that failed.
+def migrate_playlists(db, with_details=False, drop_subcollections=False):
+    migrated = 0
+    refs = {}
+    complete = set()  # Chunked playlists whose chunks were all written
+    with BatchedWriter(db) as writer:
+        playlists = timed_stream("firestore.query", db.collection(PLAYLISTS_COLLECTION).select(
+            STORED_FIELDS + [MIGRATION_FAILED]).stream())
+        for snapshot in playlists:
+            refs[snapshot.id] = snapshot.reference
+            parent = snapshot.to_dict()
+            if parent.get("format") == CHUNKED_FORMAT and not parent.get(MIGRATION_FAILED):
+                if parent.get("etag"):  # An empty etag marks a failed rebuild: its chunks are incomplete
+                    complete.add(snapshot.id)
+                continue
+            song_ids = legacy_song_ids(snapshot.reference)
+            details = fetch_song_details(db, song_ids) if with_details else None
+            write_chunked_playlist(writer, snapshot.reference, parent.get("name", snapshot.id), song_ids, details,
+                                   stored=parent, force=True)
+            complete.add(snapshot.id)
+            migrated += 1
+            print(f"📦 Migrated '{snapshot.id}' ({len(song_ids)} songs).")
+
+    # The parent may have been written although one of its chunks was not: record the failure on it
+    failed = {path.split("/")[1] for path, _ in writer.errors}
+    complete -= failed
+    if failed:
+        with BatchedWriter(db) as marker:
+            for playlist_id in failed:
+                marker.set(refs[playlist_id], {"etag": "", MIGRATION_FAILED: True}, merge=True)
+        if marker.errors:
+            print(f"⚠️ Could not mark {len(marker.errors)} failed playlists; check them before dropping subcollections.")
+
+    print(f"\n📊 Migrated: {migrated} playlists, failed: {len(failed)} playlists")
+    if drop_subcollections:
+        drop_legacy_subcollections(db, complete)
+    return failed
+
+
+# Deletes the old `songs` subcollections of the playlists already migrated to complete chunks (of the
+# given ones only, if `playlist_ids` is set); other playlists are never touched. Returns the number of
+# membership documents deleted.
+def drop_legacy_subcollections(db, playlist_ids=None):
+    dropped = 0
+    with BatchedWriter(db) as dropper:
+        playlists = timed_stream("firestore.query", db.collection(PLAYLISTS_COLLECTION).select(
+            ["format", "etag", MIGRATION_FAILED]).stream())
+        for snapshot in playlists:
+            if playlist_ids is not None and snapshot.id not in playlist_ids:
+                continue
+            if not migration_complete(snapshot.to_dict()):
+                continue
+            legacy = snapshot.reference.collection(LEGACY_SONGS_COLLECTION).select([]).stream()
+            for doc in timed_stream("firestore.query", legacy):
+                dropper.delete(doc.reference)
+                dropped += 1
+
+    print(f"🗑️ Deleted {dropped - len(dropper.errors)} membership documents"
+          + (f", {len(dropper.errors)} deletes failed" if dropper.errors else ""))
+    return dropped - len(dropper.errors)
+
+
+# Command-line entry point (`python Playlist_Storage.py` or `python QueueMue_CLI.py playlist-storage`)
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Chunked system playlist storage")
+    parser.add_argument("--migrate", action="store_true", help="convert subcollection playlists to the chunked format")
+    parser.add_argument("--song-details", action="store_true", help="cache title/artist/cover/duration in the chunks")
+    parser.add_argument("--drop-subcollections", action="store_true",
+                        help="delete the old songs subcollections of migrated playlists (once clients read the "
+                             "chunked format); with --migrate, after migrating")
+    parser.add_argument("--show", metavar="PLAYLIST_ID", help="print a playlist as stored")
+    args = parser.parse_args(argv)
+
+    from Firebase_Setup import db
+    if args.show:
+        playlist = load_playlist(db, args.show)
+        if playlist is None:
+            print(f"❌ Playlist '{args.show}' not found.")
+            return
+        print(f"🎵 {playlist['name']} — {len(playlist['songIds'])} songs, version {playlist['version']}, "
+              f"{len(playlist['chunks'])} chunks")
+        for i, song_id in enumerate(playlist["songIds"]):
+            song = playlist["songs"][i] if playlist["songs"] else {}
+            print(f"  {i + 1:>5}. {song_id} {song.get('title', '')}")
+    elif args.migrate:
+        migrate_playlists(db, with_details=args.song_details, drop_subcollections=args.drop_subcollections)
+    elif args.drop_subcollections:
+        drop_legacy_subcollections(db)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    cli()
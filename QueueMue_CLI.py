@@ -0,0 +1,74 @@
+"""
+Single command-line entry point for the QueueMue jobs.
+
+Each job script initializes Firebase and imports its own dependencies (Spotify, librosa,
+sentence-transformers, ...) when it is imported. This CLI imports nothing but the standard
+library until the command line is parsed, then imports only the script of the chosen command,
+so `--help` and light commands never pay for librosa, torch or FastAPI.
+
+How it works:
+1. `COMMANDS` maps every subcommand to the script that implements it.
+2. `python QueueMue_CLI.py <command> [options]` imports that script and hands the remaining
+   arguments to its `cli(argv)` entry point, so every command takes exactly the options of its
+   script (`python QueueMue_CLI.py <command> --help` lists them).
+3. The scripts defer their heaviest work as well: BPM analysis imports librosa only in its
+   analyzer processes, the embedding model is loaded once there are lyrics to embed, and
+   `report --source offline` never initializes Firebase.
+
+Usage example:
+    python QueueMue_CLI.py ingest --batch urls.txt
+    python QueueMue_CLI.py upload-mp3 --folder ~/SongsToUpload
+    python QueueMue_CLI.py bpm --analysis-workers 6
+    python QueueMue_CLI.py lyrics SONG_ID1,SONG_ID2
+    python QueueMue_CLI.py report --source offline --format csv
+    python QueueMue_CLI.py similarity --song HELLO -k 10
+
+Notes:
+- The scripts still run on their own (`python BPM_Update.py ...`) with the same options.
+- `python -X importtime QueueMue_CLI.py <command> --help` shows what a command imports on startup.
+"""
+
+import argparse
+import importlib
+
+# Subcommand -> (script module, description)
+COMMANDS = {
+    "ingest": ("Add_Song_To_DB", "add Spotify tracks, albums or playlists to Firestore"),
+    "upload-mp3": ("MP3_Upload", "upload local MP3 files to Firebase Storage and link them to songs"),
+    "bpm": ("BPM_Update", "calculate missing BPM values"),
+    "lyrics": ("Lyrics_Fill_Batch", "fill missing lyrics for songs"),
+    "playlists": ("System_Playlists_Update", "build the system playlists"),
+    "playlist-storage": ("Playlist_Storage", "migrate or inspect chunked system playlists"),
+    "embeddings": ("Songs_Embadding", "generate lyric embeddings"),
+    "similarity": ("Song_Similarity", "export the embedding snapshot and find similar songs"),
+    "report": ("Songs_With_No_MP3_List", "list songs that have no uploaded MP3"),
+    "main-genre": ("Create_Main_Genre", "set mainGenre on songs from their first genre"),
+}
+
+# Scripts without a `.py` extension, loaded by file name
+SCRIPTS_WITHOUT_EXTENSION = {"Songs_Embadding"}
+
+
+# Imports the script of a command (only then, so no other command's dependencies are loaded)
+def load_command(command):
+    name = COMMANDS[command][0]
+    if name in SCRIPTS_WITHOUT_EXTENSION:
+        from Pipeline_Runner import load_script
+        return load_script(name)
+    return importlib.import_module(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="QueueMue catalog jobs",
+                                     epilog="Run '%(prog)s <command> --help' for the options of a command.")
+    subparsers = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for command, (_, description) in COMMANDS.items():
+        # The command's own parser (in its script) handles its options, including --help
+        subparsers.add_parser(command, help=description, add_help=False)
+    args, rest = parser.parse_known_args(argv)
+
+    load_command(args.command).cli(rest, prog=f"{parser.prog} {args.command}")
+
+
+if __name__ == "__main__":
+    main()
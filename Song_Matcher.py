@@ -0,0 +1,141 @@
+"""
+Fuzzy matching of MP3 files to song documents.
+
+Replaces the exact lowercase-title lookup in `MP3_Upload.py`, where every near miss
+("Song (Remastered)", "Song - Radio Edit", accents, punctuation) ended up in `failed_log.txt`.
+
+How it works:
+1. Titles and artists are normalized: lowercase, accents stripped, bracketed suffixes such as
+   "(feat. X)" / "[Live]" and " - Remastered" tails removed, punctuation collapsed.
+2. Each normalized title is split into character trigrams and stored in an inverted index
+   (trigram -> song positions), plus an exact-title dict for the common case.
+3. A query scores candidates that share trigrams with the file title (Dice coefficient),
+   cross-checks the ID3 artist against `artistName` and the MP3 length against `duration`,
+   and accepts the best candidate only if it is clearly better than the runner-up.
+4. A normalized title that exactly matches a single song in the index is accepted whatever the
+   ID3 artist says (as the old exact lookup did), so files with missing or odd artist tags still match.
+
+Notes:
+- Only `title`, `artistName` and `duration` are loaded from Firestore (field projection).
+- Lookups touch only the postings of the query's trigrams, so they stay fast for 100k+ songs.
+"""
+
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+# Matching thresholds
+MIN_SCORE = 0.75  # Minimum combined score to accept a match
+MIN_MARGIN = 0.05  # Best candidate must beat the runner-up by this much
+DURATION_TOLERANCE = 10  # Max seconds between MP3 length and the song's `duration`
+TITLE_WEIGHT = 0.7  # Weight of the title score when an artist is available
+MAX_CANDIDATES = 20  # Candidates fully scored per query
+
+SUFFIX_PATTERN = re.compile(r"[(\[].*?[)\]]|\s-\s.*$")
+NON_WORD_PATTERN = re.compile(r"[^\w]+")
+
+
+# Normalizes a title or artist name for matching
+def normalize(text):
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    stripped = SUFFIX_PATTERN.sub(" ", text)
+    text = stripped if stripped.strip() else text
+    return NON_WORD_PATTERN.sub(" ", text).strip()
+
+
+# Character trigrams of a normalized string (padded so short words still produce trigrams)
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Dice similarity of two trigram sets
+def dice(a, b):
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class SongIndex:
+    def __init__(self):
+        self.songs = []  # (song_id, title trigrams, artist trigrams, duration)
+        self.by_title = defaultdict(list)
+        self.postings = defaultdict(list)
+
+    def __len__(self):
+        return len(self.songs)
+
+    def add(self, song_id, title, artist=None, duration=None):
+        norm_title = normalize(title)
+        if not norm_title:
+            return
+        title_grams = trigrams(norm_title)
+        position = len(self.songs)
+        self.songs.append((song_id, title_grams, trigrams(normalize(artist)) if artist else set(), duration))
+        self.by_title[norm_title].append(position)
+        for gram in title_grams:
+            self.postings[gram].append(position)
+
+    # Score a single candidate; returns None when the duration cross-check rules it out
+    def _score(self, position, title_grams, artist_grams, duration):
+        _, song_title_grams, song_artist_grams, song_duration = self.songs[position]
+        if duration and song_duration and abs(duration - song_duration) > DURATION_TOLERANCE:
+            return None
+        title_score = dice(title_grams, song_title_grams)
+        if artist_grams and song_artist_grams:
+            return TITLE_WEIGHT * title_score + (1 - TITLE_WEIGHT) * dice(artist_grams, song_artist_grams)
+        return title_score
+
+    # Find the song for a file; returns (song_id, score) or (None, reason)
+    def match(self, title, artist=None, duration=None):
+        norm_title = normalize(title)
+        if not norm_title:
+            return None, "EMPTY TITLE"
+        title_grams = trigrams(norm_title)
+        artist_grams = trigrams(normalize(artist)) if artist else set()
+
+        # Exact normalized titles first, then the trigram candidates with the most shared grams
+        candidates = list(self.by_title.get(norm_title, []))
+        shared = Counter()
+        for gram in title_grams:
+            shared.update(self.postings.get(gram, ()))
+        candidates += [position for position, _ in shared.most_common(MAX_CANDIDATES)]
+
+        scored = {}
+        for position in candidates:
+            score = self._score(position, title_grams, artist_grams, duration)
+            if score is not None:
+                scored[position] = score
+
+        if not scored:
+            return None, "DURATION MISMATCH" if candidates else "NO CANDIDATE"
+
+        # A title unique in the index wins on its own; the artist only decides between fuzzy candidates
+        exact_ids = {self.songs[position][0] for position in self.by_title.get(norm_title, ())}
+        if len(exact_ids) == 1:
+            for position in self.by_title[norm_title]:
+                if position in scored:
+                    return self.songs[position][0], scored[position]
+
+        ranked = sorted(scored.items(), key=lambda item: item[1], reverse=True)
+        best_position, best_score = ranked[0]
+        if best_score < MIN_SCORE:
+            return None, f"BEST SCORE {best_score:.2f} BELOW {MIN_SCORE}"
+        if len(ranked) > 1 and best_score - ranked[1][1] < MIN_MARGIN \
+                and self.songs[ranked[1][0]][0] != self.songs[best_position][0]:
+            return None, f"AMBIGUOUS ({self.songs[best_position][0]} vs {self.songs[ranked[1][0]][0]})"
+        return self.songs[best_position][0], best_score
+
+
+# Builds the index from the `songs` collection (or the local catalog snapshot), loading only the projected fields
+def build_song_index(db, source="firestore"):
+    from Catalog import load_songs
+
+    index = SongIndex()
+    for song in load_songs(db, "matcher", source):
+        data = song.to_dict()
+        index.add(song.id, (data.get("title") or "").strip(), data.get("artistName"), data.get("duration"))
+    return index
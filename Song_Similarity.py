@@ -0,0 +1,290 @@
+"""
+Local "songs like this" similarity search over the lyric embeddings written by `Songs_Embadding`.
+
+Similarity queries are served from a local snapshot instead of pulling documents from Firestore:
+all embeddings live in one contiguous float32 matrix on disk, memory-mapped on load, and a
+query is a single vectorized matrix-vector product followed by a top-k selection.
+
+How it works:
+1. `--export` streams `embedding`/`title` from the `songs` collection (field projection) and writes
+   L2-normalized rows to `.queuemue_cache/similarity/vectors.f32` plus a `meta.json` with song IDs.
+2. Queries by song ID reuse that song's row; free-text queries are embedded with the same
+   SentenceTransformer model (loaded only when needed).
+3. Cosine similarity is a dot product, since every row and query vector is normalized.
+
+Optional indexes for large catalogs (built with `--build-index`):
+- `int8`: rows quantized to int8 with a per-row scale (4x smaller to map and scan); the best
+  `RERANK_FACTOR * k` candidates are re-scored exactly with the float32 rows.
+- `ivf`: rows are clustered with mini-batch k-means into ~sqrt(N) inverted lists; a query only
+  scans the rows of its `nprobe` closest lists.
+
+Usage example:
+    python Song_Similarity.py --export
+    python Song_Similarity.py --song HELLO -k 10
+    python Song_Similarity.py --text "dancing all night long" --index ivf --nprobe 8
+"""
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from Catalog import stream_songs
+from Id_Cache import CACHE_DIR
+from Metrics import job_run
+
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, "similarity")
+MODEL_NAME = 'all-MiniLM-L6-v2'  # Must match the model used by Songs_Embadding
+
+SCAN_CHUNK_ROWS = 65536  # Rows scored per step, bounds temporary memory
+RERANK_FACTOR = 10  # int8 candidates re-scored exactly per requested result
+DEFAULT_NPROBE = 8
+KMEANS_TOLERANCE = 1e-3  # k-means stops once no center moves further than this in one iteration
+
+
+# Indices of the k largest scores, best first
+def top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+# Index of the closest center for every row (squared Euclidean distance), in bounded-memory chunks
+def assign_to_centers(data, centers, chunk_rows=SCAN_CHUNK_ROWS):
+    center_norms = (centers ** 2).sum(axis=1)
+    labels = np.empty(data.shape[0], dtype=np.int32)
+    for start in range(0, data.shape[0], chunk_rows):
+        chunk = np.asarray(data[start:start + chunk_rows], dtype=np.float32)
+        distances = center_norms[None, :] - 2 * chunk @ centers.T
+        labels[start:start + len(chunk)] = distances.argmin(axis=1)
+    return labels
+
+
+# Mini-batch k-means (Sculley 2010); reproducible for a fixed seed, memory bounded by batch_size.
+# With init_centers (e.g. the previous run's result) it warm-starts, so clusters keep their identity;
+# it stops before `iterations` once the centers move less than `tol` per iteration.
+def mini_batch_kmeans(data, k, batch_size=1024, iterations=100, seed=42, init_centers=None, tol=KMEANS_TOLERANCE):
+    rng = np.random.default_rng(seed)
+    n = data.shape[0]
+    if init_centers is not None and init_centers.shape == (k, data.shape[1]):
+        centers = np.array(init_centers, dtype=np.float32)
+        # Prior weight of ~10 batches, so old centers move but are not overwritten by the first batch
+        counts = np.full(k, 10 * batch_size / k, dtype=np.float64)
+    else:
+        k = min(k, n)
+        centers = np.array(data[np.sort(rng.choice(n, k, replace=False))], dtype=np.float32)
+        counts = np.zeros(k, dtype=np.float64)
+
+    for _ in range(iterations):
+        batch = np.asarray(data[np.sort(rng.choice(n, min(batch_size, n), replace=False))], dtype=np.float32)
+        labels = assign_to_centers(batch, centers)
+        batch_counts = np.bincount(labels, minlength=k).astype(np.float64)
+        batch_sums = np.zeros_like(centers, dtype=np.float64)
+        np.add.at(batch_sums, labels, batch)
+
+        # Per-center learning rate 1/count: each center is the running mean of every point it was given
+        updated = batch_counts > 0
+        new_counts = counts[updated] + batch_counts[updated]
+        previous = centers[updated]
+        centers[updated] = ((previous * counts[updated, None] + batch_sums[updated]) / new_counts[:, None])
+        counts[updated] = new_counts
+
+        if np.sqrt(((centers[updated] - previous) ** 2).sum(axis=1)).max(initial=0) < tol:
+            break
+
+    return centers
+
+
+# Writes the snapshot from Firestore, streaming rows to disk so memory stays flat
+def export_snapshot(db, snapshot_dir=SNAPSHOT_DIR):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    ids, titles = [], []
+    dim = None
+    tmp_path = os.path.join(snapshot_dir, "vectors.f32.tmp")
+
+    with open(tmp_path, "wb") as f:
+        for song in stream_songs(db, "similarity"):
+            data = song.to_dict()
+            embedding = data.get("embedding")
+            if not embedding:
+                continue
+            vector = np.asarray(embedding, dtype=np.float32)
+            if dim is None:
+                dim = len(vector)
+            if len(vector) != dim:
+                print(f"⚠️ Skipping {song.id}: embedding has {len(vector)} dimensions, expected {dim}")
+                continue
+            norm = np.linalg.norm(vector)
+            f.write((vector / norm if norm else vector).tobytes())
+            ids.append(song.id)
+            titles.append(data.get("title", ""))
+
+    os.replace(tmp_path, os.path.join(snapshot_dir, "vectors.f32"))
+    with open(os.path.join(snapshot_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"count": len(ids), "dim": dim or 0, "ids": ids, "titles": titles,
+                   "exportedAt": time.time()}, f, ensure_ascii=False)
+
+    # Indexes built from an older snapshot no longer line up with its rows
+    for name in ("vectors.i8", "scales.f32", "ivf.npz"):
+        path = os.path.join(snapshot_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    print(f"✅ Exported {len(ids)} embeddings ({dim} dimensions) to {snapshot_dir}")
+
+
+class SimilarityIndex:
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR):
+        self.snapshot_dir = snapshot_dir
+        with open(os.path.join(snapshot_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.ids = meta["ids"]
+        self.titles = meta["titles"]
+        self.dim = meta["dim"]
+        self.row_of = {song_id: i for i, song_id in enumerate(self.ids)}
+        if self.ids:
+            self.vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r",
+                                     shape=(len(self.ids), self.dim))
+        else:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)  # An empty file cannot be memory-mapped
+        self.model = None
+
+    def _path(self, name):
+        return os.path.join(self.snapshot_dir, name)
+
+    # Quantize rows to int8 with a per-row scale
+    def build_int8(self):
+        if not self.ids:
+            print("⚠️ The snapshot has no embeddings; nothing to index")
+            return
+        scales = np.empty(len(self.ids), dtype=np.float32)
+        quantized = np.memmap(self._path("vectors.i8"), dtype=np.int8, mode="w+", shape=self.vectors.shape)
+        for start in range(0, len(self.ids), SCAN_CHUNK_ROWS):
+            chunk = np.asarray(self.vectors[start:start + SCAN_CHUNK_ROWS])
+            chunk_scales = np.abs(chunk).max(axis=1) / 127
+            chunk_scales[chunk_scales == 0] = 1
+            quantized[start:start + len(chunk)] = np.round(chunk / chunk_scales[:, None]).astype(np.int8)
+            scales[start:start + len(chunk)] = chunk_scales
+        quantized.flush()
+        scales.tofile(self._path("scales.f32"))
+        print(f"✅ Built int8 index for {len(self.ids)} songs")
+
+    # Cluster rows into inverted lists for IVF search
+    def build_ivf(self, nlist=None, seed=42):
+        if not self.ids:
+            print("⚠️ The snapshot has no embeddings; nothing to index")
+            return
+        nlist = nlist or max(1, int(np.sqrt(len(self.ids))))
+        centers = mini_batch_kmeans(self.vectors, nlist, seed=seed)
+        labels = assign_to_centers(self.vectors, centers)
+        order = np.argsort(labels, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(labels[order], np.arange(len(centers) + 1)).astype(np.int64)
+        np.savez(self._path("ivf.npz"), centers=centers, order=order, offsets=offsets)
+        print(f"✅ Built IVF index with {len(centers)} lists for {len(self.ids)} songs")
+
+    # Exact scores of the given rows (all rows when None), computed in chunks
+    def _exact_scores(self, query, rows=None):
+        if rows is None:
+            scores = np.empty(len(self.ids), dtype=np.float32)
+            for start in range(0, len(self.ids), SCAN_CHUNK_ROWS):
+                scores[start:start + SCAN_CHUNK_ROWS] = self.vectors[start:start + SCAN_CHUNK_ROWS] @ query
+            return scores
+        return np.asarray(self.vectors[rows]) @ query
+
+    # Returns candidate rows and their scores for a normalized query vector
+    def _candidates(self, query, k, index, nprobe):
+        if index == "flat":
+            return None, self._exact_scores(query)
+
+        if index == "int8":
+            quantized = np.memmap(self._path("vectors.i8"), dtype=np.int8, mode="r", shape=self.vectors.shape)
+            scales = np.fromfile(self._path("scales.f32"), dtype=np.float32)
+            approx = np.empty(len(self.ids), dtype=np.float32)
+            for start in range(0, len(self.ids), SCAN_CHUNK_ROWS):
+                chunk = quantized[start:start + SCAN_CHUNK_ROWS].astype(np.float32)
+                approx[start:start + len(chunk)] = (chunk @ query) * scales[start:start + len(chunk)]
+            rows = np.sort(top_k(approx, k * RERANK_FACTOR))
+            return rows, self._exact_scores(query, rows)
+
+        if index == "ivf":
+            ivf = np.load(self._path("ivf.npz"))
+            lists = top_k(ivf["centers"] @ query, nprobe)
+            offsets, order = ivf["offsets"], ivf["order"]
+            rows = np.sort(np.concatenate([order[offsets[l]:offsets[l + 1]] for l in lists]))
+            return rows, self._exact_scores(query, rows)
+
+        raise ValueError(f"Unknown index type: {index}")
+
+    # Top-k most similar songs to a vector, as (song_id, title, score)
+    def search(self, vector, k=10, index="flat", nprobe=DEFAULT_NPROBE, exclude=()):
+        if not self.ids:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+
+        rows, scores = self._candidates(query, k + len(exclude), index, nprobe)
+        results = []
+        for i in top_k(scores, k + len(exclude)):
+            row = int(rows[i]) if rows is not None else int(i)
+            if self.ids[row] in exclude:
+                continue
+            results.append((self.ids[row], self.titles[row], float(scores[i])))
+        return results[:k]
+
+    # Songs most similar to a song in the snapshot
+    def similar_to_song(self, song_id, k=10, **options):
+        if song_id not in self.row_of:
+            raise KeyError(f"Song '{song_id}' has no embedding in the snapshot")
+        return self.search(np.asarray(self.vectors[self.row_of[song_id]]), k, exclude={song_id}, **options)
+
+    # Songs whose lyrics are most similar to free text
+    def similar_to_text(self, text, k=10, **options):
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(MODEL_NAME)
+        return self.search(self.model.encode(text, normalize_embeddings=True), k, **options)
+
+
+# Command-line entry point (`python Song_Similarity.py` or `python QueueMue_CLI.py similarity`)
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Find similar songs from a local embedding snapshot")
+    parser.add_argument("--export", action="store_true", help="refresh the local snapshot from Firestore")
+    parser.add_argument("--build-index", choices=["int8", "ivf"], help="build an optional index")
+    parser.add_argument("--song", help="find songs similar to this song ID")
+    parser.add_argument("--text", help="find songs whose lyrics are similar to this text")
+    parser.add_argument("-k", type=int, default=10, help="number of results")
+    parser.add_argument("--index", choices=["flat", "int8", "ivf"], default="flat", help="index used for search")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="IVF lists scanned per query")
+    args = parser.parse_args(argv)
+
+    with job_run("song_similarity"):
+        if args.export:
+            from Firebase_Setup import db
+
+            export_snapshot(db)
+
+        if args.build_index == "int8":
+            SimilarityIndex().build_int8()
+        elif args.build_index == "ivf":
+            SimilarityIndex().build_ivf()
+
+        if args.song or args.text:
+            index = SimilarityIndex()
+            start = time.perf_counter()
+            if args.song:
+                results = index.similar_to_song(args.song, args.k, index=args.index, nprobe=args.nprobe)
+            else:
+                results = index.similar_to_text(args.text, args.k, index=args.index, nprobe=args.nprobe)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            for rank, (song_id, title, score) in enumerate(results, start=1):
+                print(f"{rank:>3}. {title} ({song_id}) – {score:.3f}")
+            print(f"\n⏱ {elapsed_ms:.1f} ms ({args.index} index, {len(index.ids)} songs)")
+
+
+if __name__ == "__main__":
+    cli()
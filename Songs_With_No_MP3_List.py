@@ -1,5 +1,10 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import sys
+import csv
+import json
+import argparse
+
+from Catalog import JOB_FIELDS, SOURCES, NEEDS_AUDIO, DEFAULT_PAGE_SIZE, load_songs, stream_backlog
+from Incremental_Scan import IncrementalScan
 
 """
 This script connects to Firebase Firestore and lists all songs in the "songs" collection
@@ -7,30 +12,96 @@ that are missing an `audioUrl` field (either empty or null).
 
 Useful for identifying which songs have no uploaded MP3 file linked to them.
 
+How it works:
+- By default only songs flagged `needsAudio` are read, by an indexed query paginated with
+  `--page-size` (see `Catalog.py`), so the report costs reads proportional to the songs it lists.
+- With `--since-last-run`, only songs changed since the previous `--since-last-run` report are
+  checked (see `Incremental_Scan.py`), so the report lists just the newly missing MP3s.
+- With `--source snapshot` / `--source offline`, the report is built from the local catalog
+  snapshot (see `Catalog.py`) instead of scanning Firestore. `--source offline` never initializes
+  Firebase, so it starts (and finishes) in a fraction of a second.
+
 Output:
-- Prints song titles and Spotify URLs for all songs missing `audioUrl`.
+- Song IDs, titles and Spotify URLs for all songs missing `audioUrl`, streamed to stdout (or
+  `--output FILE`) as they are read: readable text (default), `--format csv` or `--format jsonl`
+  (one JSON object per line).
 
 Technologies:
 - Firebase Admin SDK
 """
 
-# Initialize Firebase
-cred = credentials.Certificate(r"C:\Users\Yinon\PycharmProjects\QueueMue_Adding_Songs_To_DB\queuemueue-firebase-admin.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+REPORT_COLUMNS = ["id", "title", "url"]
+
+
+# Firebase is initialized only by the reports that read Firestore
+def firestore_db():
+    from Firebase_Setup import db
+    return db
+
+
+# Songs to check: the needsAudio backlog, the songs changed since the last report, or a preloaded snapshot
+def candidate_songs(since_last_run=False, songs=None, page_size=DEFAULT_PAGE_SIZE):
+    if songs is not None:
+        yield from songs
+    elif since_last_run:
+        scan = IncrementalScan(firestore_db(), "missing_mp3_report", fields=JOB_FIELDS["missing_mp3"])
+        yield from scan
+        scan.commit()
+    else:
+        yield from stream_backlog(firestore_db(), {NEEDS_AUDIO: True}, JOB_FIELDS["missing_mp3"], page_size)
+
+
+# List songs from the 'songs' collection that have no audioUrl, writing each one as soon as it is read.
+# `songs` can be a preloaded snapshot with `audioUrl`, `title` and `url` (always a full report).
+def list_songs_without_mp3(since_last_run=False, songs=None, output_format="text", out=sys.stdout,
+                           page_size=DEFAULT_PAGE_SIZE):
+    if output_format == "text":
+        print("🎧 Songs with missing audioUrl (null or empty):\n", file=out)
+    elif output_format == "csv":
+        csv_writer = csv.DictWriter(out, fieldnames=REPORT_COLUMNS)
+        csv_writer.writeheader()
+
+    count = 0
+    for doc in candidate_songs(since_last_run, songs, page_size):
+        song = doc.to_dict()
+        if song.get("audioUrl"):  # Handles None, empty string, or other false values
+            continue
+
+        count += 1
+        row = {"id": doc.id, "title": song.get("title", "Unknown"), "url": song.get("url", "No URL")}
+        if output_format == "csv":
+            csv_writer.writerow(row)
+        elif output_format == "jsonl":
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            print(f"🎵 {row['title']}\n🔗 {row['url']}\n", file=out)
+
+    print(f"📊 {count} songs without audioUrl.", file=sys.stderr)
+    return count
+
 
-# Retrieve all songs from the 'songs' collection
-songs_ref = db.collection("songs")
-all_songs = songs_ref.stream()
+# Command-line entry point (`python Songs_With_No_MP3_List.py` or `python QueueMue_CLI.py report`)
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="List songs that have no uploaded MP3")
+    parser.add_argument("--since-last-run", action="store_true", help="only songs changed since the last report")
+    parser.add_argument("--source", choices=SOURCES, default="firestore",
+                        help="read songs from Firestore or the local catalog snapshot (always a full report)")
+    parser.add_argument("--format", choices=["text", "csv", "jsonl"], default="text", help="report format")
+    parser.add_argument("--output", default="-", help="report file ('-' for stdout)")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help="songs read per page of the needsAudio query")
+    args = parser.parse_args(argv)
 
-print("🎧 Songs with missing audioUrl (null or empty):\n")
+    songs = None
+    if args.source != "firestore":
+        songs = load_songs(None if args.source == "offline" else firestore_db(), "missing_mp3", args.source)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    try:
+        list_songs_without_mp3(args.since_last_run, songs, args.format, out, args.page_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
-# Loop through songs and check for missing audioUrl
-for doc in all_songs:
-    song = doc.to_dict()
-    audio_url = song.get("audioUrl")
 
-    if not audio_url:  # Handles None, empty string, or other false values
-        title = song.get("title", "Unknown")
-        spotify_url = song.get("url", "No URL")
-        print(f"🎵 {title}\n🔗 {spotify_url}\n")
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,278 @@
+"""
+Rate-limit-aware Spotify client with a persistent response cache.
+
+Wraps a `spotipy.Spotify` instance for the calls the ingestion scripts make, so large imports
+stop running into 429s and never ask Spotify twice for the same track or artist.
+
+How it works:
+1. Every request first takes a token from a token bucket (`RATE_PER_SECOND`, `BURST`) shared by
+   all threads of the process.
+2. A 429 answer pauses the whole bucket for the `Retry-After` seconds Spotify asks for, then the
+   request is retried. 5xx answers and network errors are retried by the HTTP session underneath
+   spotipy (`create_spotify_session`), which never retries a 429 itself.
+3. Track and artist objects are cached in `.queuemue_cache/spotify_cache.sqlite` with a TTL per
+   kind (`TRACK_TTL`, `ARTIST_TTL`); `tracks()` / `artists()` only request the IDs not cached.
+4. Concurrent requests for the same object are coalesced: one thread fetches, the others wait
+   for its result.
+5. `metrics` counts cache hits and misses, requests, throttles (429s), coalesced requests and
+   the seconds spent waiting for the limiter; `print_metrics()` prints them. Request latencies and
+   the same counters also go to the shared registry of `Metrics.py`.
+
+Usage example:
+    spotify = create_spotify(SpotifyClientCredentials(client_id=..., client_secret=...))
+    track = spotify.track(track_id, market="IL")
+    spotify.print_metrics()
+
+Notes:
+- Wrap spotipy clients whose session comes from `create_spotify_session()` (as `create_spotify`
+  does). spotipy's default session lets urllib3 retry every 429 that carries a `Retry-After`
+  header, whatever its `status_forcelist`, so throttling would never reach the shared bucket or
+  `metrics`.
+- Paginated calls (`album_tracks`, `playlist_items`, `next`) are rate-limited but not cached.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from concurrent.futures import Future
+import requests
+import spotipy
+from requests.adapters import HTTPAdapter
+from spotipy.exceptions import SpotifyException
+from urllib3.util.retry import Retry
+
+from Id_Cache import CACHE_DIR
+from Metrics import timed, count
+
+DEFAULT_CACHE_PATH = os.path.join(CACHE_DIR, "spotify_cache.sqlite")
+
+# Request rate shared by all threads (Spotify's limit is per app, over a rolling window)
+RATE_PER_SECOND = 8
+BURST = 16
+
+# Cache lifetimes
+TRACK_TTL = 30 * 24 * 3600
+ARTIST_TTL = 7 * 24 * 3600  # Artist genres change more often than track metadata
+
+# Retries of a throttled (429) request
+MAX_RETRIES = 5
+DEFAULT_RETRY_AFTER = 5  # Seconds, when a 429 comes without a Retry-After header
+
+# Statuses the HTTP session retries itself; 429 is left out so it reaches `SpotifyClient.call` with its headers
+SPOTIPY_STATUS_FORCELIST = (500, 502, 503, 504)
+SPOTIPY_RETRIES = 3
+
+# Spotify multi-ID endpoints accept at most 50 IDs per call
+MULTI_ID_CHUNK = 50
+
+# Names of the `metrics` counters in the shared registry (`Metrics.py`)
+REGISTRY_COUNTERS = {
+    "hits": "spotify_cache_hits",
+    "misses": "spotify_cache_misses",
+    "requests": "spotify_requests",
+    "throttles": "spotify_throttles",
+    "coalesced": "spotify_coalesced",
+    "waitSeconds": "spotify_limiter_wait_seconds",
+}
+
+
+class TokenBucket:
+    def __init__(self, rate=RATE_PER_SECOND, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    # Blocks until a request may be sent; returns the seconds waited
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    # Stop all requests for the given seconds (Spotify's Retry-After)
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class SpotifyClient:
+    def __init__(self, sp, cache_path=DEFAULT_CACHE_PATH, bucket=None):
+        self.sp = sp
+        self.bucket = bucket or TokenBucket()
+        self.lock = threading.Lock()
+        self.in_flight = {}  # cache key -> Future of the request fetching it
+        self.metrics = {"hits": 0, "misses": 0, "requests": 0, "throttles": 0, "coalesced": 0, "waitSeconds": 0.0}
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, fetched_at REAL, value TEXT)")
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.metrics[name] += amount
+        count(REGISTRY_COUNTERS[name], amount)
+
+    # Sends one request through the rate limiter, waiting out and retrying 429 answers
+    def call(self, method, *args, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            self._count("waitSeconds", self.bucket.acquire())
+            self._count("requests")
+            try:
+                with timed("spotify.request", method=method):
+                    return getattr(self.sp, method)(*args, **kwargs)
+            except SpotifyException as e:
+                if e.http_status != 429 or attempt == MAX_RETRIES:
+                    raise
+                retry_after = float((e.headers or {}).get("Retry-After") or DEFAULT_RETRY_AFTER)
+                self._count("throttles")
+                print(f"⏳ Spotify rate limit hit, pausing {retry_after:.0f}s")
+                self.bucket.pause(retry_after)
+
+    # Cached objects for the given keys: {key: value} for the ones present and not expired
+    def _cache_get(self, keys, ttl):
+        if not keys:
+            return {}
+        found = {}
+        now = time.time()
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, fetched_at, value FROM responses WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                found.update({key: json.loads(value) for key, fetched_at, value in rows if now - fetched_at < ttl})
+        return found
+
+    def _cache_put(self, items):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO responses (key, fetched_at, value) VALUES (?, ?, ?)",
+                                  [(key, now, json.dumps(value)) for key, value in items.items()])
+
+    # Returns {key: object} for the keys, fetching the uncached ones with fetch(missing_keys) -> {key: object}.
+    # Keys another thread is already fetching are awaited instead of requested again.
+    def _get_many(self, keys, ttl, fetch):
+        keys = list(dict.fromkeys(keys))
+        results = self._cache_get(keys, ttl)
+        self._count("hits", len(results))
+
+        own, waiting = [], {}
+        with self.lock:
+            for key in keys:
+                if key in results:
+                    continue
+                if key in self.in_flight:
+                    waiting[key] = self.in_flight[key]
+                else:
+                    self.in_flight[key] = Future()
+                    own.append(key)
+        self._count("coalesced", len(waiting))
+        self._count("misses", len(own))
+
+        if own:
+            try:
+                fetched = fetch(own)
+                self._cache_put({key: value for key, value in fetched.items() if value is not None})
+            except Exception as e:
+                with self.lock:
+                    for key in own:
+                        self.in_flight.pop(key).set_exception(e)
+                raise
+            with self.lock:
+                for key in own:
+                    self.in_flight.pop(key).set_result(fetched.get(key))
+            results.update(fetched)
+
+        for key, future in waiting.items():
+            results[key] = future.result()
+        return results
+
+    def track(self, track_id, market=None):
+        return self.tracks([track_id], market)["tracks"][0]
+
+    # Same shape as spotipy's `tracks`: {"tracks": [track or None, ...]}, any number of IDs
+    def tracks(self, track_ids, market=None):
+        def fetch(keys):
+            fetched = {}
+            ids = [key.rsplit(":", 1)[1] for key in keys]
+            for i in range(0, len(ids), MULTI_ID_CHUNK):
+                chunk = ids[i:i + MULTI_ID_CHUNK]
+                for track_id, track in zip(chunk, self.call("tracks", chunk, market=market)["tracks"]):
+                    fetched[f"track:{market}:{track_id}"] = track
+            return fetched
+
+        objects = self._get_many([f"track:{market}:{track_id}" for track_id in track_ids], TRACK_TTL, fetch)
+        return {"tracks": [objects.get(f"track:{market}:{track_id}") for track_id in track_ids]}
+
+    def artist(self, artist_id):
+        return self.artists([artist_id])["artists"][0]
+
+    # Same shape as spotipy's `artists`: {"artists": [artist or None, ...]}, any number of IDs
+    def artists(self, artist_ids):
+        def fetch(keys):
+            fetched = {}
+            ids = [key.split(":", 1)[1] for key in keys]
+            for i in range(0, len(ids), MULTI_ID_CHUNK):
+                chunk = ids[i:i + MULTI_ID_CHUNK]
+                for artist_id, artist in zip(chunk, self.call("artists", chunk)["artists"]):
+                    fetched[f"artist:{artist_id}"] = artist
+            return fetched
+
+        objects = self._get_many([f"artist:{artist_id}" for artist_id in artist_ids], ARTIST_TTL, fetch)
+        return {"artists": [objects.get(f"artist:{artist_id}") for artist_id in artist_ids]}
+
+    # Paginated endpoints: rate-limited only
+    def album_tracks(self, album_id, **kwargs):
+        return self.call("album_tracks", album_id, **kwargs)
+
+    def playlist_items(self, playlist_id, **kwargs):
+        return self.call("playlist_items", playlist_id, **kwargs)
+
+    def next(self, page):
+        return self.call("next", page)
+
+    # Drop expired entries from the cache file
+    def prune(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - max(TRACK_TTL, ARTIST_TTL),))
+
+    def print_metrics(self):
+        m = self.metrics
+        lookups = m["hits"] + m["misses"]
+        hit_rate = f"{100 * m['hits'] / lookups:.0f}%" if lookups else "n/a"
+        print(f"📈 Spotify: {m['requests']} requests, cache hits {m['hits']}/{lookups} ({hit_rate}), "
+              f"{m['coalesced']} coalesced, {m['throttles']} throttled, "
+              f"{m['waitSeconds']:.1f}s waiting for the rate limiter")
+
+
+# HTTP session for spotipy: retries 5xx answers and network errors with backoff, but not 429s
+# (urllib3 would retry those whenever they carry Retry-After, unless told not to respect the header)
+def create_spotify_session():
+    retry = Retry(total=SPOTIPY_RETRIES, connect=None, read=False, status=SPOTIPY_RETRIES, backoff_factor=0.3,
+                  status_forcelist=SPOTIPY_STATUS_FORCELIST, allowed_methods=["GET", "POST", "PUT", "DELETE"],
+                  respect_retry_after_header=False, raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Spotipy client wrapped in a SpotifyClient, with 429s left to the wrapper
+def create_spotify(auth_manager, cache_path=DEFAULT_CACHE_PATH):
+    sp = spotipy.Spotify(auth_manager=auth_manager, requests_session=create_spotify_session())
+    return SpotifyClient(sp, cache_path)
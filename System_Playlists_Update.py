@@ -1,6 +1,16 @@
+import os
+import argparse
 from collections import defaultdict
-import firebase_admin
-from firebase_admin import credentials, firestore
+import numpy as np
+
+from Firebase_Setup import db
+from Catalog import JOB_FIELDS, SOURCES, load_songs, stream_songs
+from Firestore_Writer import BatchedWriter, get_all
+from Id_Cache import CACHE_DIR
+from Song_Similarity import mini_batch_kmeans, assign_to_centers
+from Metrics import timed_stream, job_run
+from Playlist_Storage import (DETAIL_FIELDS, STORED_FIELDS, songs_hash, song_detail, song_details, stored_chunk_listing,
+                              write_chunked_playlist)
 
 """
 This script generates system playlists based on genres stored in Firestore.
@@ -9,27 +19,62 @@ a list of song IDs into the `system_playlists` collection, one document per genr
 
 How it works:
 1. Fetches all genres from the `genres` collection.
-2. Loads all songs from the `songs` collection.
-3. For each song, checks its genre(s) and assigns it to the matching playlist.
+2. Loads the `genreId` field of all songs from the `songs` collection.
+3. Builds an inverted index genre -> songs in a single pass over the songs.
 4. Saves the resulting playlists into Firestore under the `system_playlists` collection.
 
+Incremental mode (default):
+- Each playlist document stores a `songsHash` of its ordered song IDs. Playlists whose hash is
+  unchanged are skipped without reading their `songs` subcollection.
+- For changed playlists, the stored `songs` subcollection is diffed against the new membership and
+  only added, removed and `isLast`-changed documents are written, through batched writes.
+- Use `--full` to rewrite every playlist document by document, like before.
+
+Cluster mode (`--mode clusters`):
+- Groups songs by their lyric `embedding` combined with `bpm` and `mainGenre`, using mini-batch
+  k-means on a memory-mapped NumPy matrix (bounded memory, no all-pairs similarity matrix).
+- Reproducible: a fixed `--seed`, and each run warm-starts from the previous run's centers
+  (`.queuemue_cache/cluster_centers.npz`), so playlists keep their identity across rebuilds.
+- Writes `system_playlists/cluster_NN` documents in the same `numSongs`/`isLast` shape; a cluster
+  that lost all its songs is written as an empty playlist, so it does not keep stale members.
+
+Chunked storage (`--storage chunked`):
+- Stores each playlist as a few chunk documents of ordered song IDs, with a version and etag on
+  the playlist document, instead of one document per membership (see `Playlist_Storage.py`).
+  Only chunks whose content changed are written, so a rebuild costs a handful of writes.
+- `--song-details` also caches each song's title, artist, cover and duration in the chunks.
+- Existing subcollection playlists are converted on their first chunked build, or all at once with
+  `python Playlist_Storage.py --migrate`.
+- If some writes of a chunked rebuild fail, the playlist document is re-pointed at the chunks as
+  stored, so readers still load it, and the next run rewrites it.
+
 Notes:
 - Matching is case-insensitive and based on containment (e.g., "hiphop" in "hiphop/urban").
 - Songs can belong to multiple playlists if they have multiple genres.
+- A genre playlist that lost all its songs is written as an empty playlist (like cluster playlists),
+  so it does not keep stale members; genres that never had songs get no playlist.
+- `--source snapshot` reads `genreId` from the local catalog snapshot (see `Catalog.py`), which
+  only fetches songs changed since its last refresh.
 """
-# Initialize Firebase
-cred = credentials.Certificate(r"C:\Users\yinon\PycharmProjects\quemueFirestoreAddSongs\queuemueue-firebase-admin.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+
+# Cluster mode settings
+DEFAULT_CLUSTERS = 12
+DEFAULT_SEED = 42
+BPM_WEIGHT = 0.5  # Relative weight of tempo vs. the unit-length lyric embedding
+GENRE_WEIGHT = 0.5  # Relative weight of sharing a mainGenre
+CLUSTER_CHUNK_ROWS = 8192
+CLUSTER_VECTORS_PATH = os.path.join(CACHE_DIR, "cluster_vectors.f32")
+CLUSTER_CENTERS_PATH = os.path.join(CACHE_DIR, "cluster_centers.npz")
 
 # Fetch all genre names (lowercased)
 def fetch_all_genres():
-    genres_ref = db.collection("genres").stream()
+    genres_ref = timed_stream("firestore.query", db.collection("genres").stream())
     return [doc.to_dict().get("name", "").strip().lower() for doc in genres_ref if doc.to_dict().get("name")]
 
-# Fetch all songs from Firestore
-def get_all_songs():
-    return list(db.collection("songs").stream())
+# Fetch all songs (only the field needed for grouping, plus the cached details if asked for)
+# from Firestore or the local catalog snapshot
+def get_all_songs(source="firestore", with_details=False):
+    return list(load_songs(db, JOB_FIELDS["playlists"] + (DETAIL_FIELDS if with_details else []), source))
 
 # Extract genre names (as lowercase strings) from a song's 'genreId' field
 def get_genre_names(genre_field):
@@ -42,44 +87,259 @@ def get_genre_names(genre_field):
     else:
         return []
 
-# Build playlists and write them to Firestore
-def build_system_playlists():
-    genre_names = fetch_all_genres()
-    all_songs = get_all_songs()
-
+# Build the genre -> [song_id] index in one pass over the songs (songs keep their stream order)
+def build_genre_index(genre_names, songs):
+    genre_names = list(dict.fromkeys(genre_names))
+    matches_by_song_genre = {}  # Song genre string -> playlist genres contained in it
     playlists = defaultdict(list)
 
-    for genre_name in genre_names:
-        for song in all_songs:
-            data = song.to_dict()
-            song_id = song.id
-            song_genres = get_genre_names(data.get("genreId"))
-
-            for sg in song_genres:
-                if genre_name in sg:
-                    playlists[genre_name].append(song_id)
-                    break  # Stop checking once a match is found
-
-    # Write playlists to Firestore
-    for genre, song_ids in playlists.items():
-        # Create playlist document (metadata)
-        playlist_ref = db.collection("system_playlists").document(genre)
-        playlist_ref.set({
-            "name": genre.capitalize(),
-            "numSongs": len(song_ids)
+    for song in songs:
+        matched = set()
+        for sg in get_genre_names(song.to_dict().get("genreId")):
+            if sg not in matches_by_song_genre:
+                matches_by_song_genre[sg] = [g for g in genre_names if g in sg]
+            matched.update(matches_by_song_genre[sg])
+
+        for genre_name in matched:
+            playlists[genre_name].append(song.id)
+
+    return playlists
+
+# Playlist metadata document fields
+def playlist_metadata(name, song_ids):
+    return {
+        "name": name,
+        "numSongs": len(song_ids),
+        "songsHash": songs_hash(song_ids)
+    }
+
+# Rewrite a playlist and its whole songs subcollection
+def write_full_playlist(writer, playlist_ref, name, song_ids):
+    writer.set(playlist_ref, playlist_metadata(name, song_ids))
+    for i, song_id in enumerate(song_ids):
+        writer.set(playlist_ref.collection("songs").document(song_id), {
+            "songId": song_id,
+            "isLast": (i == len(song_ids) - 1)
         })
 
-        # Write subcollection of songs with isLast field
-        for i, song_id in enumerate(song_ids):
-            playlist_ref.collection("songs").document(song_id).set({
-                "songId": song_id,
-                "isLast": (i == len(song_ids) - 1)
-            })
+# Write only the membership documents that differ from what is stored; returns the number of changed docs
+def write_playlist_diff(writer, playlist_ref, name, song_ids):
+    stored = {doc.id: doc.to_dict().get("isLast", False)
+              for doc in timed_stream("firestore.query", playlist_ref.collection("songs").select(["isLast"]).stream())}
+
+    changes = 0
+    for i, song_id in enumerate(song_ids):
+        is_last = (i == len(song_ids) - 1)
+        if song_id not in stored:
+            writer.set(playlist_ref.collection("songs").document(song_id), {"songId": song_id, "isLast": is_last})
+            changes += 1
+        elif stored[song_id] != is_last:
+            writer.update(playlist_ref.collection("songs").document(song_id), {"isLast": is_last})
+            changes += 1
+
+    for song_id in stored.keys() - set(song_ids):
+        writer.delete(playlist_ref.collection("songs").document(song_id))
+        changes += 1
+
+    writer.set(playlist_ref, playlist_metadata(name, song_ids))
+    return changes
+
+# Write playlists given as {playlist_id: (name, [song_id, ...])} to the system_playlists collection,
+# as `songs` subcollections or in the chunked format (`Playlist_Storage.py`, with optional song details)
+def write_playlists(playlists, incremental=True, storage="subcollection", details=None):
+    refs = {playlist_id: db.collection("system_playlists").document(playlist_id) for playlist_id in playlists}
+    chunked = storage == "chunked"
+    stored = {}
+    # Chunked playlists always need their stored version, even when rewritten in full
+    if (incremental or chunked) and refs:
+        for snapshot in get_all(db, refs.values(), field_paths=STORED_FIELDS if chunked else ["songsHash", "name"]):
+            if snapshot.exists:
+                stored[snapshot.id] = snapshot.to_dict()
+
+    # A playlist with a failed membership write must not keep its new hash, or the next run would skip it
+    failed_playlists = set()
+    with BatchedWriter(db, on_error=lambda ref, e: failed_playlists.add(ref.path.split("/")[1])) as writer:
+        for playlist_id, (name, song_ids) in playlists.items():
+            current = stored.get(playlist_id, {})
+            if chunked:
+                changes = write_chunked_playlist(writer, refs[playlist_id], name, song_ids, details, current,
+                                                 force=not incremental)
+                if changes is None:
+                    print(f"⏭️ Playlist '{playlist_id}' – unchanged ({len(song_ids)} songs).")
+                else:
+                    print(f"🎵 Playlist '{playlist_id}' – {len(song_ids)} songs, {changes} chunk changes.")
+            elif not incremental:
+                write_full_playlist(writer, refs[playlist_id], name, song_ids)
+                print(f"🎵 Playlist '{playlist_id}' – {len(song_ids)} songs added.")
+            elif current.get("songsHash") == songs_hash(song_ids) and current.get("name") == name:
+                print(f"⏭️ Playlist '{playlist_id}' – unchanged ({len(song_ids)} songs).")
+            else:
+                changes = write_playlist_diff(writer, refs[playlist_id], name, song_ids)
+                print(f"🎵 Playlist '{playlist_id}' – {len(song_ids)} songs, {changes} membership changes.")
+
+    if failed_playlists:
+        with BatchedWriter(db) as writer:
+            for playlist_id in failed_playlists:
+                cleared = {"songsHash": ""}
+                if chunked:  # List the chunks as stored, so readers can still load the playlist
+                    previous_chunks = stored.get(playlist_id, {}).get("chunks", [])
+                    cleared.update(stored_chunk_listing(db, refs[playlist_id], previous_chunks))
+                writer.set(refs[playlist_id], cleared, merge=True)
+        print(f"\n⚠️ Some writes failed for {len(failed_playlists)} playlists; they will be re-synced on the next run.")
 
-        print(f"🎵 Playlist '{genre}' – {len(song_ids)} songs added.")
+# Build playlists and write them to Firestore; `songs` can be a preloaded snapshot with `genreId`
+# (and the DETAIL_FIELDS, for `with_details`)
+def build_system_playlists(incremental=True, songs=None, source="firestore", storage="subcollection",
+                           with_details=False):
+    genre_names = fetch_all_genres()
+    songs = get_all_songs(source, with_details) if songs is None else songs
+    playlists = build_genre_index(genre_names, songs)
+    details = song_details(songs) if with_details else None
+
+    # Existing playlists of genres that no longer have songs are rewritten empty
+    emptied = [db.collection("system_playlists").document(g) for g in dict.fromkeys(genre_names) if g not in playlists]
+    if emptied:
+        for snapshot in get_all(db, emptied, field_paths=["numSongs"]):
+            if snapshot.exists:
+                playlists[snapshot.id] = []
 
+    write_playlists({genre: (genre.capitalize(), song_ids) for genre, song_ids in playlists.items()},
+                    incremental, storage, details)
     print("\n✅ System playlists with isLast updated successfully!")
 
-# Main Execution
+# Load cluster inputs: embeddings go to a memory-mapped file, bpm/mainGenre stay in small arrays
+def load_cluster_inputs(details=None):
+    ids, bpms, main_genres = [], [], []
+    dim = None
+    fields = JOB_FIELDS["clusters"] + (DETAIL_FIELDS if details is not None else [])
+    with open(CLUSTER_VECTORS_PATH, "wb") as f:
+        for song in stream_songs(db, fields):
+            data = song.to_dict()
+            embedding = data.get("embedding")
+            if not embedding or (dim is not None and len(embedding) != dim):
+                continue
+            if details is not None:
+                details[song.id] = song_detail(data)
+            dim = dim or len(embedding)
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            f.write((vector / norm if norm else vector).tobytes())
+            ids.append(song.id)
+            bpms.append(data.get("bpm") or np.nan)
+            main_genres.append(data.get("mainGenre") or "")
+
+    if not ids:
+        return ids, None
+    vectors = np.memmap(CLUSTER_VECTORS_PATH, dtype=np.float32, mode="r", shape=(len(ids), dim))
+    return ids, ClusterFeatures(vectors, np.asarray(bpms, dtype=np.float32), main_genres)
+
+# Feature rows for clustering, computed on demand so only one batch is materialized at a time:
+# [normalized embedding | scaled bpm | one-hot mainGenre]
+class ClusterFeatures:
+    def __init__(self, vectors, bpms, main_genres):
+        self.vectors = vectors
+        self.genres = sorted({g for g in main_genres if g})
+        column_of = {g: i for i, g in enumerate(self.genres)}
+        self.genre_column = np.asarray([column_of.get(g, -1) for g in main_genres], dtype=np.int64)
+        self.main_genres = main_genres
+        self.bpms = bpms
+        # Missing BPM is neutral (0 after scaling)
+        self.bpm_feature = np.nan_to_num(np.clip((bpms - 120) / 40, -2, 2)) * BPM_WEIGHT
+
+    @property
+    def shape(self):
+        return self.vectors.shape[0], self.vectors.shape[1] + 1 + len(self.genres)
+
+    def __getitem__(self, rows):
+        embeddings = np.asarray(self.vectors[rows], dtype=np.float32)
+        genre_columns = self.genre_column[rows]
+        one_hot = np.zeros((len(embeddings), len(self.genres)), dtype=np.float32)
+        has_genre = genre_columns >= 0
+        one_hot[np.nonzero(has_genre)[0], genre_columns[has_genre]] = GENRE_WEIGHT
+        return np.hstack([embeddings, self.bpm_feature[rows, None], one_hot])
+
+# Previous run's centers, re-mapped to the current genre columns (None if unusable)
+def load_previous_centers(features, k):
+    try:
+        previous = np.load(CLUSTER_CENTERS_PATH, allow_pickle=False)
+        centers, genres = previous["centers"], list(previous["genres"])
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+    embedding_dim = features.vectors.shape[1]
+    if centers.shape[0] != k or centers.shape[1] != embedding_dim + 1 + len(genres):
+        return None
+
+    remapped = np.zeros((k, features.shape[1]), dtype=np.float32)
+    remapped[:, :embedding_dim + 1] = centers[:, :embedding_dim + 1]
+    old_column = {g: i for i, g in enumerate(genres)}
+    for new_i, g in enumerate(features.genres):
+        if g in old_column:
+            remapped[:, embedding_dim + 1 + new_i] = centers[:, embedding_dim + 1 + old_column[g]]
+    return remapped
+
+# Build playlists by clustering lyric embeddings + bpm + mainGenre, and write them to Firestore
+def build_cluster_playlists(k=DEFAULT_CLUSTERS, seed=DEFAULT_SEED, incremental=True, storage="subcollection",
+                            with_details=False):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    details = {} if with_details else None
+    ids, features = load_cluster_inputs(details)
+    if not ids:
+        print("⚠️ No songs with embeddings to cluster.")
+        return
+
+    centers = mini_batch_kmeans(features, k, seed=seed, init_centers=load_previous_centers(features, k))
+    labels = assign_to_centers(features, centers)
+    np.savez(CLUSTER_CENTERS_PATH, centers=centers, genres=np.asarray(features.genres, dtype=str))
+
+    # Order each playlist by distance to its center (most typical songs first), ties by song ID
+    distances = np.empty(len(ids), dtype=np.float32)
+    for start in range(0, len(ids), CLUSTER_CHUNK_ROWS):
+        rows = np.arange(start, min(start + CLUSTER_CHUNK_ROWS, len(ids)))
+        distances[rows] = ((features[rows] - centers[labels[rows]]) ** 2).sum(axis=1)
+
+    playlists = {}
+    for c in range(len(centers)):
+        members = np.nonzero(labels == c)[0]
+        members = sorted(members, key=lambda row: (distances[row], ids[row]))
+        playlists[f"cluster_{c:02d}"] = (cluster_name(features, members, c), [ids[row] for row in members])
+
+    write_playlists(playlists, incremental, storage, details)
+    print(f"\n✅ {len(playlists)} cluster playlists updated successfully!")
+
+# Display name from the dominant mainGenre and median BPM of a cluster
+def cluster_name(features, members, c):
+    genres = [features.main_genres[row] for row in members if features.main_genres[row]]
+    genre = max(sorted(set(genres)), key=genres.count).replace("_", " ").capitalize() if genres else "Mixed"
+    bpms = features.bpms[members]
+    bpms = bpms[~np.isnan(bpms)]
+    tempo = f" · {int(np.median(bpms))} BPM" if len(bpms) else ""
+    return f"{genre} Mix {c + 1}{tempo}"
+
+# Command-line entry point (`python System_Playlists_Update.py` or `python QueueMue_CLI.py playlists`)
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Build system playlists")
+    parser.add_argument("--full", action="store_true", help="rewrite every playlist instead of diffing")
+    parser.add_argument("--mode", choices=["genres", "clusters"], default="genres",
+                        help="group by genre substring (default) or by embedding clusters")
+    parser.add_argument("--clusters", type=int, default=DEFAULT_CLUSTERS, help="number of cluster playlists")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="random seed for clustering")
+    parser.add_argument("--source", choices=SOURCES, default="firestore",
+                        help="read songs from Firestore or the local catalog snapshot (genres mode)")
+    parser.add_argument("--storage", choices=["subcollection", "chunked"], default="subcollection",
+                        help="one document per membership (default) or chunked song lists (Playlist_Storage.py)")
+    parser.add_argument("--song-details", action="store_true",
+                        help="cache title/artist/cover/duration in the chunks (chunked storage)")
+    args = parser.parse_args(argv)
+    if args.song_details and args.storage != "chunked":
+        parser.error("--song-details needs --storage chunked")
+
+    with job_run("playlists"):
+        if args.mode == "clusters":
+            build_cluster_playlists(args.clusters, args.seed, incremental=not args.full,
+                                    storage=args.storage, with_details=args.song_details)
+        else:
+            build_system_playlists(incremental=not args.full, source=args.source,
+                                   storage=args.storage, with_details=args.song_details)
+
 if __name__ == "__main__":
-    build_system_playlists()
+    cli()
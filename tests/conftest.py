@@ -0,0 +1,72 @@
+"""
+Shared test setup.
+
+The job modules import `db` / `bucket` from `Firebase_Setup` and read `Id_Cache.CACHE_DIR` at import
+time, so before any of them is imported this module:
+- puts the repository root on `sys.path`,
+- points `QUEUEMUE_CACHE_DIR` at a temporary directory (removed at the end of the session),
+- installs a stand-in `Firebase_Setup` backed by the in-memory fakes of `Benchmark_Fakes.py`.
+
+Fixtures:
+- `db`: the shared `FakeFirestore`, emptied (and with write failures cleared) for every test.
+- `bucket`: the shared `FakeBucket`, emptied for every test.
+- `metrics`: the `Metrics.py` registry, reset for every test.
+"""
+
+import os
+import sys
+import types
+import shutil
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CACHE_DIR = tempfile.mkdtemp(prefix="queuemue_tests_")
+os.environ["QUEUEMUE_CACHE_DIR"] = CACHE_DIR
+os.environ.setdefault("SPOTIPY_CLIENT_ID", "tests")
+os.environ.setdefault("SPOTIPY_CLIENT_SECRET", "tests")
+
+from Benchmark_Fakes import FakeFirestore, FakeBucket  # noqa: E402
+
+firebase_setup = types.ModuleType("Firebase_Setup")
+firebase_setup.db = FakeFirestore()
+firebase_setup.bucket = FakeBucket()
+firebase_setup.BUCKET_NAME = firebase_setup.bucket.name
+firebase_setup.CREDENTIALS_PATH = None
+firebase_setup.PROJECT_ID = "tests"
+sys.modules["Firebase_Setup"] = firebase_setup
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def db():
+    fake = firebase_setup.db
+    with fake.lock:
+        fake.collections.clear()
+    fake.rpc.reset()
+    fake.fail_writes = None
+    yield fake
+    fake.fail_writes = None
+
+
+@pytest.fixture
+def bucket():
+    fake = firebase_setup.bucket
+    with fake.lock:
+        fake.blobs.clear()
+    fake.rpc.reset()
+    return fake
+
+
+@pytest.fixture
+def metrics():
+    from Metrics import registry
+    registry.reset()
+    yield registry
+    registry.reset()
@@ -0,0 +1,105 @@
+import pytest
+
+import Add_Song_To_DB as ingest
+
+
+class FakeSpotify:
+    def __init__(self, albums=None, playlists=None):
+        self.albums = albums or {}
+        self.playlists = playlists or {}
+        self.calls = []
+
+    # Pages hold up to `size` items and link the next one through "next"
+    @staticmethod
+    def _pages(items, size):
+        pages = [{"items": items[i:i + size], "next": None} for i in range(0, len(items), size)] or [
+            {"items": [], "next": None}]
+        for page, following in zip(pages, pages[1:]):
+            page["next"] = following
+        return pages[0]
+
+    def album_tracks(self, album_id, limit=50):
+        self.calls.append(("album_tracks", album_id))
+        return self._pages([{"id": track_id} for track_id in self.albums[album_id]], 2)
+
+    def playlist_items(self, playlist_id, **kwargs):
+        self.calls.append(("playlist_items", playlist_id))
+        return self._pages(self.playlists[playlist_id], 2)
+
+    def next(self, page):
+        self.calls.append(("next",))
+        return page["next"]
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://open.spotify.com/track/abc123?si=xyz", ("track", "abc123")),
+    ("https://open.spotify.com/intl-he/album/alb1/", ("album", "alb1")),
+    ("spotify:playlist:pl1", ("playlist", "pl1")),
+    ("  https://open.spotify.com/track/t9  ", ("track", "t9")),
+])
+def test_parse_spotify_url(url, expected):
+    assert ingest.parse_spotify_url(url) == expected
+
+
+def test_parse_spotify_url_rejects_other_links():
+    with pytest.raises(ValueError):
+        ingest.parse_spotify_url("https://open.spotify.com/artist/a1")
+
+
+def test_collect_track_ids_expands_albums_and_playlists_in_order(monkeypatch):
+    spotify = FakeSpotify(
+        albums={"alb": ["t2", "t3", "t4"]},
+        playlists={"pl": [{"track": {"id": "t4", "type": "track"}},
+                          {"track": {"id": "ep1", "type": "episode"}},
+                          {"track": None},
+                          {"track": {"id": "t5", "type": "track"}}]},
+    )
+    monkeypatch.setattr(ingest, "spotify", spotify)
+
+    track_ids = ingest.collect_track_ids([
+        "https://open.spotify.com/track/t1",
+        "https://open.spotify.com/album/alb",
+        "not a spotify link",
+        "spotify:playlist:pl",
+        "https://open.spotify.com/track/t1",
+    ])
+
+    assert track_ids == ["t1", "t2", "t3", "t4", "t5"]
+    assert ("next",) in spotify.calls  # Both multi-page sources were followed to their last page
+
+
+def song_info(title, artist, genres):
+    return {"track_id": title, "title": title, "artist": artist, "artist_id": artist, "duration": 200,
+            "url": f"https://open.spotify.com/track/{title}", "cover": "", "audioUrl": "", "genres": genres}
+
+
+def test_upload_songs_reports_songs_with_failed_related_writes(db, tmp_path, monkeypatch):
+    from Id_Cache import IdCache
+    id_cache = IdCache(path=str(tmp_path / "id_cache.json"))
+    monkeypatch.setattr(ingest, "id_cache", id_cache)
+    db.fail_writes = lambda path: path in ("artists/BROKEN_ARTIST", "genres/BAD_GENRE")
+
+    uploaded = ingest.upload_songs([
+        song_info("Fine Song", "Good Artist", ["pop"]),
+        song_info("Orphan Song", "Broken Artist", ["pop"]),
+        song_info("Odd Song", "Good Artist", ["bad genre"]),
+    ])
+
+    assert uploaded == ["FINE_SONG"]
+    assert not id_cache.contains("artists", "BROKEN_ARTIST")  # Retried by the next run
+    assert not id_cache.contains("genres", "BAD_GENRE")
+    assert id_cache.contains("artists", "GOOD_ARTIST")
+
+
+def test_upload_songs_skips_duplicate_titles_as_failed(db, tmp_path, monkeypatch, capsys):
+    from Id_Cache import IdCache
+    monkeypatch.setattr(ingest, "id_cache", IdCache(path=str(tmp_path / "id_cache.json")))
+
+    uploaded = ingest.upload_songs([
+        song_info("Intro", "First Artist", ["pop"]),
+        song_info("Intro", "Second Artist", ["rock"]),
+    ])
+
+    assert uploaded == ["INTRO"]
+    assert db.collections["songs"]["INTRO"]["artistName"] == "First Artist"  # Not overwritten
+    assert "skipped" in capsys.readouterr().out
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from Benchmark_Fakes import click_track_wav
+
+import Audio_Analysis
+from Audio_Analysis import FEATURES_VERSION, SONG_FEATURE_FIELDS, extract_features, features_current, song_feature_fields
+
+
+@pytest.fixture(scope="module")
+def features():
+    return extract_features(click_track_wav(120, seconds=20), window_seconds=None)
+
+
+def test_one_decode_gives_every_feature(features):
+    assert features["featuresVersion"] == FEATURES_VERSION
+    assert abs(features["bpm"] - 120) <= 3
+    assert features["key"] in Audio_Analysis.KEY_NAMES and features["mode"] in ("major", "minor")
+    assert set(SONG_FEATURE_FIELDS) <= set(features)
+    json.dumps(features)  # Stored as is in Firestore and the feature store
+
+
+def test_song_fields_are_the_scalar_features(features):
+    fields = song_feature_fields(features)
+    assert fields["bpm"] == features["bpm"]
+    assert sorted(fields["audioFeatures"]) == sorted(SONG_FEATURE_FIELDS)
+
+
+def test_features_current():
+    assert features_current({"bpm": 120, "featuresVersion": FEATURES_VERSION})
+    assert not features_current({"bpm": 120})  # Written before the feature vector existed
+    assert not features_current({"featuresVersion": FEATURES_VERSION})
+    assert not features_current(None)
+
+
+def test_undecodable_audio_gives_none():
+    assert extract_features(b"not audio") is None
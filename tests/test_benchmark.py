@@ -0,0 +1,25 @@
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Runs the whole suite on a tiny catalog, in its own process like `Benchmark.py` runs each size
+def test_smoke_run_reports_every_job(tmp_path):
+    output = tmp_path / "results.json"
+    argv = [sys.executable, os.path.join(ROOT, "Benchmark.py"), "--sizes", "100", "--backlog", "10",
+            "--rpc-latency-ms", "0", "--storage-latency-ms", "0", "--http-latency-ms", "0",
+            "--analysis-workers", "1", "--no-memory", "--output", str(output)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + sys.path))
+    subprocess.run(argv, cwd=tmp_path, env=env, capture_output=True, text=True, check=True, timeout=300)
+
+    rows = {row["job"]: row for row in json.loads(output.read_text(encoding="utf-8"))["results"]}
+    assert sorted(rows) == sorted(["ingest", "playlists", "chunked", "bpm", "lyrics", "embeddings", "mp3"])
+    for job in ("ingest", "playlists", "chunked", "lyrics", "mp3"):
+        assert rows[job]["status"] == "ok", rows[job].get("error")
+        assert rows[job]["firestore"]["docsWritten"] > 0
+    assert all(row["status"] in ("ok", "skipped") for row in rows.values())  # bpm/embeddings need librosa/torch
+    assert rows["ingest"]["http"]  # Spotify calls went to the local fake services
+    assert rows["mp3"]["storage"]
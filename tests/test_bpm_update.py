@@ -0,0 +1,51 @@
+import os
+import sys
+import subprocess
+
+from Benchmark_Fakes import FakeSnapshot
+
+import BPM_Update
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Analyzer processes started with spawn/forkserver re-import BPM_Update when it runs as a script
+def test_import_does_not_initialize_firebase():
+    code = "import sys, BPM_Update; print('Firebase_Setup' in sys.modules, 'librosa' in sys.modules)"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + sys.path))
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_find_songs_missing_bpm(db):
+    songs = db.collection("songs")
+    docs = [
+        FakeSnapshot(songs.document("NEW"), {"title": "New", "audioUrl": "https://a/new.mp3", "bpm": None}),
+        FakeSnapshot(songs.document("DONE"), {"title": "Done", "audioUrl": "https://a/done.mp3", "bpm": 120,
+                                              "featuresVersion": 0}),
+        FakeSnapshot(songs.document("NO_AUDIO"), {"title": "No audio", "audioUrl": "", "bpm": None}),
+    ]
+
+    assert BPM_Update.find_songs_missing_bpm(docs) == [("NEW", "New", "https://a/new.mp3")]
+    assert [doc_id for doc_id, _, _ in BPM_Update.find_songs_missing_bpm(docs, refresh_features=True)] == [
+        "NEW", "DONE"]
+
+
+def test_song_with_both_writes_failed_counts_once(db, tmp_path, monkeypatch, capsys):
+    from Feature_Store import FeatureStore
+    from Audio_Analysis import FEATURES_VERSION
+
+    store = FeatureStore(path=str(tmp_path / "features.sqlite"))
+    store.put("sha", "md5", {"bpm": 120, "featuresVersion": FEATURES_VERSION}, object_key="songs/a.mp3#1")
+    monkeypatch.setattr(BPM_Update, "FeatureStore", lambda: store)
+    monkeypatch.setattr(BPM_Update, "head_audio", lambda url: ("songs/a.mp3#1", "md5"))
+    db.load("songs", {"A": {"title": "A", "bpm": None}, "B": {"title": "B", "bpm": None}})
+    db.fail_writes = lambda path: path.endswith("/A")  # Both songs/A and audio_features/A
+
+    failed_ids = BPM_Update.run_bpm_pipeline([("A", "A", "https://a/a.mp3"), ("B", "B", "https://a/b.mp3")],
+                                             download_workers=1, analysis_workers=1)
+
+    assert failed_ids == {"A"}
+    out = capsys.readouterr().out
+    assert "✅ Success: 1" in out and "❌ Failed: 1" in out
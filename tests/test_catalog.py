@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import Catalog
+from Catalog import CatalogSnapshot, load_songs
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def song(title, minutes, **fields):
+    return {"title": title, "genreId": ["pop"], "lyrics": "long text", "updatedAt": T0 + timedelta(minutes=minutes),
+            **fields}
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    snapshot = CatalogSnapshot(str(tmp_path / "catalog.sqlite"))
+    yield snapshot
+    snapshot.close()
+
+
+def test_refresh_reads_only_changed_songs(db, snapshot):
+    db.load("songs", {"B": song("B", 1), "A": song("A", 2)})
+    assert snapshot.refresh(db) == (2, 0)
+
+    db.load("songs", {"C": song("C", 3)})
+    db.rpc.reset()
+    assert snapshot.refresh(db) == (1, 0)
+    assert db.rpc.snapshot()["docsRead"] == 1
+
+    assert [(doc.id, doc.to_dict()) for doc in snapshot.songs(["title", "genreId"])] == [
+        ("A", {"title": "A", "genreId": ["pop"]}), ("B", {"title": "B", "genreId": ["pop"]}),
+        ("C", {"title": "C", "genreId": ["pop"]})]
+
+
+def test_full_refresh_drops_deleted_songs(db, snapshot):
+    db.load("songs", {"A": song("A", 1), "B": song("B", 2)})
+    snapshot.refresh(db)
+    del db.collections["songs"]["B"]
+    assert snapshot.refresh(db, full=True) == (1, 1)
+    assert len(snapshot) == 1
+
+
+def test_snapshot_rejects_fields_it_does_not_store(snapshot):
+    with pytest.raises(ValueError):
+        list(snapshot.songs(["lyrics"]))
+
+
+def test_sources_return_the_same_songs_in_the_same_order(db, tmp_path, monkeypatch):
+    db.load("songs", {song_id: song(song_id, i) for i, song_id in enumerate(["m", "B", "a", "Z"])})
+    closed = []
+    close = CatalogSnapshot.close
+    monkeypatch.setattr(CatalogSnapshot, "close", lambda self: closed.append(self.path) or close(self))
+    path = str(tmp_path / "catalog.sqlite")
+
+    from_firestore = [(doc.id, doc.to_dict()) for doc in load_songs(db, "playlists")]
+    from_snapshot = [(doc.id, doc.to_dict()) for doc in load_songs(db, "playlists", "snapshot", path)]
+    assert from_snapshot == from_firestore
+    assert [song_id for song_id, _ in from_firestore] == ["B", "Z", "a", "m"]
+    assert closed == [path]
+
+    songs = load_songs(None, "playlists", "offline", path)
+    next(songs)
+    songs.close()  # Stopping early closes the snapshot too
+    assert closed == [path, path]
+
+
+def test_jobs_outside_the_snapshot_read_firestore(db, tmp_path):
+    db.load("songs", {"A": song("A", 1)})
+    assert [doc.to_dict() for doc in load_songs(db, ["lyrics"], "offline", str(tmp_path / "c.sqlite"))] == [
+        {"lyrics": "long text"}]
+
+
+def test_status_flags():
+    assert Catalog.status_flags({"audioUrl": "https://a", "bpm": 0, "lyrics": "la"}) == {
+        "needsAudio": False, "needsBpm": True, "needsLyrics": False}
@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+
+import Create_Main_Genre
+from Create_Main_Genre import derive_main_genre, update_main_genre
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def test_derive_main_genre():
+    assert derive_main_genre(["POP", "ROCK"]) == "POP"
+    assert derive_main_genre([]) is None
+    assert derive_main_genre("POP") is None
+
+
+def test_writes_only_changed_songs_in_batches(db, capsys):
+    db.load("songs", {
+        "NEW": {"genreId": ["POP", "ROCK"], "updatedAt": T0},
+        "STALE": {"genreId": ["JAZZ"], "mainGenre": "POP", "updatedAt": T0},
+        "SAME": {"genreId": ["ROCK"], "mainGenre": "ROCK", "updatedAt": T0},
+        "NO_GENRE": {"genreId": [], "updatedAt": T0},
+        **{f"BULK{i}": {"genreId": ["FOLK"], "updatedAt": T0} for i in range(4)},
+    })
+
+    update_main_genre(flush_size=2)
+
+    songs = db.collections["songs"]
+    assert songs["NEW"]["mainGenre"] == "POP" and songs["STALE"]["mainGenre"] == "JAZZ"
+    assert "updatedBy" not in songs["SAME"] and "mainGenre" not in songs["NO_GENRE"]
+    assert db.rpc.snapshot()["commit"] == 4  # 6 updates, 2 per batch, then the watermark
+    assert "mainGenre updated: 6, unchanged: 1, no genres: 1" in capsys.readouterr().out
+
+    update_main_genre()  # Its own writes are not selected again
+    assert "mainGenre updated: 0, unchanged: 0, no genres: 0" in capsys.readouterr().out
+
+
+def test_flush_size_is_capped_at_the_batch_limit(db, monkeypatch):
+    sizes = []
+    writer = Create_Main_Genre.BatchedWriter
+    monkeypatch.setattr(Create_Main_Genre, "BatchedWriter",
+                        lambda client, flush_size: sizes.append(flush_size) or writer(client, flush_size=flush_size))
+    update_main_genre(flush_size=10_000)
+    assert sizes == [Create_Main_Genre.MAX_BATCH_SIZE]
+
+
+def test_failed_update_is_retried_by_the_next_run(db):
+    db.load("songs", {"A": {"genreId": ["POP"], "updatedAt": T0}, "B": {"genreId": ["ROCK"], "updatedAt": T0}})
+    db.fail_writes = lambda path: path == "songs/B"
+    update_main_genre()
+    assert "mainGenre" not in db.collections["songs"]["B"]
+
+    db.fail_writes = None
+    update_main_genre()
+    assert db.collections["songs"]["B"]["mainGenre"] == "ROCK"
+
+
+def test_new_songs_get_their_main_genre_at_ingest():
+    from Add_Song_To_DB import build_song_doc
+
+    song = {"title": "Hello", "artist": "Adele", "duration": 295, "url": "", "cover": "", "audioUrl": ""}
+    assert build_song_doc({**song, "genres": ["soul pop", "pop"]})["mainGenre"] == "SOUL_POP"
+    assert "mainGenre" not in build_song_doc({**song, "genres": []})
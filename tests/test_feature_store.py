@@ -0,0 +1,23 @@
+from Feature_Store import FeatureStore, content_hashes, file_hashes, storage_object_key
+
+
+def test_lookups_by_hash_md5_and_object(tmp_path):
+    store = FeatureStore(path=str(tmp_path / "features.sqlite"))
+    sha256, md5 = content_hashes(b"audio bytes")
+    key = storage_object_key("bucket", "songs/a.mp3", 3)
+
+    store.put(sha256, md5, {"bpm": 120}, object_key=key)
+    store.put(sha256, md5, {"key": "A"})
+
+    assert store.get(sha256) == {"bpm": 120, "key": "A"}  # Merged
+    assert store.get_by_md5(md5) == {"bpm": 120, "key": "A"}
+    assert store.get_by_object(key) == {"bpm": 120, "key": "A"}
+    assert store.get_by_object(storage_object_key("bucket", "songs/a.mp3", 4)) is None
+    assert store.get(None) is None
+    store.close()
+
+
+def test_file_hashes_match_content_hashes(tmp_path):
+    path = tmp_path / "a.mp3"
+    path.write_bytes(b"x" * 3_000_000)
+    assert file_hashes(str(path)) == content_hashes(b"x" * 3_000_000)
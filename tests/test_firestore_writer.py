@@ -0,0 +1,70 @@
+import pytest
+
+from Firestore_Writer import BatchedWriter, existing_paths, set_if_absent
+
+
+def test_flushes_every_flush_size_writes(db):
+    with BatchedWriter(db, flush_size=3) as writer:
+        for i in range(7):
+            writer.set(db.collection("songs").document(f"S{i}"), {"n": i})
+        assert db.rpc.snapshot()["commit"] == 2  # 3 + 3, one write still pending
+
+    assert db.rpc.snapshot()["commit"] == 3
+    assert writer.written == 7
+    assert writer.errors == []
+    assert db.count("songs") == 7
+
+
+def test_failed_batch_is_retried_one_by_one(db):
+    db.fail_writes = lambda path: path == "songs/S2"
+    failed_refs = []
+
+    with BatchedWriter(db, flush_size=5, on_error=lambda ref, e: failed_refs.append(ref.path)) as writer:
+        for i in range(5):
+            writer.set(db.collection("songs").document(f"S{i}"), {"n": i})
+
+    assert [path for path, _ in writer.errors] == ["songs/S2"]
+    assert failed_refs == ["songs/S2"]
+    assert writer.written == 4
+    assert sorted(db.collections["songs"]) == ["S0", "S1", "S3", "S4"]
+
+
+def test_update_of_missing_document_fails_alone(db):
+    db.load("songs", {"A": {"bpm": None}})
+    with BatchedWriter(db) as writer:
+        writer.update(db.collection("songs").document("A"), {"bpm": 120})
+        writer.update(db.collection("songs").document("MISSING"), {"bpm": 90})
+        writer.delete(db.collection("songs").document("A"))
+
+    assert [path for path, _ in writer.errors] == ["songs/MISSING"]
+    assert db.count("songs") == 0
+
+
+def test_flush_returns_only_this_flushs_failures(db):
+    db.fail_writes = lambda path: path.endswith("BAD")
+    writer = BatchedWriter(db)
+    writer.set(db.collection("songs").document("BAD"), {})
+    assert [path for path, _ in writer.flush()] == ["songs/BAD"]
+
+    writer.set(db.collection("songs").document("GOOD"), {})
+    assert writer.flush() == []
+    assert len(writer.errors) == 1
+
+
+def test_flush_size_is_capped():
+    with pytest.raises(ValueError):
+        BatchedWriter(None, flush_size=501)
+
+
+def test_set_if_absent_queues_only_missing_documents(db):
+    db.load("artists", {"ADELE": {"name": "Adele"}})
+    with BatchedWriter(db) as writer:
+        queued = set_if_absent(writer, [
+            (db.collection("artists").document("ADELE"), {"name": "Adele (new)"}),
+            (db.collection("artists").document("SIA"), {"name": "Sia"}),
+            (db.collection("artists").document("SIA"), {"name": "Sia"}),
+        ])
+
+    assert [ref.path for ref in queued] == ["artists/SIA"]
+    assert db.collections["artists"]["ADELE"] == {"name": "Adele"}
+    assert existing_paths(db, [db.collection("artists").document(i) for i in ("SIA", "NOPE")]) == {"artists/SIA"}
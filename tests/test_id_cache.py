@@ -0,0 +1,51 @@
+import json
+import time
+
+from Id_Cache import IdCache
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "id_cache.json")
+    cache = IdCache(path=path)
+    cache.add("artists", "ADELE")
+    cache.add("genres", "POP")
+    cache.save()
+
+    reloaded = IdCache(path=path)
+    assert reloaded.contains("artists", "ADELE")
+    assert reloaded.contains("genres", "POP")
+    assert not reloaded.contains("artists", "POP")
+
+
+def test_unreadable_file_means_empty_cache(tmp_path):
+    path = tmp_path / "id_cache.json"
+    path.write_text("{not json", encoding="utf-8")
+    cache = IdCache(path=str(path))
+    assert not cache.contains("artists", "ADELE")
+
+
+def test_warm_scans_once_until_stale(db, tmp_path):
+    db.load("artists", {"ADELE": {"name": "Adele"}, "SIA": {"name": "Sia"}})
+    db.load("genres", {"POP": {"name": "pop"}})
+    cache = IdCache(path=str(tmp_path / "id_cache.json"))
+
+    assert cache.warm(db)
+    assert cache.contains("artists", "SIA") and cache.contains("genres", "POP")
+    queries = db.rpc.snapshot()["runQuery"]
+
+    assert not cache.warm(db)  # Still fresh: no scan
+    assert db.rpc.snapshot()["runQuery"] == queries
+
+    cache.warmed_at = time.time() - 2 * 24 * 3600
+    assert cache.warm(db)
+
+
+def test_invalidate_ref_forgets_a_failed_document(db, tmp_path):
+    cache = IdCache(path=str(tmp_path / "id_cache.json"))
+    cache.add("artists", "ADELE")
+    cache.invalidate_ref(db.collection("artists").document("ADELE"), RuntimeError("write failed"))
+    assert not cache.contains("artists", "ADELE")
+
+    cache.save()
+    with open(cache.path, encoding="utf-8") as f:
+        assert json.load(f)["known"]["artists"] == []
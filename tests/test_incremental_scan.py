@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+from Firestore_Writer import BatchedWriter
+from Incremental_Scan import IncrementalScan, load_watermark, save_watermark, touch
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+def scanned_ids(scan):
+    return sorted(doc.id for doc in scan)
+
+
+def test_commit_stores_the_newest_timestamp_seen(db):
+    db.load("songs", {"A": {"updatedAt": at(1)}, "B": {"updatedAt": at(2)}, "LEGACY": {}})
+
+    scan = IncrementalScan(db, "job")
+    assert scan.is_full
+    assert scanned_ids(scan) == ["A", "B", "LEGACY"]
+    scan.commit()
+    assert load_watermark(db, "job") == at(2)
+
+    db.load("songs", {"C": {"updatedAt": at(3)}})
+    assert scanned_ids(IncrementalScan(db, "job")) == ["C"]
+
+
+def test_failed_documents_are_scanned_again(db):
+    db.load("songs", {"A": {"updatedAt": at(1)}, "B": {"updatedAt": at(2)}, "C": {"updatedAt": at(3)}})
+    save_watermark(db, "job", at(0))
+
+    scan = IncrementalScan(db, "job")
+    docs = {doc.id: doc for doc in scan}
+    scan.mark_failed(docs["B"])
+    scan.commit()
+
+    assert scanned_ids(IncrementalScan(db, "job")) == ["B", "C"]
+
+
+def test_failed_document_without_timestamp_keeps_the_watermark(db):
+    db.load("songs", {"A": {"updatedAt": at(1)}, "LEGACY": {}})
+
+    scan = IncrementalScan(db, "job")
+    docs = {doc.id: doc for doc in scan}
+    scan.mark_failed(docs["LEGACY"])
+    scan.commit()
+
+    assert load_watermark(db, "job") is None  # Next run is a full scan again, which retries LEGACY
+    assert scanned_ids(IncrementalScan(db, "job")) == ["A", "LEGACY"]
+
+
+def test_own_writes_are_not_selected_again(db):
+    db.load("songs", {"A": {"updatedAt": at(1)}, "B": {"updatedAt": at(2)}})
+    save_watermark(db, "job", at(0))
+    save_watermark(db, "other_job", at(0))
+
+    scan = IncrementalScan(db, "job")
+    with BatchedWriter(db) as writer:
+        for doc in scan:
+            writer.update(doc.reference, touch({"derived": True}, scan.job_name))
+    scan.commit()
+
+    again = IncrementalScan(db, "job")
+    assert scanned_ids(again) == []
+    assert again.skipped_own == 2
+    again.commit()
+    assert load_watermark(db, "job") > at(2)  # Moved past the job's own writes
+
+    assert scanned_ids(IncrementalScan(db, "other_job")) == ["A", "B"]  # Other jobs still see them
+    assert scanned_ids(IncrementalScan(db, "job", full=True)) == ["A", "B"]
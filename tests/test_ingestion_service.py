@@ -0,0 +1,128 @@
+import json
+import time
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import Ingestion_Service as service
+from Metrics import ContextThreadPoolExecutor
+
+
+# Pytest puts its own sys.stdout back between fixture setup and the test, so the app (whose lifespan
+# installs the job output router) is started inside each test
+@pytest.fixture
+def app(metrics):
+    return lambda: TestClient(service.app)
+
+
+def wait_for(client, job_id):
+    for _ in range(200):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in service.FINISHED:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def events(client, job_id):
+    response = client.get(f"/jobs/{job_id}/events")
+    return [(block.split("\n")[1][len("event: "):], json.loads(block.split("\n")[2][len("data: "):]))
+            for block in response.text.strip().split("\n\n") if block.startswith("id:")]
+
+
+def test_output_of_inner_pool_threads_reaches_the_job(app, monkeypatch):
+    def run_bpm(params):
+        print("starting")
+        with ContextThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(lambda i: print(f"worker {i}"), range(2)))
+        return {"ok": True}
+
+    monkeypatch.setitem(service.JOB_KINDS, "bpm", ("batch", run_bpm))
+    with app() as client:
+        job = client.post("/jobs/bpm").json()
+        assert wait_for(client, job["id"])["result"] == {"ok": True}
+        logs = [data for event, data in events(client, job["id"]) if event == "log"]
+
+    assert logs[0] == "starting" and sorted(logs[1:]) == ["worker 0", "worker 1"]
+
+
+def test_failed_job_reports_its_error(app, monkeypatch):
+    def run_lyrics(params):
+        raise RuntimeError(f"no lyrics for {params['songIds']}")
+
+    monkeypatch.setitem(service.JOB_KINDS, "lyrics", ("enrich", run_lyrics))
+    with app() as client:
+        job = client.post("/jobs/lyrics", json={"songIds": ["A"]}).json()
+        finished = wait_for(client, job["id"])
+        prometheus = client.get("/metrics").text
+
+    assert finished["status"] == "failed" and finished["error"] == "no lyrics for ['A']"
+    assert 'queuemue_jobs_total{kind="lyrics",status="failed"} 1' in prometheus
+
+
+def test_invalid_requests_are_rejected(app):
+    with app() as client:
+        assert client.post("/songs", json={"urls": ["  "]}).status_code == 400
+        assert client.post("/mp3?filename=song.wav", content=b"x").status_code == 400
+        assert client.post("/mp3?filename=song.mp3", content=b"").status_code == 400
+        assert client.post("/jobs/unknown").status_code == 404
+        assert client.get("/jobs/nope").status_code == 404
+        assert client.get("/health").json()["batch"] == {"queued": 0, "workers": service.POOL_SIZES["batch"]}
+
+
+def test_mp3_body_is_spooled_off_the_event_loop(app, monkeypatch):
+    calls = []
+
+    def on_event_loop():
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    class RecordingFile:
+        def __init__(self, path, mode):
+            calls.append(("open", on_event_loop()))
+            self.file = open(path, mode)
+
+        def write(self, data):
+            calls.append(("write", on_event_loop()))
+            return self.file.write(data)
+
+        def close(self):
+            calls.append(("close", on_event_loop()))
+            self.file.close()
+
+    def run_mp3(params):
+        with open(params["path"], "rb") as f:
+            return {"size": len(f.read()), "fileName": params["fileName"]}
+
+    monkeypatch.setattr(service, "open", RecordingFile, raising=False)
+    monkeypatch.setitem(service.JOB_KINDS, "mp3", ("audio", run_mp3))
+    with app() as client:
+        job = client.post("/mp3?filename=song.mp3", content=b"x" * 100_000).json()
+        assert wait_for(client, job["id"])["result"] == {"size": 100_000, "fileName": "song.mp3"}
+
+    assert calls[0] == ("open", False) and calls[-1] == ("close", False)
+    assert not any(on_loop for _, on_loop in calls)
+
+
+def test_job_keeps_only_its_latest_events(app, monkeypatch):
+    def run_bpm(params):
+        for i in range(20):
+            print(f"line {i}")
+        return {}
+
+    monkeypatch.setattr(service, "MAX_JOB_EVENTS", 5)
+    monkeypatch.setitem(service.JOB_KINDS, "bpm", ("batch", run_bpm))
+    with app() as client:
+        job = client.post("/jobs/bpm").json()
+        finished = wait_for(client, job["id"])
+        response = client.get(f"/jobs/{job['id']}/events")
+        last_event = events(client, job["id"])[-1]
+
+    assert finished["events"] == 23  # queued, running, 20 lines, done
+    ids = [int(line[len("id: "):]) for line in response.text.split("\n") if line.startswith("id: ")]
+    assert ids == [19, 20, 21, 22, 23]
+    assert last_event[1]["status"] == "done"
@@ -0,0 +1,118 @@
+import json
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+
+import Lyrics_Fill_Batch as lyrics
+from Lyrics_Fill_Batch import LyricsMissCache
+
+
+# Minimal lyrics.ovh: answers each title from a list of statuses (then 404), 200s carry lyrics
+class LyricsServer:
+    def __init__(self, answers):
+        self.answers = {title: list(statuses) for title, statuses in answers.items()}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                title = unquote(self.path.rsplit("/", 1)[-1])
+                server.requests.append(title)
+                statuses = server.answers.get(title, [])
+                status = statuses.pop(0) if statuses else 404
+                data = json.dumps({"lyrics": f"la la {title}"} if status == 200 else {"error": "No lyrics"}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def lyrics_server(monkeypatch, tmp_path):
+    servers = []
+    monkeypatch.setattr(lyrics, "LyricsMissCache", partial(LyricsMissCache, str(tmp_path / "misses.sqlite")))
+
+    def start(answers):
+        servers.append(LyricsServer(answers))
+        port = servers[-1].httpd.server_port
+        monkeypatch.setattr(lyrics, "LYRICS_API_URL", f"http://127.0.0.1:{port}/v1/{{artist}}/{{title}}")
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def seed_songs(db):
+    db.load("songs", {
+        "BUSY": {"title": "Busy", "artistName": "Adele", "lyrics": ""},
+        "UNKNOWN": {"title": "Unknown", "artistName": "Adele", "lyrics": ""},
+    })
+
+
+def test_server_errors_are_retried(db, lyrics_server):
+    seed_songs(db)
+    server = lyrics_server({"Busy": [503, 200]})
+
+    lyrics.fill_lyrics_for_songs(["BUSY"])
+
+    assert server.requests == ["Busy", "Busy"]
+    assert db.collections["songs"]["BUSY"]["lyrics"] == "la la Busy"
+    assert db.collections["songs"]["BUSY"]["needsLyrics"] is False
+
+
+def test_not_found_songs_are_not_queried_again_until_asked(db, lyrics_server):
+    seed_songs(db)
+    server = lyrics_server({})
+
+    lyrics.fill_lyrics_for_songs(["UNKNOWN"])
+    lyrics.fill_lyrics_for_songs(["UNKNOWN"])
+    assert server.requests == ["Unknown"]
+
+    lyrics.fill_lyrics_for_songs(["UNKNOWN"], retry_misses=True)
+    assert server.requests == ["Unknown", "Unknown"]
+
+
+def test_concurrent_jobs_keep_each_others_misses(tmp_path):
+    path = str(tmp_path / "misses.sqlite")
+    first, second = LyricsMissCache(path), LyricsMissCache(path)
+    first.add("Adele", "Hello")
+    second.add("Sia", "Chandelier")
+    assert first.contains("sia", "chandelier ")  # Visible to the other job at once
+    first.close()
+    second.close()
+
+    reopened = LyricsMissCache(path)
+    assert reopened.contains("Adele", "Hello") and reopened.contains("Sia", "Chandelier")
+    reopened.discard("Adele", "Hello")
+    assert not reopened.contains("Adele", "Hello")
+    assert not LyricsMissCache(path, ttl=0).contains("Sia", "Chandelier")  # Expired
+
+
+def test_unreadable_song_chunk_does_not_abort_the_others(db, monkeypatch):
+    db.load("songs", {f"S{i}": {"title": f"Song {i}"} for i in range(4)})
+    get_all = lyrics.get_all
+
+    def failing_get_all(client, refs, field_paths=None):
+        if refs[0].id == "S0":
+            raise RuntimeError("deadline exceeded")
+        return get_all(client, refs, field_paths)
+
+    monkeypatch.setattr(lyrics, "GET_ALL_CHUNK", 2)
+    monkeypatch.setattr(lyrics, "get_all", failing_get_all)
+    assert sorted(lyrics.get_songs(["S0", "S1", "S2", "S3"])) == ["S2", "S3"]
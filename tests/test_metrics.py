@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from Metrics import Histogram, Registry, count_docs, job_run, timed, timed_stream
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram(buckets=(0.1, 1, 10))
+    for value in (0.05, 0.05, 0.5, 20):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1
+    assert histogram.quantile(1.0) == float("inf")
+
+
+def test_timed_counts_errors(metrics):
+    with timed("op.ok"):
+        pass
+    with pytest.raises(ValueError):
+        with timed("op.bad"):
+            raise ValueError()
+
+    counters = {(c["name"], c["labels"]["op"]): c["value"] for c in metrics.snapshot()["counters"]}
+    assert counters == {("operation_errors", "op.bad"): 1}
+    assert sorted(h["labels"]["op"] for h in metrics.snapshot()["histograms"]) == ["op.bad", "op.ok"]
+
+
+def test_timed_stream_counts_documents_read_even_when_stopped_early(metrics):
+    stream = timed_stream("firestore.query", iter(range(10)))
+    assert [next(stream) for _ in range(3)] == [0, 1, 2]
+    stream.close()
+    assert metrics.counters[Registry._key("documents_read", {"op": "firestore.query"})] == 3
+
+
+def test_drain_and_merge_carry_worker_measurements(metrics):
+    worker = Registry()
+    worker.observe("operation_seconds", 0.2, op="audio.decode")
+    worker.inc("documents_read", 2, op="x")
+    metrics.merge(worker.drain())
+    metrics.merge({"histograms": [], "counters": [{"name": "documents_read", "labels": {"op": "x"}, "value": 1}]})
+
+    assert worker.snapshot() == {"histograms": [], "counters": []}
+    assert metrics.counters[Registry._key("documents_read", {"op": "x"})] == 3
+    assert metrics.histograms[Registry._key("operation_seconds", {"op": "audio.decode"})].count == 1
+
+
+def test_prometheus_text(metrics):
+    metrics.observe("operation_seconds", 0.02, op='say "hi"')
+    count_docs("scan", read=5)
+    text = metrics.to_prometheus({"job": "bpm"})
+
+    assert "# TYPE queuemue_operation_seconds histogram" in text
+    assert 'queuemue_operation_seconds_bucket{job="bpm",op="say \\"hi\\"",le="0.025"} 1' in text
+    assert 'queuemue_operation_seconds_count{job="bpm",op="say \\"hi\\""} 1' in text
+    assert 'queuemue_documents_read_total{job="bpm",op="scan"} 5' in text
+    assert "documents_written" not in text  # Zero increments are not recorded
+
+
+def test_job_run_writes_reports_for_failed_runs(metrics, tmp_path):
+    with pytest.raises(RuntimeError):
+        with job_run("bpm", metrics_dir=str(tmp_path)):
+            count_docs("scan", read=1)
+            raise RuntimeError("boom")
+
+    with open(tmp_path / "bpm.jsonl", encoding="utf-8") as f:
+        report = json.loads(f.read())
+    assert report["job"] == "bpm" and report["status"] == "failed"
+    assert report["counters"] == [{"name": "documents_read", "labels": {"op": "scan"}, "value": 1}]
+    assert 'queuemue_job_success{job="bpm"} 0' in (tmp_path / "bpm.prom").read_text(encoding="utf-8")
@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+from Audio_Analysis import FEATURES_VERSION, features_current
+from Benchmark_Fakes import write_silent_mp3
+from Feature_Store import FeatureStore, file_hashes
+
+import MP3_Upload
+
+
+@pytest.fixture
+def folder(db, bucket, tmp_path):
+    db.load("songs", {
+        "HELLO": {"title": "Hello", "artistName": "Adele", "duration": 30, "audioUrl": ""},
+        "CHANDELIER": {"title": "Chandelier", "artistName": "Sia", "duration": 30, "audioUrl": ""},
+    })
+    path = tmp_path / "mp3"
+    path.mkdir()
+    write_silent_mp3(str(path / "hello.mp3"), "Hello", "Adele", seconds=30)
+    write_silent_mp3(str(path / "chandelier.mp3"), "Chandelier", "Sia", seconds=30)
+    return path
+
+
+def read_checkpoint(folder):
+    with open(folder / "logs" / "upload_checkpoint.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_logs_and_checkpoint_follow_the_folder(db, folder):
+    MP3_Upload.upload_all(str(folder), workers=2)
+
+    assert sorted(os.listdir(folder / "logs")) == ["failed_log.txt", "upload_checkpoint.json", "uploaded_log.txt"]
+    assert sorted(read_checkpoint(folder)) == sorted(os.path.abspath(folder / name)
+                                                     for name in ("chandelier.mp3", "hello.mp3"))
+    assert db.collections["songs"]["HELLO"]["audioUrl"].endswith("songs/hello.mp3")
+
+
+def test_failed_update_is_not_checkpointed(db, folder):
+    db.fail_writes = lambda path: path == "songs/HELLO"
+    MP3_Upload.upload_all(str(folder), workers=1, flush_size=1)
+
+    assert list(read_checkpoint(folder)) == [os.path.abspath(folder / "chandelier.mp3")]
+    with open(folder / "logs" / "failed_log.txt", encoding="utf-8") as f:
+        failed = f.read().splitlines()[1:]
+    assert failed == ["hello.mp3 -> ERROR: Firestore update failed"]
+
+
+def test_unchanged_blob_is_made_public_again(db, bucket, folder):
+    MP3_Upload.upload_all(str(folder))
+    os.remove(folder / "logs" / "upload_checkpoint.json")
+    bucket.rpc.reset()
+
+    MP3_Upload.upload_all(str(folder))
+    calls = bucket.rpc.snapshot()
+    assert calls.get("storage.upload", 0) == 0
+    assert calls["storage.acl"] == 2
+
+
+def test_index_errors_are_raised(folder, monkeypatch):
+    def unreachable(db):
+        raise ConnectionError("offline")
+    monkeypatch.setattr(MP3_Upload, "build_song_index", unreachable)
+
+    with pytest.raises(ConnectionError):
+        MP3_Upload.upload_all(str(folder))
+
+
+@pytest.fixture
+def feature_store(tmp_path, monkeypatch):
+    store = FeatureStore(path=str(tmp_path / "features.sqlite"))
+    monkeypatch.setattr(MP3_Upload, "feature_store", store)
+    yield store
+    store.close()
+
+
+def test_cached_features_are_written_like_bpm_update_writes_them(db, folder, feature_store):
+    features = {"bpm": 120, "featuresVersion": FEATURES_VERSION, "key": "A", "mode": "minor", "beats": [0.5, 1.0]}
+    feature_store.put(*file_hashes(str(folder / "hello.mp3")), features)
+    feature_store.put(*file_hashes(str(folder / "chandelier.mp3")), {"bpm": 90, "featuresVersion": 0})
+
+    MP3_Upload.upload_all(str(folder))
+
+    hello = db.collections["songs"]["HELLO"]
+    assert hello["featuresVersion"] == FEATURES_VERSION and hello["audioFeatures"] == {"key": "A", "mode": "minor"}
+    assert hello["bpm"] == 120 and hello["needsBpm"] is False
+    assert db.collections["audio_features"]["HELLO"] == features
+    assert not features_current(db.collections["songs"]["CHANDELIER"])  # Older features: only the BPM
+    assert db.collections["songs"]["CHANDELIER"]["bpm"] == 90
+    assert "CHANDELIER" not in db.collections["audio_features"]
+
+
+def test_failed_features_write_is_not_checkpointed(db, folder, feature_store):
+    feature_store.put(*file_hashes(str(folder / "hello.mp3")), {"bpm": 120, "featuresVersion": FEATURES_VERSION})
+    db.fail_writes = lambda path: path == "audio_features/HELLO"
+    MP3_Upload.upload_all(str(folder), flush_size=1)
+
+    assert list(read_checkpoint(folder)) == [os.path.abspath(folder / "chandelier.mp3")]
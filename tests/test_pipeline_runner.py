@@ -0,0 +1,42 @@
+import threading
+
+from Pipeline_Runner import Step, run_pipeline
+
+
+def test_results_flow_to_dependent_steps():
+    report = run_pipeline([
+        Step("sum", lambda numbers, offset: sum(numbers) + offset, after=["numbers", "offset"]),
+        Step("numbers", lambda: [1, 2, 3]),
+        Step("offset", lambda: 10),
+    ])
+    assert list(report) == ["sum", "numbers", "offset"]  # Reported in declaration order
+    assert report["sum"][0] == "ok" and report["sum"][2] == 16
+
+
+def test_independent_steps_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    report = run_pipeline([Step("a", barrier.wait), Step("b", barrier.wait)], workers=2)
+    assert [status for status, _, _ in report.values()] == ["ok", "ok"]
+
+
+def test_failure_skips_only_dependent_steps():
+    def broken():
+        raise RuntimeError("boom")
+
+    report = run_pipeline([
+        Step("broken", broken),
+        Step("after_broken", lambda broken: None, after=["broken"]),
+        Step("transitive", lambda after_broken: None, after=["after_broken"]),
+        Step("independent", lambda: "fine"),
+    ])
+    assert {name: status for name, (status, _, _) in report.items()} == {
+        "broken": "failed", "after_broken": "skipped", "transitive": "skipped", "independent": "ok"}
+
+
+def test_missing_and_cyclic_dependencies_are_skipped():
+    report = run_pipeline([
+        Step("orphan", lambda ghost: None, after=["ghost"]),
+        Step("x", lambda y: None, after=["y"]),
+        Step("y", lambda x: None, after=["x"]),
+    ])
+    assert [status for status, _, _ in report.values()] == ["skipped"] * 3
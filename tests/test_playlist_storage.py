@@ -0,0 +1,102 @@
+from Firestore_Writer import BatchedWriter
+from Playlist_Storage import (MIGRATION_FAILED, drop_legacy_subcollections, load_playlist, migrate_playlists,
+                              write_chunked_playlist)
+
+SONG_IDS = [f"S{i:05d}" for i in range(2500)]  # 3 chunks
+
+
+def write(db, playlist_id, song_ids, stored=None):
+    with BatchedWriter(db) as writer:
+        return write_chunked_playlist(writer, db.collection("system_playlists").document(playlist_id), "Rock",
+                                      song_ids, stored=stored)
+
+
+def stored_parent(db, playlist_id):
+    return db.collections["system_playlists"][playlist_id]
+
+
+def test_rebuild_writes_and_reloads_only_changed_chunks(db):
+    assert write(db, "rock", SONG_IDS) == 3
+    playlist = load_playlist(db, "rock")
+    assert playlist["songIds"] == SONG_IDS and playlist["version"] == 1
+
+    assert write(db, "rock", SONG_IDS, stored_parent(db, "rock")) is None  # Unchanged
+    assert write(db, "rock", SONG_IDS[:-1], stored_parent(db, "rock")) == 1  # Only the last chunk changed
+
+    db.rpc.reset()
+    reloaded = load_playlist(db, "rock", cached=playlist)
+    assert reloaded["songIds"] == SONG_IDS[:-1] and reloaded["version"] == 2
+    assert db.rpc.snapshot()["docsRead"] == 2  # Parent + the changed chunk
+
+    db.rpc.reset()
+    assert load_playlist(db, "rock", cached=reloaded) is reloaded
+    assert db.rpc.snapshot()["docsRead"] == 1
+
+
+def seed_legacy(db, playlist_id, song_ids):
+    db.load("system_playlists", {playlist_id: {"name": playlist_id.capitalize(), "numSongs": len(song_ids)}})
+    db.load(f"system_playlists/{playlist_id}/songs", {
+        song_id: {"songId": song_id, "isLast": i == 0} for i, song_id in enumerate(song_ids)})
+
+
+def test_migration_keeps_the_client_order(db):
+    seed_legacy(db, "pop", ["B", "A", "C"])  # B is the isLast song
+    assert migrate_playlists(db, drop_subcollections=True) == set()
+    assert load_playlist(db, "pop")["songIds"] == ["A", "C", "B"]
+    assert db.count("system_playlists/pop/songs") == 0
+
+
+def test_failed_migration_is_retried_and_not_dropped(db):
+    seed_legacy(db, "pop", ["A", "B"])
+    seed_legacy(db, "rock", SONG_IDS)
+    db.fail_writes = lambda path: path == "system_playlists/rock/chunks/0001"
+
+    assert migrate_playlists(db, drop_subcollections=True) == {"rock"}
+    rock = stored_parent(db, "rock")
+    assert rock["etag"] == "" and rock[MIGRATION_FAILED] is True
+    assert db.count("system_playlists/rock/songs") == len(SONG_IDS)  # Not dropped
+    assert db.count("system_playlists/pop/songs") == 0
+    assert load_playlist(db, "rock")["songIds"] == sorted(SONG_IDS[1:]) + [SONG_IDS[0]]  # Still the subcollection
+
+    # A chunked rebuild does not take the incomplete chunks as up to date
+    with BatchedWriter(db) as writer:
+        assert write_chunked_playlist(writer, db.collection("system_playlists").document("rock"), "Rock",
+                                      SONG_IDS[1:] + SONG_IDS[:1], stored=dict(rock)) is not None
+
+    db.fail_writes = None
+    db.collections["system_playlists"]["rock"] = dict(rock)  # Undo the rebuild: only the migration can repair it
+    assert migrate_playlists(db, drop_subcollections=True) == set()
+    assert MIGRATION_FAILED not in stored_parent(db, "rock")
+    assert load_playlist(db, "rock")["songIds"] == SONG_IDS[1:] + SONG_IDS[:1]
+    assert db.count("system_playlists/rock/songs") == 0
+
+
+def test_partly_failed_chunked_rebuild_stays_readable(db):
+    from System_Playlists_Update import write_playlists
+
+    write_playlists({"rock": ("Rock", SONG_IDS)}, storage="chunked")
+    db.fail_writes = lambda path: path == "system_playlists/rock/chunks/0001"
+    rebuilt = ["NEW"] + SONG_IDS  # Shifts every chunk
+    write_playlists({"rock": ("Rock", rebuilt)}, storage="chunked")
+    assert stored_parent(db, "rock")["etag"] == ""
+
+    playlist = load_playlist(db, "rock")  # Chunk 0001 still holds the previous build's songs
+    assert playlist["songIds"] == rebuilt[:1000] + SONG_IDS[1000:2000] + rebuilt[2000:]
+
+    db.fail_writes = None
+    write_playlists({"rock": ("Rock", rebuilt)}, storage="chunked")
+    assert load_playlist(db, "rock", cached=playlist)["songIds"] == rebuilt
+
+
+def test_drop_subcollections_alone_does_not_migrate(db):
+    seed_legacy(db, "pop", ["A", "B"])
+    seed_legacy(db, "rock", ["C"])
+    assert migrate_playlists(db) == set()
+    seed_legacy(db, "jazz", ["D"])  # Not migrated yet
+    db.collections["system_playlists"]["rock"][MIGRATION_FAILED] = True
+
+    assert drop_legacy_subcollections(db) == 2
+    assert db.count("system_playlists/pop/songs") == 0
+    assert db.count("system_playlists/rock/songs") == 1
+    assert db.count("system_playlists/jazz/songs") == 1
+    assert "format" not in stored_parent(db, "jazz")
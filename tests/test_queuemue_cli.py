@@ -0,0 +1,58 @@
+import os
+import sys
+import types
+import subprocess
+
+import pytest
+
+import QueueMue_CLI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["Firebase_Setup", "firebase_admin", "librosa", "fastapi", "sentence_transformers", "torch"]
+
+
+def fake_script(calls):
+    module = types.ModuleType("script")
+    module.cli = lambda argv, prog: calls.append((argv, prog))
+    return module
+
+
+def test_command_gets_its_own_arguments(monkeypatch):
+    calls, imported = [], []
+    monkeypatch.setattr(QueueMue_CLI.importlib, "import_module",
+                        lambda name: imported.append(name) or fake_script(calls))
+
+    QueueMue_CLI.main(["bpm", "--analysis-workers", "6", "--full"])
+
+    assert imported == ["BPM_Update"]
+    (argv, prog), = calls
+    assert argv == ["--analysis-workers", "6", "--full"] and prog.endswith(" bpm")
+
+
+def test_script_without_extension_is_loaded_by_file_name(monkeypatch):
+    import Pipeline_Runner
+    calls, loaded = [], []
+    monkeypatch.setattr(Pipeline_Runner, "load_script", lambda name: loaded.append(name) or fake_script(calls))
+
+    QueueMue_CLI.main(["embeddings", "--full"])
+    assert loaded == ["Songs_Embadding"] and calls[0][0] == ["--full"]
+
+
+def test_unknown_command_is_rejected():
+    with pytest.raises(SystemExit):
+        QueueMue_CLI.main(["nope"])
+
+
+# BPM analysis imports librosa only in its analyzer processes, and the report Firebase only for Firestore sources
+@pytest.mark.parametrize("command", ["", "bpm", "report", "similarity"])
+def test_help_does_not_import_heavy_dependencies(command):
+    code = ("import sys, QueueMue_CLI\n"
+            "try:\n"
+            f"    QueueMue_CLI.main([c for c in [{command!r}, '--help'] if c])\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            f"print('loaded:', *sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + sys.path))
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.strip().splitlines()[-1] == "loaded:"
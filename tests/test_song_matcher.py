@@ -0,0 +1,65 @@
+from Song_Matcher import SongIndex, build_song_index, normalize
+
+
+def test_normalize_strips_accents_and_suffixes():
+    assert normalize("Café (Remastered 2011)") == "cafe"
+    assert normalize("Hello - Radio Edit") == "hello"
+    assert normalize("(Intro)") == "intro"  # Nothing left without the brackets: keep them
+
+
+def test_match_tolerates_variants_and_checks_duration():
+    index = SongIndex()
+    index.add("HELLO", "Hello", "Adele", 295)
+    index.add("HELLO_LIVE", "Hello World", "Someone Else", 200)
+    index.add("CHANDELIER", "Chandelier", "Sia", 216)
+
+    assert index.match("Hello (Remastered)", "Adele", 296) == ("HELLO", 1.0)
+    assert index.match("Chandelir", "Sia", 216)[0] == "CHANDELIER"
+    assert index.match("Chandelier", "Sia", 100) == (None, "DURATION MISMATCH")
+    assert index.match("Nothing Like It") == (None, "NO CANDIDATE")
+    assert index.match("") == (None, "EMPTY TITLE")
+
+
+def test_match_rejects_ambiguous_titles():
+    index = SongIndex()
+    index.add("A", "Intro")
+    index.add("B", "Intro")
+    song_id, reason = index.match("Intro")
+    assert song_id is None and reason.startswith("AMBIGUOUS")
+
+
+def test_build_song_index_skips_missing_titles(db):
+    db.load("songs", {
+        "HELLO": {"title": "Hello", "artistName": "Adele", "duration": 295},
+        "UNTITLED": {"title": None, "artistName": "Adele"},
+    })
+    index = build_song_index(db)
+    assert len(index) == 1
+    assert index.match("hello")[0] == "HELLO"
+
+
+def test_unique_exact_title_matches_despite_odd_artist_tag():
+    index = SongIndex()
+    index.add("HELLO", "Hello", "Adele", 295)
+    index.add("HELLO_WORLD", "Hello World", "Someone Else", 200)
+
+    song_id, score = index.match("Hello", "Track 01 - Unknown", 295)
+    assert song_id == "HELLO" and score < 0.75
+
+
+def test_unique_exact_title_matches_without_artist_tag():
+    index = SongIndex()
+    index.add("CHANDELIER", "Chandelier", "Sia", 216)
+    index.add("CHANDELIERS", "Chandeliers", "Other", 216)
+
+    assert index.match("Chandelier", None, 216) == ("CHANDELIER", 1.0)
+    assert index.match("Chandelier", "", 100) == (None, "DURATION MISMATCH")
+
+
+def test_shared_exact_title_still_needs_the_artist():
+    index = SongIndex()
+    index.add("INTRO_A", "Intro", "Adele")
+    index.add("INTRO_B", "Intro", "Sia")
+
+    assert index.match("Intro", "Sia")[0] == "INTRO_B"
+    assert index.match("Intro", "Unknown")[0] is None
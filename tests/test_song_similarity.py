@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+
+from Metrics import METRICS_DIR
+from Song_Similarity import SimilarityIndex, cli, export_snapshot, mini_batch_kmeans, top_k
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+@pytest.fixture
+def snapshot_dir(db, tmp_path):
+    db.load("songs", {
+        "UP": {"title": "Up", "embedding": unit(1, 0, 0)},
+        "UPISH": {"title": "Up-ish", "embedding": unit(1, 0.2, 0)},
+        "SIDE": {"title": "Side", "embedding": unit(0, 1, 0)},
+        "DOWN": {"title": "Down", "embedding": unit(0, 0, 1)},
+        "NO_LYRICS": {"title": "No lyrics"},
+        "WRONG_DIM": {"title": "Wrong", "embedding": [1.0, 0.0]},
+    })
+    export_snapshot(db, str(tmp_path))
+    return str(tmp_path)
+
+
+def test_top_k_is_sorted_and_bounded():
+    scores = np.array([0.1, 0.9, 0.5])
+    assert top_k(scores, 2).tolist() == [1, 2]
+    assert top_k(scores, 10).tolist() == [1, 2, 0]
+    assert top_k(scores, 0).tolist() == []
+
+
+def test_similar_to_song_excludes_the_song(snapshot_dir):
+    index = SimilarityIndex(snapshot_dir)
+    assert index.ids == ["DOWN", "SIDE", "UP", "UPISH"]  # Songs without (valid) embeddings are skipped
+
+    results = index.similar_to_song("UP", k=2)
+    assert [song_id for song_id, _, _ in results] == ["UPISH", "SIDE"]
+    with pytest.raises(KeyError):
+        index.similar_to_song("NO_LYRICS")
+
+
+@pytest.mark.parametrize("kind", ["int8", "ivf"])
+def test_approximate_indexes_agree_with_exact_search(snapshot_dir, kind):
+    index = SimilarityIndex(snapshot_dir)
+    getattr(index, f"build_{kind}")()
+    expected = [song_id for song_id, _, _ in index.search(unit(1, 0.1, 0), k=2)]
+    assert [song_id for song_id, _, _ in index.search(unit(1, 0.1, 0), k=2, index=kind, nprobe=4)] == expected
+
+
+def test_empty_snapshot_returns_no_results(db, tmp_path):
+    export_snapshot(db, str(tmp_path))
+    index = SimilarityIndex(str(tmp_path))
+    assert index.search(unit(1, 0, 0)) == []
+    index.build_ivf()  # Nothing to index, no error
+
+
+def test_kmeans_warm_start_keeps_cluster_identity():
+    rng = np.random.default_rng(0)
+    data = np.concatenate([rng.normal(0, 0.05, (50, 2)), rng.normal(5, 0.05, (50, 2))]).astype(np.float32)
+    init = np.array([[5, 5], [0, 0]], dtype=np.float32)
+    centers = mini_batch_kmeans(data, 2, batch_size=32, iterations=20, init_centers=init)
+    assert np.allclose(centers, init, atol=0.2)
+
+
+def test_cli_runs_as_a_measured_job(db, capsys):
+    db.load("songs", {"UP": {"title": "Up", "embedding": unit(1, 0, 0)},
+                      "UPISH": {"title": "Up-ish", "embedding": unit(1, 0.2, 0)}})
+    cli(["--export", "--song", "UP", "-k", "1"])
+
+    assert "Up-ish (UPISH)" in capsys.readouterr().out
+    assert os.path.exists(os.path.join(METRICS_DIR, "song_similarity.jsonl"))
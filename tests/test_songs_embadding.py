@@ -0,0 +1,66 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from Pipeline_Runner import load_script
+
+embeddings = load_script("Songs_Embadding")
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size, normalize_embeddings, convert_to_numpy):
+        self.calls.append((list(texts), batch_size))
+        return np.asarray([[len(text), 1.0, 0.0] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    fake = FakeModel()
+    monkeypatch.setattr(embeddings, "model", fake)
+    monkeypatch.setattr(embeddings, "ENCODE_CHUNK_SIZE", 2)
+    return fake
+
+
+def test_embeds_changed_lyrics_in_length_sorted_chunks(db, model):
+    db.load("songs", {
+        "LONG": {"title": "Long", "lyrics": "a much longer verse", "updatedAt": T0},
+        "SHORT": {"title": "Short", "lyrics": "hi", "updatedAt": T0},
+        "MID": {"title": "Mid", "lyrics": "la la la", "updatedAt": T0},
+        "NONE": {"title": "None", "lyrics": "", "updatedAt": T0},
+        "DONE": {"title": "Done", "lyrics": "same", "embeddingSourceHash": embeddings.lyrics_hash("same"),
+                 "updatedAt": T0},
+    })
+
+    embeddings.update_song_embeddings(batch_size=8)
+
+    assert model.calls == [(["hi", "la la la"], 8), (["a much longer verse"], 8)]
+    songs = db.collections["songs"]
+    assert songs["SHORT"]["embedding"] == [2.0, 1.0, 0.0]
+    assert songs["LONG"]["embeddingSourceHash"] == embeddings.lyrics_hash("a much longer verse")
+    assert "embedding" not in songs["DONE"] and "embedding" not in songs["NONE"]
+
+
+def test_next_run_resumes_with_failed_and_changed_songs_only(db, model):
+    db.load("songs", {
+        "A": {"title": "A", "lyrics": "first", "updatedAt": T0},
+        "B": {"title": "B", "lyrics": "second", "updatedAt": T0},
+    })
+    db.fail_writes = lambda path: path == "songs/B"
+    embeddings.update_song_embeddings()
+    assert "embedding" in db.collections["songs"]["A"]
+
+    db.fail_writes = None
+    model.calls.clear()
+    embeddings.update_song_embeddings()
+    assert model.calls == [(["second"], embeddings.DEFAULT_BATCH_SIZE)]  # A is not re-selected or re-encoded
+
+    model.calls.clear()
+    embeddings.update_song_embeddings()
+    assert model.calls == []
+    assert "embedding" in db.collections["songs"]["B"]
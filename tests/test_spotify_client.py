@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+import Spotify_Client
+from Spotify_Client import SpotifyClient, TokenBucket, create_spotify
+
+
+class FakeSpotipy:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def tracks(self, ids, market=None):
+        self.calls.append(("tracks", list(ids)))
+        time.sleep(self.delay)
+        return {"tracks": [{"id": track_id, "name": f"Song {track_id}"} for track_id in ids]}
+
+    def artists(self, ids):
+        self.calls.append(("artists", list(ids)))
+        return {"artists": [{"id": artist_id, "genres": ["pop"]} for artist_id in ids]}
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "spotify_cache.sqlite")
+
+
+def test_cached_objects_are_not_requested_again(cache_path):
+    sp = FakeSpotipy()
+    client = SpotifyClient(sp, cache_path)
+    client.tracks(["a", "b"])
+    assert client.tracks(["b", "c", "a"])["tracks"][1] == {"id": "c", "name": "Song c"}
+    assert sp.calls == [("tracks", ["a", "b"]), ("tracks", ["c"])]
+    assert client.metrics["hits"] == 2 and client.metrics["misses"] == 3
+
+    # The cache file outlives the client
+    assert SpotifyClient(sp, cache_path).track("a") == {"id": "a", "name": "Song a"}
+    assert len(sp.calls) == 2
+
+
+def test_expired_objects_are_requested_again(cache_path, monkeypatch):
+    sp = FakeSpotipy()
+    client = SpotifyClient(sp, cache_path)
+    client.artist("x")
+    client.track("t")
+
+    now = time.time()
+    monkeypatch.setattr(Spotify_Client.time, "time", lambda: now + Spotify_Client.ARTIST_TTL + 1)
+    client.artist("x")  # Artists expire first
+    client.track("t")
+    assert sp.calls == [("artists", ["x"]), ("tracks", ["t"]), ("artists", ["x"])]
+
+
+def test_concurrent_requests_for_the_same_object_are_coalesced(cache_path):
+    sp = FakeSpotipy(delay=0.2)
+    client = SpotifyClient(sp, cache_path)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.track("same"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sp.calls == [("tracks", ["same"])]
+    assert results == [{"id": "same", "name": "Song same"}] * 4
+    assert client.metrics["coalesced"] == 3
+
+
+def test_token_bucket_pause_holds_every_request():
+    bucket = TokenBucket(rate=1000, burst=1000)
+    bucket.pause(0.2)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.19
+
+
+# Minimal Spotify Web API: answers from a list of (status, headers, body), then 200s
+class SpotifyServer:
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                status, headers, body = server.answers.pop(0) if server.answers else (200, {}, {"tracks": [
+                    {"id": "t1", "name": "Song"}]})
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in {"Content-Type": "application/json", **headers}.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/v1/"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StaticToken:
+    def get_access_token(self, as_dict=False):
+        return "token"
+
+
+@pytest.fixture
+def spotify_server():
+    servers = []
+
+    def start(answers):
+        servers.append(SpotifyServer(answers))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_throttled_requests_pause_the_shared_bucket(spotify_server, cache_path, monkeypatch):
+    pauses = []
+    server = spotify_server([(429, {"Retry-After": "0"}, {"error": {"status": 429, "message": "slow down"}})])
+    client = create_spotify(StaticToken(), cache_path)
+    client.sp.prefix = server.url
+    monkeypatch.setattr(client.bucket, "pause", pauses.append)
+
+    assert client.track("t1") == {"id": "t1", "name": "Song"}
+    assert server.requests == 2
+    assert client.metrics["throttles"] == 1 and pauses == [0.0]
+
+
+def test_server_errors_are_retried_by_the_session(spotify_server, cache_path):
+    server = spotify_server([(503, {"Retry-After": "0"}, {"error": {"status": 503, "message": "busy"}})] * 4)
+    client = create_spotify(StaticToken(), cache_path)
+    client.sp.prefix = server.url
+
+    with pytest.raises(SpotifyException) as error:
+        client.track("t1")
+    assert error.value.http_status == 503  # Not reported as a 429 once the retries ran out
+    assert server.requests == Spotify_Client.SPOTIPY_RETRIES + 1
+    assert client.metrics["throttles"] == 0
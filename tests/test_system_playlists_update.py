@@ -0,0 +1,109 @@
+import numpy as np
+
+import Song_Similarity
+import System_Playlists_Update as playlists
+
+
+def embedding(x, y, seed):
+    rng = np.random.default_rng(seed)
+    return (np.array([x, y, 0.0]) + rng.normal(0, 0.01, 3)).tolist()
+
+
+def test_emptied_cluster_is_written_empty(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(playlists, "CLUSTER_VECTORS_PATH", str(tmp_path / "vectors.f32"))
+    monkeypatch.setattr(playlists, "CLUSTER_CENTERS_PATH", str(tmp_path / "centers.npz"))
+    db.load("songs", {f"A{i}": {"embedding": embedding(1, 0, i), "bpm": 120} for i in range(3)})
+    db.load("songs", {f"B{i}": {"embedding": embedding(0, 1, i), "bpm": 120} for i in range(3)})
+
+    playlists.build_cluster_playlists(k=2)
+    sizes = {playlist_id: data["numSongs"] for playlist_id, data in db.collections["system_playlists"].items()}
+    assert sorted(sizes.values()) == [3, 3]
+
+    for i in range(3):
+        del db.collections["songs"][f"B{i}"]
+    playlists.build_cluster_playlists(k=2)  # Warm start: the B center keeps its cluster, now without songs
+
+    emptied = next(playlist_id for playlist_id, data in db.collections["system_playlists"].items()
+                   if data["numSongs"] == 0)
+    assert db.count(f"system_playlists/{emptied}/songs") == 0
+
+
+def test_kmeans_stops_once_centers_settle(monkeypatch):
+    calls = []
+    assign = Song_Similarity.assign_to_centers
+    monkeypatch.setattr(Song_Similarity, "assign_to_centers", lambda *args: calls.append(1) or assign(*args))
+
+    rng = np.random.default_rng(0)
+    data = np.concatenate([rng.normal(0, 0.05, (200, 2)), rng.normal(5, 0.05, (200, 2))]).astype(np.float32)
+    centers = Song_Similarity.mini_batch_kmeans(data, 2, batch_size=64, iterations=100)
+    cold_iterations = len(calls)
+
+    calls.clear()
+    Song_Similarity.mini_batch_kmeans(data, 2, batch_size=64, iterations=100, init_centers=centers)
+    assert len(calls) < cold_iterations < 100
+
+
+def seed_catalog(db):
+    db.load("genres", {"ROCK": {"name": "Rock"}, "POP": {"name": "Pop"}})
+    db.load("songs", {
+        "A": {"genreId": ["hard rock"]},
+        "B": {"genreId": ["pop", "pop rock"]},
+        "C": {"genreId": ["jazz"]},
+    })
+
+
+def members(db, playlist_id):
+    return db.collections.get(f"system_playlists/{playlist_id}/songs", {})
+
+
+def test_incremental_rebuild_writes_only_the_difference(db):
+    seed_catalog(db)
+    playlists.build_system_playlists()
+    assert sorted(members(db, "rock")) == ["A", "B"] and members(db, "rock")["B"]["isLast"]
+    assert sorted(members(db, "pop")) == ["B"]
+    assert "jazz" not in db.collections["system_playlists"]
+
+    db.rpc.reset()
+    playlists.build_system_playlists()
+    assert db.rpc.snapshot().get("docsWritten", 0) == 0  # Nothing changed
+
+    db.load("songs", {"D": {"genreId": ["rock"]}})
+    db.rpc.reset()
+    playlists.build_system_playlists()
+    assert sorted(members(db, "rock")) == ["A", "B", "D"]
+    assert members(db, "rock")["D"]["isLast"] and not members(db, "rock")["B"]["isLast"]
+    assert db.rpc.snapshot()["docsWritten"] == 3  # New member, old last member, playlist document
+
+
+def test_failed_membership_write_clears_the_hash(db):
+    seed_catalog(db)
+    db.fail_writes = lambda path: path == "system_playlists/rock/songs/B"
+    playlists.build_system_playlists()
+    assert db.collections["system_playlists"]["rock"]["songsHash"] == ""
+
+    db.fail_writes = None
+    playlists.build_system_playlists()  # Re-synced instead of skipped as unchanged
+    assert sorted(members(db, "rock")) == ["A", "B"]
+
+
+def test_genre_playlist_that_lost_its_songs_is_written_empty(db):
+    seed_catalog(db)
+    playlists.build_system_playlists()
+    assert sorted(members(db, "pop")) == ["B"]
+
+    db.load("songs", {"B": {"genreId": ["jazz"]}})
+    playlists.build_system_playlists()
+    assert members(db, "pop") == {}
+    assert db.collections["system_playlists"]["pop"]["numSongs"] == 0
+    assert db.collections["system_playlists"]["pop"]["songsHash"] == playlists.songs_hash([])
+    assert "jazz" not in db.collections["system_playlists"]  # Not in `genres`: still no playlist
+
+
+def test_emptied_genre_playlist_is_written_empty_in_chunked_storage(db):
+    from Playlist_Storage import load_playlist
+
+    seed_catalog(db)
+    playlists.build_system_playlists(storage="chunked")
+    db.load("songs", {"B": {"genreId": ["jazz"]}})
+    playlists.build_system_playlists(storage="chunked")
+    assert load_playlist(db, "pop")["songIds"] == []